@@ -0,0 +1,34 @@
+"""
+Helpers to run a ServerRuntime against benchmarks/fake_server.py instead of bedrock_server
+
+"""
+
+import os
+import sys
+
+from mc import ServerRuntime
+from benchmarks._synthetic import make_world
+
+FAKE_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_server.py")
+
+
+class FakeServerRuntime(ServerRuntime):
+    def _popen_args(self):
+        return [sys.executable, FAKE_SERVER, os.path.dirname(self.path_to_exe)]
+
+
+def make_server_root(root: str, files: int = 200, file_size: int = 64 * 1024, level_name: str = "Bedrock level"):
+    """
+    Lay out active/current the way ServerRuntime expects it, with a synthetic world
+
+    :return: path to the (placeholder) server exe
+    """
+    current = os.path.join(root, "current")
+    os.makedirs(current, exist_ok=True)
+    with open(os.path.join(current, "server.properties"), "w") as f:
+        f.write(f"level-name={level_name}\n")
+    exe = os.path.join(current, "bedrock_server.exe")
+    with open(exe, "w") as f:
+        f.write("placeholder, benchmarks run fake_server.py instead\n")
+    make_world(os.path.join(current, "worlds", level_name), files=files, file_size=file_size)
+    return exe
@@ -0,0 +1,39 @@
+"""
+Helpers to build synthetic data for the benchmarks
+
+"""
+
+import os
+import random
+
+
+def make_world(root: str, files: int = 2000, file_size: int = 64 * 1024, seed: int = 0) -> int:
+    """
+    Build a fake LevelDB world: a db/ folder full of .ldb files (half compressible, half random, roughly like real
+    chunk data) plus the handful of small files the server writes alongside them.
+
+    :return: total number of bytes written
+    """
+    rng = random.Random(seed)
+    db = os.path.join(root, "db")
+    os.makedirs(db, exist_ok=True)
+
+    total = 0
+    for i in range(files):
+        half = file_size // 2
+        data = rng.randbytes(half) + bytes([i % 251]) * (file_size - half)
+        with open(os.path.join(db, f"{i:06d}.ldb"), "wb") as f:
+            f.write(data)
+        total += len(data)
+
+    for name, size in (("CURRENT", 16), ("MANIFEST-000001", 4096), ("000003.log", 256 * 1024), ("LOCK", 0)):
+        with open(os.path.join(db, name), "wb") as f:
+            f.write(rng.randbytes(size))
+        total += size
+
+    for name, size in (("level.dat", 2048), ("level.dat_old", 2048), ("levelname.txt", 12)):
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(rng.randbytes(size))
+        total += size
+
+    return total
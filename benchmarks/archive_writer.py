@@ -0,0 +1,66 @@
+"""
+Compares the historic per-file append backup (reopening the zip in 'a' mode for every file) with the single-pass
+ArchiveWriter, across the available codecs, on a synthetic world.
+
+    python -m benchmarks.archive_writer --files 2000
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import zipfile
+
+from mc import archive
+from benchmarks._synthetic import make_world
+
+
+def legacy_append(world_path: str, dst: str):
+    # what ServerRuntime.backup used to do
+    for root, dirs, files in os.walk(world_path):
+        for file in files:
+            src = os.path.join(root, file)
+            with zipfile.ZipFile(dst, 'a', zipfile.ZIP_DEFLATED, compresslevel=9) as zip_ref:
+                zip_ref.write(src, os.path.relpath(src, world_path))
+
+
+def single_pass(world_path: str, dst: str, codec: str, level: int | None):
+    with archive.ArchiveWriter(dst, codec=codec, level=level) as writer:
+        writer.add_tree(world_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        world = os.path.join(tmp, "world")
+        total = make_world(world, files=args.files, file_size=args.file_size)
+        print(f"synthetic world: {args.files} files, {total / 1024 ** 2:.1f} MiB")
+
+        runs = [("single-pass", c, l) for c, l in (
+            ("stored", None), ("deflate", 1), ("deflate", 6), ("deflate", 9), ("lzma", None), ("zstd", 3)
+        ) if c in archive.CODECS]
+        if not args.skip_legacy:
+            runs.insert(0, ("legacy append", "deflate", 9))
+
+        for i, (name, codec, level) in enumerate(runs):
+            dst = os.path.join(tmp, f"out_{i}.zip")
+            start = time.perf_counter()
+            if name == "legacy append":
+                legacy_append(world, dst)
+            else:
+                single_pass(world, dst, codec, level)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(dst)
+            print(f"{name:>14} {codec:>8} {str(level):>4}: {elapsed:8.3f}s "
+                  f"{total / 1024 ** 2 / elapsed:8.1f} MiB/s  ratio {size / total:.3f}")
+            os.remove(dst)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Measures console command latency (send_command until the server's reply is read back) while idle and while a backup
+is running, against benchmarks/fake_server.py.
+
+    python -m benchmarks.command_latency --files 3000 --commands 200
+
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from threading import Event, Thread
+
+from benchmarks._fake_runtime import FakeServerRuntime, make_server_root
+
+
+def measure(runtime, commands: int, interval: float) -> list[float]:
+    reply = Event()
+
+    def listener(line: str):
+        if "players online" in line:
+            reply.set()
+
+    runtime.add_stdout_listener(listener)
+    latencies = []
+    try:
+        for _ in range(commands):
+            reply.clear()
+            start = time.perf_counter()
+            runtime.send_command("list")
+            if not reply.wait(10):
+                raise RuntimeError("no reply from fake server within 10s")
+            latencies.append(time.perf_counter() - start)
+            time.sleep(interval)
+    finally:
+        runtime.remove_stdout_listener(listener)
+    return latencies
+
+
+def report(name: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>16}: n={len(latencies)} p50 {statistics.median(latencies) * 1000:7.2f}ms "
+          f"p99 {p99 * 1000:7.2f}ms max {latencies[-1] * 1000:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=3000)
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["MC_BACKUP_DIR"] = os.path.join(tmp, "backup")
+        os.makedirs(os.environ["MC_BACKUP_DIR"])
+        runtime = FakeServerRuntime(make_server_root(os.path.join(tmp, "active"), files=args.files))
+        runtime.start()
+        try:
+            report("idle", measure(runtime, args.commands, args.interval))
+
+            backup_done = Event()
+
+            def run_backup():
+                try:
+                    runtime.backup().result()
+                finally:
+                    backup_done.set()
+
+            Thread(target=run_backup, daemon=True).start()
+            during = []
+            while not backup_done.is_set():
+                during.extend(measure(runtime, 10, args.interval))
+            report("during backup", during)
+            print(f"save hold lasted {runtime.last_backup_hold_seconds:.3f}s")
+        finally:
+            runtime.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Exercises downloads.download_file against a local HTTP server that supports Range requests and can drop the connection
+part way through, and compares its peak memory with the old buffered requests.get.
+
+    python -m benchmarks.download --size-mb 64 --drops 3
+
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import requests
+
+from mc import downloads
+
+
+class _Fixture:
+    def __init__(self, data: bytes, drops: int):
+        self.data = data
+        self.drops_left = drops  # connections to cut after sending half of what was asked for
+        self.requests = 0
+
+
+def _make_handler(fixture: _Fixture):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):  # noqa  # quiet
+            pass
+
+        def do_GET(self):  # noqa  # http.server naming
+            fixture.requests += 1
+            data = fixture.data
+            start = 0
+            range_header = self.headers.get("Range")
+            if range_header is not None and range_header.startswith("bytes="):
+                start = int(range_header[len("bytes="):].split("-")[0])
+                if start >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(data)}")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(data) - start))
+            self.send_header("ETag", '"fixture"')
+            self.end_headers()
+
+            end = len(data)
+            if fixture.drops_left > 0:
+                fixture.drops_left -= 1
+                end = start + (len(data) - start) // 2
+            view = memoryview(data)
+            for i in range(start, end, 256 * 1024):
+                self.wfile.write(view[i:min(i + 256 * 1024, end)])
+            if end < len(data):
+                self.close_connection = True
+                self.connection.shutdown(2)
+
+    return Handler
+
+
+def serve(fixture: _Fixture) -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(fixture))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/bedrock-server-1.0.0.1.zip"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--drops", type=int, default=3)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 1024 ** 2)
+    digest = hashlib.sha256(data).hexdigest()
+    downloads.time.sleep = lambda seconds: None  # no backoff against a local server
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # old: the whole body buffered by requests before it is written out
+        fixture = _Fixture(data, drops=0)
+        server, url = serve(fixture)
+        tracemalloc.start()
+        start = time.perf_counter()
+        r = requests.get(url)
+        with open(os.path.join(tmp, "old.zip"), "wb") as f:
+            for chunk in r.iter_content(chunk_size=1024 ** 2):
+                f.write(chunk)
+        old_seconds = time.perf_counter() - start
+        old_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del r
+        server.shutdown()
+
+        # new: streamed to a .part file
+        fixture = _Fixture(data, drops=0)
+        server, url = serve(fixture)
+        path = os.path.join(tmp, "new.zip")
+        tracemalloc.start()
+        stats = downloads.download_file(url, path, expected_sha256=digest)
+        new_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert stats is not None and stats.sha256 == digest and os.path.getsize(path) == len(data)
+        assert not os.path.exists(path + ".part")
+        server.shutdown()
+
+        print(f"{args.size_mb} MiB download")
+        print(f"  buffered requests.get: {old_seconds:6.2f}s  peak python memory {old_peak / 1024 ** 2:8.1f} MiB")
+        print(f"  download_file:         {stats.seconds:6.2f}s  peak python memory {new_peak / 1024 ** 2:8.1f} MiB"
+              f"  ({stats.throughput / 1024 ** 2:.1f} MiB/s)")
+
+        # dropped connections resume rather than starting over
+        fixture = _Fixture(data, drops=args.drops)
+        server, url = serve(fixture)
+        path = os.path.join(tmp, "resumed.zip")
+        stats = downloads.download_file(url, path, expected_sha256=digest)
+        assert stats is not None and stats.sha256 == digest and stats.resumes == args.drops
+        print(f"  {args.drops} dropped connections: {fixture.requests} requests, {stats.resumes} resumes, "
+              f"{stats.bytes_transferred / 1024 ** 2:.1f} MiB transferred for a {args.size_mb} MiB file")
+
+        # a partial file left by a previous run is picked up too, and a complete one just needs a 416
+        path = os.path.join(tmp, "leftover.zip")
+        with open(path + ".part", "wb") as f:
+            f.write(data[:len(data) // 3])
+        stats = downloads.download_file(url, path, expected_sha256=digest)
+        assert stats is not None and stats.resumes == 1 and stats.bytes_transferred == len(data) - len(data) // 3
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        stats = downloads.download_file(url, path, expected_sha256=digest)
+        assert stats is not None and stats.bytes_transferred == 0 and stats.sha256 == digest
+
+        # a hash mismatch is never promoted
+        path = os.path.join(tmp, "bad.zip")
+        assert downloads.download_file(url, path, expected_sha256="0" * 64) is None
+        assert not os.path.exists(path) and not os.path.exists(path + ".part")
+        print("  resume from a leftover .part, complete .part and hash mismatch: ok")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Measures how many console lines per second the EventParser gets through on a replayed log, compared with the naive
+approach of trying each pattern in turn.
+
+    python -m benchmarks.event_parser --lines 500000
+    python -m benchmarks.event_parser --log path/to/real.log
+
+"""
+
+import argparse
+import random
+import re
+import time
+
+from mc import events
+
+
+def synthetic_log(lines: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    stamp = "[2024-06-01 12:00:00:123 {}] {}"
+    players = [f"Player{i}" for i in range(20)]
+    templates = [
+        (50, lambda: stamp.format("INFO", "Running AutoCompaction...")),
+        (10, lambda: stamp.format("INFO", f"Player connected: {rng.choice(players)}, xuid: {rng.randrange(10 ** 16)}")),
+        (10, lambda: stamp.format("INFO", f"Player disconnected: {rng.choice(players)}, xuid: "
+                                          f"{rng.randrange(10 ** 16)}, pfid: abc")),
+        (10, lambda: stamp.format("INFO", f"Player Spawned: {rng.choice(players)} xuid: 1, pfid: abc")),
+        (5, lambda: stamp.format("ERROR", "Failed to load chunk")),
+        (5, lambda: stamp.format("INFO", "Saving...")),
+        (5, lambda: stamp.format("INFO", "Changes to the world are resumed.")),
+        (5, lambda: "[Server] hello"),
+    ]
+    weights = [w for w, _ in templates]
+    makers = [m for _, m in templates]
+    return [rng.choices(makers, weights)[0]() for _ in range(lines)]
+
+
+_naive_patterns = [
+    (re.compile(r"\[.*?\] Server started\."), "started"),
+    (re.compile(r"\[.*?\] Stopping server\.\.\."), "stopping"),
+    (re.compile(r"\[.*?\] Version:? (\d+(?:\.\d+)+)"), "version"),
+    (re.compile(r"\[.*?\] Player connected: (.+?), xuid: (\d*)"), "connected"),
+    (re.compile(r"\[.*?\] Player disconnected: (.+?), xuid: (\d*)"), "disconnected"),
+    (re.compile(r"\[.*?\] Saving\.\.\."), "held"),
+    (re.compile(r"\[.*?\] Data saved\. Files are now ready to be copied\."), "ready"),
+    (re.compile(r"\[.*?\] A previous save has not been completed\."), "not_ready"),
+    (re.compile(r"\[.*?\] Changes to the world are resumed\."), "resumed"),
+    (re.compile(r"\[.*? ERROR\] (.*)"), "error"),
+]
+
+
+def naive(lines: list[str]) -> int:
+    found = 0
+    for line in lines:
+        for pattern, _ in _naive_patterns:
+            if pattern.match(line):
+                found += 1
+                break
+    return found
+
+
+def parser(lines: list[str]) -> int:
+    p = events.EventParser()
+    p.subscribe(events.ServerEvent, lambda e: None)
+    found = 0
+    for line in lines:
+        if p.feed(line) is not None:
+            found += 1
+    return found
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--lines", type=int, default=500_000)
+    arg_parser.add_argument("--log", help="replay a real log instead of a synthetic one")
+    args = arg_parser.parse_args()
+
+    if args.log:
+        with open(args.log, "r", errors="replace") as f:
+            lines = f.readlines()
+    else:
+        lines = synthetic_log(args.lines)
+
+    for name, fn in (("naive linear scan", naive), ("EventParser", parser)):
+        start = time.perf_counter()
+        found = fn(lines)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>18}: {len(lines) / elapsed:12,.0f} lines/s ({found} events from {len(lines)} lines)")
+
+
+if __name__ == '__main__':
+    main()
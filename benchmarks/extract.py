@@ -0,0 +1,109 @@
+"""
+Compares archive.extract_archive with zipfile.extractall on a large synthetic archive shaped like a server zip (a few
+big members plus many small ones), checks both produce identical trees, and that a corrupted member is caught.
+
+    python -m benchmarks.extract --files 3000 --big-mb 64 --workers 1 4
+
+"""
+
+import argparse
+import filecmp
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+
+from mc import archive
+from benchmarks._synthetic import make_world
+
+
+def _same_tree(a: str, b: str) -> bool:
+    cmp = filecmp.dircmp(a, b)
+    if cmp.left_only or cmp.right_only or cmp.funny_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)
+    if mismatch or errors:
+        return False
+    return all(_same_tree(os.path.join(a, d), os.path.join(b, d)) for d in cmp.common_dirs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=3000)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--big-mb", type=int, default=64, help="size of the large member, like bedrock_server.exe")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs each")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src")
+        total = make_world(src, files=args.files, file_size=args.file_size)
+        rng = random.Random(1)
+        with open(os.path.join(src, "bedrock_server.exe"), "wb") as f:
+            for _ in range(args.big_mb):
+                f.write(rng.randbytes(512 * 1024) + bytes(512 * 1024))
+        total += args.big_mb * 1024 ** 2
+
+        zip_path = os.path.join(tmp, "server.zip")
+        with archive.ArchiveWriter(zip_path, codec="deflate", level=6, workers=os.cpu_count() or 1) as writer:
+            writer.add_tree(src)
+        print(f"archive: {writer.files_written} members, {total / 1024 ** 2:.1f} MiB "
+              f"({os.path.getsize(zip_path) / 1024 ** 2:.1f} MiB compressed)")
+
+        def best_of(extract) -> float:
+            times = []
+            for i in range(args.repeat):
+                out = os.path.join(tmp, f"run_{i}")
+                start = time.perf_counter()
+                extract(out)
+                times.append(time.perf_counter() - start)
+                if i < args.repeat - 1:
+                    shutil.rmtree(out)
+            return min(times)
+
+        def extractall(out: str):
+            with zipfile.ZipFile(zip_path) as zf:
+                zf.extractall(out)
+
+        baseline = best_of(extractall)
+        dst = os.path.join(tmp, "extractall")
+        os.rename(os.path.join(tmp, f"run_{args.repeat - 1}"), dst)
+        print(f"zipfile.extractall:          {baseline:7.3f}s {total / 1024 ** 2 / baseline:8.1f} MiB/s")
+
+        for workers in sorted(set(args.workers)):
+            extracted = 0
+
+            def extract(out: str):
+                nonlocal extracted
+                extracted = archive.extract_archive(zip_path, out, workers=workers)
+
+            elapsed = best_of(extract)
+            out = os.path.join(tmp, f"run_{args.repeat - 1}")
+            if extracted != total or not _same_tree(dst, out):
+                raise RuntimeError(f"extract_archive with {workers} workers does not match extractall")
+            shutil.rmtree(out)
+            print(f"extract_archive workers {workers:>3}: {elapsed:7.3f}s {total / 1024 ** 2 / elapsed:8.1f} MiB/s "
+                  f"speedup x{baseline / elapsed:.2f}")
+
+        # flip a byte in the middle of a stored member's data and make sure it is caught
+        bad_path = os.path.join(tmp, "bad.zip")
+        with zipfile.ZipFile(bad_path, "w", zipfile.ZIP_STORED) as zf:
+            zf.writestr("a.bin", bytes(4096))
+        with zipfile.ZipFile(bad_path) as zf:
+            offset = zf.getinfo("a.bin").header_offset + 30 + len("a.bin") + 2048
+        with open(bad_path, "r+b") as f:
+            f.seek(offset)
+            f.write(b"\x01")
+        try:
+            archive.extract_archive(bad_path, os.path.join(tmp, "bad"), workers=2)
+        except zipfile.BadZipFile as e:
+            print(f"corrupt member caught: {e}")
+        else:
+            raise RuntimeError("corrupt member was not caught")
+
+
+if __name__ == '__main__':
+    main()
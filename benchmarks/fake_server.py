@@ -0,0 +1,81 @@
+"""
+A stand-in for bedrock_server that speaks just enough of its console protocol for the benchmarks: it answers
+`save hold` / `save query` / `save resume` using the real files in worlds/<level-name>, `list`, `stop`, exits with
+an error on `crash`, and stops reading its console (but keeps running) on `hang`.
+
+It expects to be run with its working directory (or first argument) set to the server root, which holds
+server.properties and worlds/.
+
+"""
+
+import datetime
+import os
+import sys
+import time
+
+
+def _say(message: str, level: str = "INFO"):
+    stamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S:%f")[:-3]
+    print(f"[{stamp} {level}] {message}", flush=True)
+
+
+def _level_name(root: str) -> str:
+    with open(os.path.join(root, "server.properties"), "r") as f:
+        for line in f:
+            if line.startswith("level-name="):
+                return line.split("=")[1].strip()
+    return "Bedrock level"
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
+    level_name = _level_name(root)
+    worlds = os.path.join(root, "worlds")
+
+    _say("Version: 1.21.0.00")
+    _say("Server started.")
+
+    holding = False
+    queries = 0
+    for line in sys.stdin:
+        command = line.strip()
+        if command == "stop":
+            _say("Stopping server...")
+            _say("Quit correctly")
+            return 0
+        elif command == "crash":
+            return 1
+        elif command == "hang":
+            time.sleep(3600)
+        elif command == "save hold":
+            holding = True
+            queries = 0
+            _say("Saving...")
+        elif command == "save query":
+            queries += 1
+            if not holding or queries < 2:  # the real server usually needs a moment
+                _say("A previous save has not been completed.")
+                continue
+            entries = []
+            for dir_path, dirs, files in os.walk(os.path.join(worlds, level_name)):
+                for file in files:
+                    path = os.path.join(dir_path, file)
+                    rel = os.path.relpath(path, worlds).replace(os.sep, "/")
+                    entries.append(f"{rel}:{os.path.getsize(path)}")
+            _say("Data saved. Files are now ready to be copied.")
+            print(", ".join(entries), flush=True)
+        elif command == "save resume":
+            holding = False
+            _say("Changes to the world are resumed.")
+        elif command == "list":
+            _say("There are 0/10 players online:")
+        elif command.startswith("say "):
+            print(f"[Server] {command[4:]}", flush=True)
+        else:
+            _say(f"Unknown command: {command}. Please check that the command exists and that you have permission to "
+                 f"use it.", level="ERROR")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
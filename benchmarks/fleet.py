@@ -0,0 +1,160 @@
+"""
+Runs a Fleet of servers (benchmarks/fake_server.py) from this one process: installs a version into each instance from
+the shared versions directory, checks each got its own ports, that starts and update countdowns are staggered, that one
+instance hanging is caught by its health check and restarted without touching the others, that instances whose worlds
+share a level name keep (and prune) their own backups, and counts the threads the whole fleet costs.
+
+    python -m benchmarks.fleet --instances 3 --stagger 2
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from threading import active_count, enumerate as enumerate_threads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=3)
+    parser.add_argument("--stagger", type=float, default=2.0, help="seconds between each instance's update countdown")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data")
+        os.makedirs(os.path.join(data, "active"))
+        os.environ["MC_DATA_DIR"] = data
+        from mc import backup_catalog
+        from mc import events
+        from mc import fleet as fleet_module
+        from mc import paths
+        from mc import supervisor as supervisor_module
+        from mc import update
+        from mc import versions
+        from benchmarks._fake_runtime import FakeServerRuntime
+        from benchmarks._synthetic import make_world
+        from benchmarks.update_promotion import make_version
+
+        versions_dir = paths.get_path_to_versions_dir()
+        make_version(os.path.join(versions_dir, "1.0.0.1"), 4, 200, seed=1)
+        supervisor_module.UPDATE_COUNTDOWN = [(0, "say updating soon"), (1, "say updating now")]
+        supervisor_module.HEALTH_CHECK_TIMEOUT = 0.5
+
+        started_at = {}  # instance name: [time.monotonic() of each ServerStarted]
+
+        def factory(path_to_exe: str):
+            runtime = FakeServerRuntime(path_to_exe)
+            name = os.path.basename(os.path.dirname(os.path.dirname(path_to_exe)))
+            runtime.events.subscribe(
+                events.ServerStarted, lambda event: started_at.setdefault(name, []).append(time.monotonic())
+            )
+            return runtime
+
+        instances = [fleet_module.Instance(f"world{i}", 19132 + 2 * i) for i in range(args.instances)]
+        fleet = fleet_module.Fleet(instances, runtime_factory=factory, health_check_interval=0.5,
+                                   start_stagger=10.0, update_stagger=args.stagger)
+
+        start = time.perf_counter()
+        fleet.install()
+        seconds = time.perf_counter() - start
+        print(f"{args.instances} instances installed from the shared versions dir in {seconds:.2f}s")
+        for instance in instances:
+            # every world has the default level name, their backups are still kept apart
+            current = os.path.join(instance.active_dir, "current")
+            with open(os.path.join(current, "server.properties"), "w") as f:
+                f.write("level-name=Bedrock level\n")
+            make_world(os.path.join(current, "worlds", "Bedrock level"), files=50, file_size=16 * 1024)
+
+        threads_before = active_count()
+        begin = time.monotonic()
+        fleet.start()
+        _wait(lambda: len(started_at) == args.instances, "every instance to start")
+        print("  started (after the previous one said it started): " + ", ".join(
+            f"{i.name} +{started_at[i.name][0] - begin:.2f}s" for i in instances))
+
+        for instance in instances:
+            with open(os.path.join(instance.active_dir, "current", "server.properties"), "r") as f:
+                properties = f.read()
+            if f"server-port={instance.port}\n" not in properties or \
+                    f"server-portv6={instance.port_v6}\n" not in properties:
+                raise RuntimeError(f"{instance.name} was not given its ports")
+        print("  each instance's server.properties has its own server-port/server-portv6: ok")
+
+        # wait for one health check to go through on each
+        _wait(lambda: all(i.supervisor.last_health_check_seconds is not None for i in instances), "health checks")
+        idle_threads = active_count() - threads_before
+        print(f"  {idle_threads} threads for {args.instances} running servers (a supervisor, exit waiter and three "
+              f"console threads each, and the shared scheduler)")
+
+        # one backup each, all kept: the same level name is still a group of its own per instance
+        for instance in instances:
+            instance.supervisor.runtime.backup().result()
+        with backup_catalog.BackupCatalog() as catalog:  # zips or snapshots, depending on MC_BACKUP_MODE
+            backups = {b["instance"]: b for b in catalog.list_backups() if b["kind"] != backup_catalog.KIND_UPDATE}
+        if sorted(backups) != sorted(i.name for i in instances):
+            raise RuntimeError(f"expected one backup per instance after pruning, the catalog has: {sorted(backups)}")
+        try:
+            instances[0].supervisor.restore_world(backups[instances[-1].name]["id"]).result(10)
+            raise RuntimeError(f"{instances[0].name} restored {instances[-1].name}'s backup")
+        except ValueError as e:
+            print(f"  one backup of each 'Bedrock level' kept, restoring another instance's is refused ({e})")
+
+        # a hung server is restarted by its own supervisor, the others keep running
+        hung = instances[-1]
+        others = {i.name: len(started_at[i.name]) for i in instances if i is not hung}
+        sent = time.monotonic()
+        hung.supervisor.runtime.send_command("hang")
+        _wait(lambda: len(started_at[hung.name]) == 2, "the hung instance to be restarted", timeout=30)
+        print(f"  {hung.name} hung, restarted after {time.monotonic() - sent:.2f}s "
+              f"({supervisor_module.HEALTH_CHECK_FAILURES} missed checks, then up to 5s to stop it)")
+        if any(len(started_at[name]) != count for name, count in others.items()):
+            raise RuntimeError("an instance that didn't hang was restarted")
+
+        # one new version, downloaded once, rolled out one instance at a time
+        make_version(os.path.join(versions_dir, "1.0.0.2"), 4, 200, seed=2)
+        versions.invalidate_all()
+        updated_at = {}
+        begin = time.monotonic()
+        fleet.notify_update_ready()
+
+        def all_updated() -> bool:
+            for i in instances:
+                if i.name not in updated_at and i.supervisor.last_update_downtime is not None:
+                    updated_at[i.name] = time.monotonic()
+            return len(updated_at) == args.instances
+
+        _wait(all_updated, "every instance to update", timeout=60)
+        for instance in instances:
+            if paths.get_current_version(active_dir=instance.active_dir) != "1.0.0.2":
+                raise RuntimeError(f"{instance.name} was not updated")
+        print("  updated (countdown staggered): " + ", ".join(
+            f"{i.name} +{updated_at[i.name] - begin:.2f}s ({i.supervisor.last_update_downtime:.2f}s down)"
+            for i in instances))
+
+        fleet.shutdown()
+        for thread in enumerate_threads():
+            if thread.name == "update-backup":
+                thread.join()
+        for instance in instances:
+            if not os.path.exists(update.get_path_to_update_backup("1.0.0.1", "1.0.0.2", instance.active_dir)):
+                raise RuntimeError(f"{instance.name} has no pre-update backup")
+        with backup_catalog.BackupCatalog() as catalog:
+            catalog.prune(backup_catalog.RetentionPolicy.from_env())
+            updates = {b["instance"] for b in catalog.list_backups(kind=backup_catalog.KIND_UPDATE)}
+        if updates != {i.name for i in instances}:
+            raise RuntimeError(f"expected a pre-update backup per instance after pruning, the catalog has: {updates}")
+        print(f"  pre-update backups after pruning, one per instance: {sorted(updates)}")
+        print(f"  one versions dir for all of them: {sorted(os.listdir(versions_dir))}")
+
+
+def _wait(condition, what: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"timed out waiting for {what}")
+        time.sleep(0.02)
+
+
+if __name__ == '__main__':
+    main()
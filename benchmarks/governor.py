@@ -0,0 +1,156 @@
+"""
+Measures how much a backup disturbs the server, and what mc.governor does about it: a stand-in "server" subprocess ticks
+every 50ms (a fixed amount of computation per tick, like the game loop) and records how late each tick starts and how
+long its work takes, while zip backups of a synthetic world run back to back in this process for --seconds, with no
+backup at all (the baseline), with no limits, with an I/O limit (as it was before it synced its writes, and as it is),
+at a lower CPU/I/O priority, and with the server and the backup on separate cores (skipped on a single cpu machine).
+Every run backs up for at least the same window, so each has at least as many ticks. The backups are kept until the run
+has synced what they left in the page cache, so the writeback they cause lands in the run that caused it.
+
+The server is CPU bound by default (--work-ms of computation on an idle cpu per tick). With --save-bytes it instead
+writes and fsyncs that much every tick, like a server saving its world, so the I/O limit and the I/O priority have
+something to compete with.
+
+    python -m benchmarks.governor --files 1500 --file-size 65536 --io-limit 20000000 --work-ms 20
+    python -m benchmarks.governor --files 4000 --file-size 65536 --save-bytes 262144
+
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_TICKER = """
+import os, sys, time
+tick = 0.05
+save, save_bytes, work = sys.argv[1], int(sys.argv[2]), float(sys.argv[3]) / 1000
+
+def step(n):
+    x = 0
+    for i in range(n):
+        x += i * i
+    return x
+
+def timed(n):
+    start = time.perf_counter()
+    step(n)
+    return time.perf_counter() - start
+
+# a fixed amount of computation per tick, sized to take `work` seconds on an idle cpu (the best of a few tries)
+n = 100_000
+n = max(int(n * work / min(timed(n) for _ in range(5))), 1)
+
+due = time.perf_counter() + tick
+while True:
+    time.sleep(max(due - time.perf_counter(), 0))
+    late = time.perf_counter() - due
+    started = time.perf_counter()
+    if save_bytes:  # a disk bound server: every tick saves and waits for it to reach the disk
+        with open(save, "wb") as f:
+            f.write(os.urandom(save_bytes))
+            f.flush()
+            os.fsync(f.fileno())
+    else:  # a cpu bound one, the tick takes longer when it has to share the cpu
+        step(n)
+    print(f"{late * 1000:.3f} {(time.perf_counter() - started) * 1000:.3f}", flush=True)
+    due += tick
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=1500)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--io-limit", type=int, default=20_000_000, help="bytes/s for the I/O limited run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--work-ms", type=float, default=5.0, help="cpu time the server spends on every 50ms tick")
+    parser.add_argument("--save-bytes", type=int, default=0, help="bytes the server writes and fsyncs every tick")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long each run backs up for")
+    args = parser.parse_args()
+
+    from mc import archive
+    from mc import governor
+    from benchmarks._synthetic import make_world
+
+    with tempfile.TemporaryDirectory() as tmp:
+        world = os.path.join(tmp, "world")
+        total = make_world(world, files=args.files, file_size=args.file_size)
+        print(f"world: {args.files} files, {total / 1024 ** 2:.1f} MiB, {args.workers} archive workers, "
+              f"{os.cpu_count()} cpus, server "
+              + (f"saving {args.save_bytes / 1024:.0f} KiB (fsynced) every tick" if args.save_bytes else
+                 f"busy {args.work_ms:g}ms every 50ms tick"))
+
+        cpus = os.cpu_count() or 1
+        io_limit = f"io limit {args.io_limit / 1024 ** 2:.0f} MiB/s"
+        runs = [  # label, limits, cores to pin the server to, whether throttled writes are synced as they go
+            ("no backup (baseline)", governor.Limits(), None, True),
+            ("no limits", governor.Limits(), None, True),
+            (f"{io_limit}, not synced", governor.Limits(io_limit_bps=args.io_limit), None, False),
+            (io_limit, governor.Limits(io_limit_bps=args.io_limit), None, True),
+            ("nice 19, io idle", governor.Limits(nice=19, io_class="idle"), None, True),
+        ]
+        if cpus >= 2 and hasattr(os, "sched_setaffinity"):
+            runs.append(("server on cpu 0, backup on the rest", governor.Limits(server_cpus={0}), {0}, True))
+        else:
+            print("(1 cpu, or no affinity support here: skipping the pinned run)")
+
+        written = governor.written
+        for i, (label, limits, server_cpus, synced) in enumerate(runs):
+            governor.set_limits(limits)
+            governor.written = written if synced else lambda f, n: None  # the limit before it synced anything
+            ticker = subprocess.Popen(
+                [sys.executable, "-c", _TICKER, os.path.join(tmp, "save"), str(args.save_bytes), str(args.work_ms)],
+                stdout=subprocess.PIPE, text=True
+            )
+            if server_cpus is not None:
+                governor.pin_server_process(ticker.pid)
+            time.sleep(0.5)  # let it settle, these ticks are dropped
+
+            start = time.perf_counter()
+            backups = 0
+            if i == 0:
+                time.sleep(args.seconds)
+            else:
+                with ThreadPoolExecutor(1, initializer=governor.maintenance_thread) as pool:
+                    while time.perf_counter() - start < args.seconds:
+                        path = os.path.join(tmp, f"backup_{backups}.zip")
+                        pool.submit(_backup, archive, world, path, args.workers).result()
+                        backups += 1
+            seconds = time.perf_counter() - start
+            # the backups are kept, so whatever they left in the page cache is written back while the server runs
+            # (within vm.dirty_expire_centisecs on linux), that counts against them too
+            sync_start = time.perf_counter()
+            os.sync()
+            writeback = time.perf_counter() - sync_start
+            time.sleep(0.1)
+
+            ticker.kill()
+            for n in range(backups):
+                os.remove(os.path.join(tmp, f"backup_{n}.zip"))
+            lines = [line.split() for line in ticker.stdout.read().splitlines()[10:]]  # 10 ticks = the settling 0.5s
+            ticker.wait()
+            ticks = sorted(float(line[0]) for line in lines if line)
+            took = sorted(float(line[1]) for line in lines if line)
+            bucket = limits.io_bucket
+            throughput = f"{backups} backups, {backups * total / seconds / 1024 ** 2:5.1f} MiB/s"
+            throughput += f", {writeback:4.1f}s sync"
+            if bucket is not None:
+                throughput += f" (held back {bucket.waited:.1f}s)"
+            print(f"  {label:<32} {throughput:<52} server ticks late by p50 {statistics.median(ticks):5.2f}ms "
+                  f"p99 {ticks[int(len(ticks) * 0.99)]:6.2f}ms max {ticks[-1]:6.2f}ms ({len(ticks)} ticks)")
+            print(f"  {'':<32} {'':<52} {'saves' if args.save_bytes else 'tick work'} took p50 "
+                  f"{statistics.median(took):5.2f}ms p99 {took[int(len(took) * 0.99)]:6.2f}ms max {took[-1]:6.2f}ms")
+
+
+def _backup(archive, world: str, path: str, workers: int):
+    with archive.ArchiveWriter(path, codec="deflate", level=6, workers=workers) as writer:
+        writer.add_tree(world)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Golden checks and timings for the legacy download page scraper: the single-pass scan_download_links against the
+original find/rfind plus list.remove implementation, over synthetic copies of the pre June 2025 download page grown to
+different sizes.
+
+    python -m benchmarks.html_scraper --sizes 1 4 16 --links 50 400
+
+"""
+
+import argparse
+import random
+import re
+import time
+
+from mc import downloads
+
+# the server zip name the original scraper searched for, then walked back from to the "https://"
+old_pattern = re.compile(r"bedrock-server-\d+\.\d+\.\d+\.\d+\.zip")
+
+
+def old_extract(text: str) -> str | None:
+    """The original get_latest_download_link_old, from the response text on"""
+    matches = old_pattern.findall(text)
+    full_links = []
+    for match in matches:
+        start = text.rfind("https://", 0, text.find(match))
+        if start == -1:
+            continue
+        full_link = text[start:text.find(match) + len(match)]
+        full_links.append(full_link)
+
+    illegal_chars = ">< \n"
+    to_remove = []
+    for link in full_links:
+        if any(char in link for char in illegal_chars):
+            to_remove.append(link)
+    for link in to_remove:
+        full_links.remove(link)
+    to_remove = []
+    for link in full_links:
+        if "win" not in link:
+            to_remove.append(link)
+    for link in to_remove:
+        full_links.remove(link)
+    to_remove = []
+    for link in full_links:
+        if "preview" in link:
+            to_remove.append(link)
+    for link in to_remove:
+        full_links.remove(link)
+
+    full_links = list(set(full_links))
+    return full_links[0] if len(full_links) == 1 else None
+
+
+def new_extract(text: str, chunk_size: int = 64 * 1024) -> str | None:
+    """get_latest_download_link_old's parsing, fed in chunks like a streaming decode would"""
+    links = {
+        link for link, windows, preview in downloads.scan_download_links(
+            text[i:i + chunk_size] for i in range(0, len(text), chunk_size)
+        ) if windows and not preview
+    }
+    return links.pop() if len(links) == 1 else None
+
+
+_BLOCK = """
+<div class="card">
+  <p>Download the Minecraft Bedrock Dedicated Server for {platform}.</p>
+  <a href="https://www.minecraft.net/en-us/eula">End User License Agreement</a>
+  <a href="https://minecraft.azureedge.net/bin-{platform}/bedrock-server-{version}.zip" class="btn"
+     data-platform="serverBedrock{platform}" role="button" aria-label="Download">Download</a>
+  <script>window.dataLayer.push({{"event": "view", "href": "https://www.minecraft.net/{noise}"}});</script>
+</div>
+"""
+
+
+def make_page(size_mb: float, links: int, version: str, seed: int = 0, extra: str = "",
+              platforms: tuple[str, ...] = ("win", "linux", "win-preview", "linux-preview"), versions: int = 0) -> str:
+    """
+    A page shaped like the old download page: download cards (windows first, then linux and the previews, as on the
+    real page) repeated in order through a lot of unrelated markup.
+
+    With versions, that many older linux releases are listed after the current one (like a changelog or archive
+    section), each with its own zip name.
+    """
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 ** 2)
+    head = "<html><head><title>Download Minecraft Dedicated Server</title></head><body>"
+    cards = []
+    for i in range(links):
+        platform = platforms[i % len(platforms)]
+        v = version if "preview" not in platform else "1.99.0.20"
+        if versions and i >= len(platforms):
+            platform, v = "linux", f"1.20.{(i - len(platforms)) % versions}.1"
+        cards.append(_BLOCK.format(platform=platform, version=v, noise=rng.randbytes(6).hex()))
+
+    filler = []
+    length = len(head) + sum(len(card) for card in cards)
+    while length < target:
+        part = f'<p class="filler">{rng.randbytes(48).hex()} https://www.minecraft.net/{rng.randbytes(4).hex()}' \
+               f' more text about servers</p>\n'
+        filler.append(part)
+        length += len(part)
+
+    # spread the cards through the filler, keeping their order
+    positions = sorted(rng.randrange(len(filler) + 1) for _ in cards)
+    parts = [head]
+    previous = 0
+    for position, card in zip(positions, cards):
+        parts.extend(filler[previous:position])
+        parts.append(card)
+        previous = position
+    parts.extend(filler[previous:])
+    parts.append(extra + "</body></html>")
+    return "".join(parts)
+
+
+def golden_cases() -> list[tuple[str, str]]:
+    cases = [
+        ("typical", make_page(0.5, 8, "1.21.30.03")),
+        ("many repeats", make_page(1, 200, "1.21.30.03", seed=1)),
+        ("no links", make_page(0.2, 0, "1.21.30.03", seed=2)),
+        ("two windows versions", make_page(0.2, 8, "1.21.30.03", seed=3,
+                                           extra='<a href="https://minecraft.azureedge.net/bin-win/'
+                                                 'bedrock-server-1.21.31.04.zip">x</a>')),
+        ("name without a link", make_page(0.2, 4, "1.21.30.03", seed=4,
+                                          extra="<p>bedrock-server-1.21.30.03.zip is the latest</p>")),
+        ("link broken by a tag", "<p>https://minecraft.azureedge.net/<b>bin-win</b>/bedrock-server-1.2.3.4.zip</p>"),
+        ("only preview", '<a href="https://minecraft.azureedge.net/bin-win-preview/bedrock-server-1.2.3.4.zip">'),
+        ("nested https", '<a href="https://redirect.example/?to=https://minecraft.azureedge.net/bin-win/'
+                         'bedrock-server-1.2.3.4.zip">'),
+        ("version archive", make_page(0.5, 200, "1.21.30.03", seed=6, versions=100)),
+    ]
+    return cases
+
+
+def fixed_cases() -> list[tuple[str, str, str]]:
+    """
+    Pages where the old implementation was wrong: it located each name with text.find, so always at its first
+    occurrence, and a linux link sharing the windows zip name above the windows link hid the windows link
+    """
+    return [
+        ("linux card first", make_page(0.2, 4, "1.21.30.03", seed=5, platforms=("linux", "win")),
+         "https://minecraft.azureedge.net/bin-win/bedrock-server-1.21.30.03.zip"),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="page sizes in MiB")
+    parser.add_argument("--links", type=int, nargs="+", default=[50, 400], help="download cards per page")
+    parser.add_argument("--versions", type=int, nargs="+", default=[0, 400],
+                        help="distinct older releases listed on the page")
+    args = parser.parse_args()
+
+    for name, page in golden_cases():
+        old = old_extract(page)
+        for chunk_size in (7, 4096, 64 * 1024):
+            new = new_extract(page, chunk_size)
+            if new != old:
+                raise RuntimeError(f"golden case '{name}' differs with {chunk_size} char chunks: {old!r} vs {new!r}")
+        print(f"golden {name:<22} ok: {old}")
+
+    for name, page, expected in fixed_cases():
+        new = new_extract(page, 4096)
+        if new != expected:
+            raise RuntimeError(f"case '{name}': expected {expected!r}, got {new!r}")
+        print(f"fixed  {name:<22} ok: {new} (old: {old_extract(page)})")
+
+    for size in args.sizes:
+        for links, versions in [(links, versions) for links in args.links for versions in args.versions]:
+            page = make_page(size, links, "1.21.30.03", seed=int(size * 10) + links, versions=versions)
+
+            start = time.perf_counter()
+            old = old_extract(page)
+            old_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            new = new_extract(page)
+            new_seconds = time.perf_counter() - start
+
+            if old != new:
+                raise RuntimeError(f"{size} MiB page with {links} links: {old!r} vs {new!r}")
+            print(f"{size:5.1f} MiB page, {links:4d} links, {versions:4d} older versions: old {old_seconds * 1000:9.1f}ms "
+                  f"new {new_seconds * 1000:8.1f}ms  x{old_seconds / new_seconds:.1f}")
+
+
+if __name__ == '__main__':
+    main()
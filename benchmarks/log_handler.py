@@ -0,0 +1,77 @@
+"""
+Compares the records/sec of the old ThreadSafeFileLogger (open, write and close the day's file for every record)
+with QueuedDailyFileHandler, as seen by the logging thread and including the time to get everything onto disk.
+
+    python -m benchmarks.log_handler --records 100000
+
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import tempfile
+import time
+from threading import RLock
+
+from mc import log_handlers
+
+
+class LegacyThreadSafeFileLogger(logging.Handler):
+    # the handler run_mc_server.py used to use
+    def __init__(self, log_dir: str, level=logging.NOTSET):
+        super().__init__(level)
+        self.log_dir = log_dir
+        self.lock = RLock()  # noqa
+
+    def emit(self, record):
+        current_time = datetime.datetime.now()
+        log_file = os.path.join(self.log_dir, f"{current_time.strftime('%Y-%m-%d')}.log")
+
+        with self.lock:
+            with open(log_file, "a") as f:
+                f.write(f"{record.asctime} - {record.name} - {record.levelname} - {record.message}\n")
+
+
+def run(handler: logging.Handler, records: int) -> tuple[float, float]:
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    logger = logging.getLogger(f"bench.{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    # the old handler relied on another handler having formatted the record first (for asctime/message)
+    if isinstance(handler, LegacyThreadSafeFileLogger):
+        class _Formats(logging.Handler):
+            def emit(self, record):
+                formatter.format(record)
+        logger.handlers.insert(0, _Formats())
+
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info("[2024-06-01 12:00:00:123 INFO] Running AutoCompaction... %d", i)
+    logged = time.perf_counter() - start
+    handler.close()
+    done = time.perf_counter() - start
+    return logged, done
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100_000)
+    args = parser.parse_args()
+
+    for name, make in (
+        ("ThreadSafeFileLogger", LegacyThreadSafeFileLogger),
+        ("QueuedDailyFileHandler", lambda log_dir: log_handlers.QueuedDailyFileHandler(log_dir=log_dir)),
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            logged, done = run(make(tmp), args.records)
+            lines = sum(sum(1 for _ in open(os.path.join(tmp, f))) for f in os.listdir(tmp))
+            print(f"{name:>22}: {args.records / logged:10,.0f} records/s on the logging thread, "
+                  f"{args.records / done:10,.0f} records/s to disk ({lines} lines written)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Exercises mc.metrics: what recording costs on the paths that record as they happen, then, against
+benchmarks/fake_server.py and a local HTTP server, scrapes /metrics after a backup, some console output, a crash, a
+download and discovery requests, checks each of them shows up, and times a scrape.
+
+    python -m benchmarks.metrics --lines 2000 --scrapes 100
+
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import timeit
+import urllib.error
+import urllib.request
+from threading import Event, Thread
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=2000, help="console lines for the server to write")
+    parser.add_argument("--scrapes", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data")
+        os.makedirs(os.path.join(data, "active"))
+        os.environ["MC_DATA_DIR"] = data
+        from mc import discovery
+        from mc import downloads
+        from mc import events
+        from mc import metrics
+        from mc import supervisor as supervisor_module
+        from mc import update
+        from benchmarks._fake_runtime import FakeServerRuntime, make_server_root
+        from benchmarks.download import _Fixture, serve
+
+        # what it costs where it is recorded
+        counter = metrics.Counter("bench_total", "benchmark", ("server",))
+        histogram = metrics.Histogram("bench_seconds", "benchmark", ("world",))
+        n = 200_000
+        per_inc = timeit.timeit(lambda: counter.inc(server="a"), number=n) / n
+        per_observe = timeit.timeit(lambda: histogram.observe(0.3, world="a"), number=n) / n
+
+        class Lines:
+            stdout_lines = 0
+
+        def count_line():
+            Lines.stdout_lines += 1
+
+        per_line = timeit.timeit(count_line, number=n) / n - timeit.timeit(lambda: None, number=n) / n
+        print(f"Counter.inc {per_inc * 1e9:.0f}ns, Histogram.observe {per_observe * 1e9:.0f}ns (a few an hour), "
+              f"counting a stdout line {max(per_line, 0) * 1e9:.0f}ns (every line)")
+
+        # a supervised server, with the endpoint up
+        update.need_update = lambda active_dir=None: False
+        exe = make_server_root(os.path.join(data, "active"), files=200, file_size=64 * 1024)
+        started = Event()
+
+        def factory(path_to_exe: str):
+            runtime = FakeServerRuntime(path_to_exe)
+            runtime.events.subscribe(events.ServerStarted, lambda event: started.set())
+            return runtime
+
+        sup = supervisor_module.Supervisor(runtime_factory=factory, path_to_exe=exe, restart_delay=0)
+        thread = Thread(target=sup.run, daemon=True)
+        thread.start()
+        if not started.wait(10):
+            raise RuntimeError("fake server did not start")
+        server = metrics.start_server(port=0, host="127.0.0.1")
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+        sup.runtime.backup().result()
+        for i in range(args.lines):
+            sup.runtime.send_command(f"say line {i}")
+        _wait(lambda: sup.runtime.stdout_lines >= args.lines, "the server's output")
+        lines = 'mc_server_stdout_lines_total{server="server"}'
+        with urllib.request.urlopen(url) as r:
+            print(f"after {args.lines} commands echoed: {lines} {_parse(r.read().decode())[lines]:g} "
+                  f"(per server process, like its cpu time)")
+
+        started.clear()
+        sup.runtime.send_command("crash")
+        if not started.wait(10):
+            raise RuntimeError("fake server was not restarted after crashing")
+
+        fixture = _Fixture(os.urandom(16 * 1024 ** 2), drops=1)
+        http_server, download_url = serve(fixture)
+        downloads.time.sleep = lambda seconds: None  # no backoff against a local server
+        downloads.download_file(download_url, os.path.join(tmp, "version.zip"))
+        client = discovery.DiscoveryClient(cache_path=os.path.join(tmp, "discovery_cache.json"))
+        client.fetch(download_url)
+        client.fetch(download_url)  # from the cache
+        http_server.shutdown()
+
+        timings = []
+        body = ""
+        for _ in range(args.scrapes):
+            start = time.perf_counter()
+            with urllib.request.urlopen(url) as r:
+                body = r.read().decode()
+                content_type = r.headers["Content-Type"]
+            timings.append(time.perf_counter() - start)
+        samples = _parse(body)
+        print(f"{args.scrapes} scrapes: p50 {statistics.median(timings) * 1000:.2f}ms, "
+              f"max {max(timings) * 1000:.2f}ms, {len(body)} bytes, {len(samples)} samples ({content_type})")
+
+        expected = [
+            'mc_backup_duration_seconds_count{world="Bedrock level",mode="zip"}',
+            'mc_backup_bytes_in_total{world="Bedrock level",mode="zip"}',
+            'mc_backup_bytes_out_total{world="Bedrock level",mode="zip"}',
+            'mc_backup_save_hold_seconds_count{world="Bedrock level"}',
+            'mc_download_bytes_total',
+            'mc_download_resumes_total',
+            'mc_download_last_throughput_bytes_per_second',
+            'mc_discovery_request_duration_seconds_count{result="200"}',
+            'mc_discovery_cache_hits_total',
+            'mc_server_restarts_total{server="server",reason="crash"}',
+            'mc_server_up{server="server"}',
+            'mc_server_uptime_seconds{server="server"}',
+            'mc_server_command_queue_depth{server="server"}',
+        ]
+        if os.path.exists("/proc/self/stat"):
+            expected += ['mc_server_process_cpu_seconds_total{server="server"}',
+                         'mc_server_process_resident_memory_bytes{server="server"}']
+        missing = [name for name in expected if name not in samples]
+        if missing:
+            raise RuntimeError(f"missing from /metrics: {missing}")
+        for name in expected:
+            print(f"  {name} {samples[name]:g}")
+        optional = 'mc_server_process_read_bytes_total{server="server"}'
+        print(f"  {optional} {samples[optional]:g}" if optional in samples else
+              f"  (no /proc/<pid>/io here, process I/O not reported)")
+
+        try:
+            urllib.request.urlopen(url.replace("/metrics", "/nothing")).close()
+            raise RuntimeError("/nothing was answered")
+        except urllib.error.HTTPError as e:
+            print(f"  /nothing: {e.code}")
+
+        metrics.stop_server()
+        sup.shutdown()
+        thread.join(10)
+
+
+def _parse(body: str) -> dict[str, float]:
+    samples = {}
+    for line in body.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            samples[name] = float(value)
+    return samples
+
+
+def _wait(condition, what: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"timed out waiting for {what}")
+        time.sleep(0.02)
+
+
+if __name__ == '__main__':
+    main()
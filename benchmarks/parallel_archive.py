@@ -0,0 +1,54 @@
+"""
+Compares serial and parallel ArchiveWriter compression on a synthetic world, and checks every archive it writes is
+valid (CRCs and offsets) by reading it back.
+
+    python -m benchmarks.parallel_archive --files 2000 --workers 1 2 4 8
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import zipfile
+
+from mc import archive
+from benchmarks._synthetic import make_world
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--codec", default="deflate", choices=list(archive.CODECS))
+    parser.add_argument("--level", type=int, default=9)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        world = os.path.join(tmp, "world")
+        total = make_world(world, files=args.files, file_size=args.file_size)
+        print(f"synthetic world: {args.files} files, {total / 1024 ** 2:.1f} MiB, {args.codec} {args.level}")
+
+        baseline = None
+        for workers in sorted(set(args.workers)):
+            dst = os.path.join(tmp, f"out_{workers}.zip")
+            start = time.perf_counter()
+            with archive.ArchiveWriter(dst, codec=args.codec, level=args.level, workers=workers) as writer:
+                writer.add_tree(world)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+
+            with zipfile.ZipFile(dst) as zf:
+                bad = zf.testzip()
+                members = len(zf.namelist())
+            if bad is not None or members != writer.files_written:
+                raise RuntimeError(f"archive written with {workers} workers is invalid: {bad}, {members} members")
+
+            print(f"workers {workers:>3}: {elapsed:8.3f}s {total / 1024 ** 2 / elapsed:8.1f} MiB/s "
+                  f"speedup x{baseline / elapsed:.2f}")
+            os.remove(dst)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Exercises mc.scheduler: how late tasks run, that the thread stays asleep with tasks pending, that a named task picks up
+its interval across a restart of the process, cron matching, and, against benchmarks/fake_server.py, that restarting a
+ServerRuntime no longer leaks a backup thread per start and that a timed restart backs up and restarts the server.
+
+    python -m benchmarks.scheduler --tasks 500 --restarts 20
+
+"""
+
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+from threading import Event, Thread, active_count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--restarts", type=int, default=20)
+    parser.add_argument("--idle", type=float, default=5.0, help="seconds to sit idle while counting wakeups")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data")
+        os.makedirs(os.path.join(data, "active"))
+        os.environ["MC_DATA_DIR"] = data
+        from mc import events
+        from mc import scheduler
+        from mc import server_runtime
+        from mc import supervisor as supervisor_module
+        from mc import update
+        from benchmarks._fake_runtime import FakeServerRuntime, make_server_root
+
+        # lateness of one-off tasks spread over a second
+        sched = scheduler.Scheduler(path_to_state=os.path.join(tmp, "schedule.json"))
+        late = []
+        done = Event()
+
+        def make_task(due: float):
+            def run():
+                late.append(time.monotonic() - due)
+                if len(late) == args.tasks:
+                    done.set()
+            return run
+
+        for _ in range(args.tasks):
+            delay = random.random()
+            sched.call_later(delay, make_task(time.monotonic() + delay))
+        done.wait(10)
+        print(f"{args.tasks} tasks over 1s: late by p50 {statistics.median(late) * 1000:.2f}ms, "
+              f"max {max(late) * 1000:.2f}ms")
+
+        # idle with tasks pending, nothing due
+        for _ in range(args.tasks):
+            sched.schedule(scheduler.Interval(3600), lambda: None)
+        time.sleep(0.2)
+        wakeups = sched.wakeups
+        time.sleep(args.idle)
+        print(f"idle {args.idle:.0f}s with {args.tasks} hourly tasks pending: {sched.wakeups - wakeups} wakeups")
+
+        # a countdown, cancelled half way
+        said = []
+        countdown = sched.sequence([(0.0, lambda: said.append(1)), (0.2, lambda: said.append(2)),
+                                    (0.6, lambda: said.append(3))])
+        time.sleep(0.4)
+        countdown.cancel()
+        time.sleep(0.4)
+        if said != [1, 2]:
+            raise RuntimeError(f"cancelled countdown misbehaved: {said}")
+        print("countdown cancelled after its second step, third skipped: ok")
+        sched.shutdown()
+
+        # a named task's last run survives a restart of the process (a new Scheduler on the same state)
+        state = os.path.join(tmp, "schedule.json")
+        first = scheduler.Scheduler(path_to_state=state)
+        ran = Event()
+        first.schedule(scheduler.Interval(1.0), ran.set, name="backup test")
+        ran.wait(5)
+        first.shutdown()
+        time.sleep(0.5)
+        second = scheduler.Scheduler(path_to_state=state)
+        task = second.schedule(scheduler.Interval(1.0), lambda: None, name="backup test")
+        print(f"named 1s task 0.5s after the process 'restarted': next due in {task.due - time.time():.2f}s "
+              f"(a fresh task would be 1.00s)")
+        second.shutdown()
+
+        cron = scheduler.Cron("0 4 * * *")
+        start = time.perf_counter()
+        for _ in range(1000):
+            cron.next_after(time.time())
+        print(f"Cron('0 4 * * *') next: {datetime.datetime.fromtimestamp(cron.next_after(time.time()))}, "
+              f"{(time.perf_counter() - start) * 1000:.3f}us per lookup")
+
+        # ServerRuntime used to start a backup thread (sleeping an hour) on every start and never stop it
+        exe = make_server_root(os.path.join(tmp, "server"), files=20, file_size=4096)
+        runtime = FakeServerRuntime(exe)
+        runtime.start()
+        runtime.stop()
+        threads = active_count()
+        for _ in range(args.restarts):
+            runtime.start()
+            runtime.stop()
+        print(f"{args.restarts} start/stops of a ServerRuntime: {active_count() - threads} threads left behind "
+              f"(the old _backup_thread leaked {args.restarts})")
+
+        # a timed restart: countdown, backup, restart
+        update.need_update = lambda active_dir=None: False
+        supervisor_module.RESTART_COUNTDOWN = [(0, "say restarting soon"), (0.5, "say restarting now")]
+        started = Event()
+
+        def factory(path_to_exe: str):
+            r = FakeServerRuntime(path_to_exe)
+            r.events.subscribe(events.ServerStarted, lambda event: started.set())
+            return r
+
+        sup = supervisor_module.Supervisor(runtime_factory=factory, path_to_exe=exe, restart_cron="0 4 * * *")
+        thread = Thread(target=sup.run, daemon=True)
+        thread.start()
+        if not started.wait(10):
+            raise RuntimeError("fake server did not start")
+        started.clear()
+        before = sup.runtime
+        sup.call_soon(sup._on_restart_due)  # noqa  # as if it were 4am
+        if not started.wait(10) or sup.runtime is before:
+            raise RuntimeError("timed restart did not restart the server")
+        before._backup_executor.shutdown(wait=True)  # noqa  # the archive finishes after the restart
+        backups = [name for _, _, files in os.walk(os.path.join(data, "backup")) for name in files
+                   if name.endswith(".zip")]
+        if not backups and server_runtime.get_backup_mode() == "zip":
+            raise RuntimeError("timed restart did not back up")
+        print(f"timed restart: counted down, backed up ({', '.join(backups)}) and restarted: ok")
+        sup.shutdown()
+        thread.join(10)
+
+
+if __name__ == '__main__':
+    main()
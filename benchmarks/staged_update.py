@@ -0,0 +1,109 @@
+"""
+Runs a whole update through the Supervisor against benchmarks/fake_server.py, on a synthetic server install and world,
+and compares the stop-to-start downtime of a staged update (prepared while the old server runs) with doing the whole
+update after the stop, as slow_update used to (backup, clone, config merge, world handover and swap).
+
+    python -m benchmarks.staged_update --exe-mb 40 --pack-files 2000 --world-files 2000
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from threading import Event, Thread, current_thread, enumerate as enumerate_threads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exe-mb", type=int, default=40)
+    parser.add_argument("--pack-files", type=int, default=2000)
+    parser.add_argument("--world-files", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data")
+        os.makedirs(os.path.join(data, "active"))
+        os.environ["MC_DATA_DIR"] = data
+        from mc import events
+        from mc import paths
+        from mc import update
+        from mc import supervisor as supervisor_module
+        from benchmarks._fake_runtime import FakeServerRuntime
+        from benchmarks._synthetic import make_world
+        from benchmarks.update_promotion import make_version
+
+        versions_dir = paths.get_path_to_versions_dir()
+        active_dir = paths.get_path_to_active_dir()
+        make_version(os.path.join(versions_dir, "1.0.0.1"), args.exe_mb, args.pack_files, seed=1)
+        make_version(os.path.join(versions_dir, "1.0.0.2"), args.exe_mb, args.pack_files, seed=2)
+        supervisor_module.UPDATE_COUNTDOWN = [(0, "say updating soon"), (3, "say updating now")]
+
+        def install_old_version():
+            current = os.path.join(active_dir, "current")
+            shutil.rmtree(current, ignore_errors=True)
+            shutil.copytree(os.path.join(versions_dir, "1.0.0.1"), current)
+            make_world(os.path.join(current, "worlds", "Bedrock level"), files=args.world_files)
+            with open(os.path.join(active_dir, ".version"), "w") as f:
+                f.write("1.0.0.1")
+            shutil.rmtree(paths.get_path_to_backup_dir(), ignore_errors=True)
+            update.versions.get_catalog().invalidate()
+
+        def run_update() -> float:
+            started = Event()
+
+            def factory(path_to_exe: str):
+                runtime = FakeServerRuntime(path_to_exe)
+                runtime.events.subscribe(events.ServerStarted, lambda event: started.set())
+                return runtime
+
+            sup = supervisor_module.Supervisor(runtime_factory=factory)
+            thread = Thread(target=sup.run, daemon=True)
+            thread.start()
+            if not started.wait(10):
+                raise RuntimeError("fake server did not start")
+            started.clear()
+            sup.notify_update_ready()
+            deadline = time.monotonic() + 300
+            while sup.last_update_downtime is None:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("update did not finish")
+                time.sleep(0.05)
+            sup.shutdown()
+            thread.join(10)
+            for backup_thread in enumerate_threads():
+                if backup_thread.name == "update-backup":
+                    backup_thread.join()
+            if not os.path.exists(update.get_path_to_update_backup("1.0.0.1", "1.0.0.2")):
+                raise RuntimeError("pre-update backup was not written")
+            if paths.get_current_version() != "1.0.0.2":
+                raise RuntimeError("server was not updated")
+            world = os.path.join(active_dir, "current", "worlds", "Bedrock level", "db")
+            if len(os.listdir(world)) < args.world_files:
+                raise RuntimeError("worlds were not carried over")
+            return sup.last_update_downtime
+
+        prepare_update = update.prepare_update
+
+        install_old_version()
+
+        def unprepared(active_dir=None):
+            if current_thread().name == "update-prepare":
+                raise RuntimeError("benchmarking the unstaged update")
+            return prepare_update(active_dir)
+
+        update.prepare_update = unprepared
+        old_seconds = run_update()
+
+        install_old_version()
+        update.prepare_update = prepare_update
+        new_seconds = run_update()
+
+        print(f"version: {args.exe_mb} MiB exe, {args.pack_files} pack files; world: {args.world_files} files")
+        print(f"  update after the stop: {old_seconds:7.2f}s stop-to-start")
+        print(f"  staged update:         {new_seconds:7.2f}s stop-to-start")
+
+
+if __name__ == '__main__':
+    main()
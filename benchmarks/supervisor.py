@@ -0,0 +1,91 @@
+"""
+Runs the Supervisor against benchmarks/fake_server.py: measures how long it takes to notice a crash and have the
+server back up, checks that a deliberate stop isn't taken for a crash, and counts how often the supervisor wakes while
+idle (the old maintain_loop woke once a second).
+
+    python -m benchmarks.supervisor --crashes 20 --idle 10
+
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from threading import Event, Thread
+
+from mc import events
+from mc import supervisor as supervisor_module
+from mc import update
+from benchmarks._fake_runtime import FakeServerRuntime, make_server_root
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--crashes", type=int, default=20)
+    parser.add_argument("--idle", type=float, default=10.0, help="seconds to sit idle while counting wakeups")
+    args = parser.parse_args()
+
+    # no versions directory here, only the process handling is under test
+    update.need_update = lambda active_dir=None: False
+    supervisor_module.CRASH_LOOP_WINDOW = 0.0  # crash on purpose back to back without the crash loop backoff
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exe = make_server_root(tmp, files=10, file_size=1024)
+        started = Event()
+
+        def factory(path_to_exe: str):
+            runtime = FakeServerRuntime(path_to_exe)
+            runtime.events.subscribe(events.ServerStarted, lambda event: started.set())
+            return runtime
+
+        sup = supervisor_module.Supervisor(runtime_factory=factory, path_to_exe=exe)
+        thread = Thread(target=sup.run, daemon=True)
+        thread.start()
+        if not started.wait(10):
+            raise RuntimeError("fake server did not start")
+
+        detect, back_up = [], []
+        for _ in range(args.crashes):
+            started.clear()
+            runtime = sup.runtime
+            sent = time.perf_counter()
+            runtime.send_command("crash")
+            if not started.wait(10):
+                raise RuntimeError("server was not restarted after a crash")
+            back_up.append(time.perf_counter() - sent)
+            detect.append(sup.last_exit_detected - sent)
+            # the fake server's own process start is most of back_up, detect is what the supervisor adds
+        print(f"{args.crashes} crashes: exit noticed p50 {statistics.median(detect) * 1000:.1f}ms "
+              f"max {max(detect) * 1000:.1f}ms, server back up p50 {statistics.median(back_up) * 1000:.0f}ms")
+        print("  (old maintain_loop: up to 1000ms to notice, then a fixed 5000ms sleep before restarting)")
+
+        wakeups = sup.wakeups
+        time.sleep(args.idle)
+        print(f"idle {args.idle:.0f}s: {sup.wakeups - wakeups} supervisor wakeups (old maintain_loop: {args.idle:.0f})")
+
+        # a stop we asked for is not a crash
+        crashes = sup.crashes
+        restarted = Event()
+        sup.call_soon(lambda: (sup._stop_runtime(), restarted.set()))  # noqa  # poking the internals on purpose
+        restarted.wait(10)
+        time.sleep(1)
+        if sup.crashes != crashes or sup.runtime is not None:
+            raise RuntimeError("a deliberate stop was treated as a crash")
+        print("deliberate stop not restarted: ok")
+
+        # timers fire on time and can be cancelled
+        fired = []
+        sup.call_later(0.2, lambda: fired.append(time.perf_counter()))
+        sup.call_later(0.1, lambda: fired.append("cancelled")).cancel()
+        scheduled = time.perf_counter()
+        time.sleep(0.5)
+        if len(fired) != 1 or fired[0] == "cancelled":
+            raise RuntimeError(f"timers misbehaved: {fired}")
+        print(f"call_later(0.2) fired after {(fired[0] - scheduled) * 1000:.0f}ms, cancelled timer skipped: ok")
+
+        sup.shutdown()
+        thread.join(10)
+
+
+if __name__ == '__main__':
+    main()
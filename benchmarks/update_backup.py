@@ -0,0 +1,79 @@
+"""
+Compares the pre-update backup that zipped the whole of active/current at deflate 9 with the one that stores only the
+config and worlds (the binaries and packs are rebuilt from versions/ on restore), on a synthetic server install and
+world, then restores the new backup and checks the rebuilt tree matches.
+
+    python -m benchmarks.update_backup --exe-mb 80 --pack-files 5000 --world-files 2000
+
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exe-mb", type=int, default=80)
+    parser.add_argument("--pack-files", type=int, default=5000)
+    parser.add_argument("--world-files", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data")
+        os.makedirs(os.path.join(data, "active"))
+        os.environ["MC_DATA_DIR"] = data
+        from mc import archive
+        from mc import paths
+        from mc import update
+        from benchmarks._synthetic import make_world
+        from benchmarks.update_promotion import make_version
+
+        versions_dir = paths.get_path_to_versions_dir()
+        make_version(os.path.join(versions_dir, "1.0.0.1"), args.exe_mb, args.pack_files, seed=1)
+        current = os.path.join(paths.get_path_to_active_dir(), "current")
+        shutil.copytree(os.path.join(versions_dir, "1.0.0.1"), current)
+        with open(os.path.join(current, "server.properties"), "a") as f:
+            f.write("max-players=20\n")
+        make_world(os.path.join(current, "worlds", "Bedrock level"), files=args.world_files)
+
+        # the original: the whole tree, deflate 9
+        old_path = os.path.join(tmp, "full.zip")
+        start = time.perf_counter()
+        with archive.ArchiveWriter(old_path, codec="deflate", level=9, workers=archive.get_archive_workers()) as w:
+            w.add_tree(current)
+        old_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        staging_dir = update.stage_update_backup("1.0.0.1", "1.0.0.2", current)
+        staged_seconds = time.perf_counter() - start
+        new_path = update.write_update_backup("1.0.0.1", "1.0.0.2", staging_dir)
+        new_seconds = time.perf_counter() - start
+
+        print(f"version: {args.exe_mb} MiB exe, {args.pack_files} pack files; world: {args.world_files} files")
+        print(f"  whole tree, deflate 9:    {old_seconds:6.2f}s  {os.path.getsize(old_path) / 1024 ** 2:7.1f} MiB")
+        print(f"  config and worlds only:   {new_seconds:6.2f}s  {os.path.getsize(new_path) / 1024 ** 2:7.1f} MiB "
+              f"({staged_seconds:.2f}s of it before the handover, codec {archive.get_backup_codec()})")
+
+        restored = os.path.join(tmp, "restored")
+        start = time.perf_counter()
+        version = update.restore_update_backup(new_path, restored)
+        restore_seconds = time.perf_counter() - start
+        mismatches = []
+
+        def compare(cmp: filecmp.dircmp):
+            mismatches.extend(cmp.left_only + cmp.right_only + cmp.diff_files)
+            for sub in cmp.subdirs.values():
+                compare(sub)
+
+        compare(filecmp.dircmp(current, restored))
+        if version != "1.0.0.1" or mismatches:
+            raise RuntimeError(f"restored tree does not match: {version} {mismatches[:10]}")
+        print(f"  restored onto versions/{version} in {restore_seconds:.2f}s, tree matches: ok")
+
+
+if __name__ == '__main__':
+    main()
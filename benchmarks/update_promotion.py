@@ -0,0 +1,146 @@
+"""
+Measures server downtime during update.try_update's promotion of a new version (cloning the version into active/,
+carrying over the config and worlds, swapping it in) against the original copytree/copytree/rmtree steps, on a
+synthetic server install and world. The pre-update backup is left out of both, it is the same work either way.
+
+Then fails the promotion once, at the rename that retires the old version, and checks it was rolled back (the worlds
+back in current, no .updating_to) and that the retried update goes through.
+
+    python -m benchmarks.update_promotion --exe-mb 80 --pack-files 5000 --world-files 3000
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+def make_version(root: str, exe_mb: int, pack_files: int, seed: int):
+    rng = random.Random(seed)
+    os.makedirs(root)
+    with open(os.path.join(root, "bedrock_server.exe"), "wb") as f:
+        for _ in range(exe_mb):
+            f.write(rng.randbytes(1024 ** 2))
+    for name in ("bedrock_server.pdb", "server.dll"):
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(rng.randbytes(2 * 1024 ** 2))
+    for name in ("server.properties", "allowlist.json", "permissions.json"):
+        with open(os.path.join(root, name), "w") as f:
+            f.write("level-name=Bedrock level\n" if name == "server.properties" else "[]\n")
+    for i in range(pack_files):
+        pack_dir = os.path.join(root, "behavior_packs" if i % 2 else "resource_packs", f"pack_{i % 50}")
+        os.makedirs(pack_dir, exist_ok=True)
+        with open(os.path.join(pack_dir, f"{i}.json"), "wb") as f:
+            f.write(rng.randbytes(4096))
+
+
+def old_promotion(src_path: str, active_dir: str, new_version: str):
+    """The original steps one, three, four and five of try_update"""
+    dst_path = os.path.join(active_dir, new_version)
+    path_to_current = os.path.join(active_dir, "current")
+    shutil.copytree(src_path, dst_path)
+    for file in ("allowlist.json", "permissions.json", "server.properties"):
+        src = os.path.join(path_to_current, file)
+        dst = os.path.join(dst_path, file)
+        if os.path.exists(dst):
+            os.remove(dst)
+        shutil.copy(src, dst)
+    src = os.path.join(path_to_current, "worlds")
+    dst = os.path.join(dst_path, "worlds")
+    if os.path.exists(dst):
+        shutil.rmtree(dst)
+    shutil.copytree(src, dst)
+    shutil.rmtree(path_to_current)
+    os.rename(dst_path, path_to_current)
+    with open(os.path.join(active_dir, ".version"), "w") as f:
+        f.write(new_version)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exe-mb", type=int, default=80)
+    parser.add_argument("--pack-files", type=int, default=5000)
+    parser.add_argument("--world-files", type=int, default=3000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data")
+        os.makedirs(os.path.join(data, "active"))
+        os.environ["MC_DATA_DIR"] = data
+        from mc import update
+        from mc import paths
+        from benchmarks._synthetic import make_world
+
+        versions_dir = paths.get_path_to_versions_dir()
+        active_dir = paths.get_path_to_active_dir()
+        make_version(os.path.join(versions_dir, "1.0.0.1"), args.exe_mb, args.pack_files, seed=1)
+        make_version(os.path.join(versions_dir, "1.0.0.2"), args.exe_mb, args.pack_files, seed=2)
+
+        def install_old_version():
+            current = os.path.join(active_dir, "current")
+            shutil.rmtree(current, ignore_errors=True)
+            shutil.copytree(os.path.join(versions_dir, "1.0.0.1"), current)
+            make_world(os.path.join(current, "worlds", "Bedrock level"), files=args.world_files)
+            with open(os.path.join(active_dir, ".version"), "w") as f:
+                f.write("1.0.0.1")
+            update.versions.get_catalog().invalidate()
+
+        install_old_version()
+        start = time.perf_counter()
+        old_promotion(os.path.join(versions_dir, "1.0.0.2"), active_dir, "1.0.0.2")
+        old_seconds = time.perf_counter() - start
+
+        install_old_version()
+        update.stage_update_backup = lambda *a, **k: None  # not part of the promotion, left out
+        start = time.perf_counter()
+        if not update.try_update():
+            raise RuntimeError("try_update did not update")
+        new_seconds = time.perf_counter() - start
+
+        world = os.path.join(active_dir, "current", "worlds", "Bedrock level", "db")
+        if len(os.listdir(world)) < args.world_files:
+            raise RuntimeError("worlds were not carried over")
+        exe = os.path.join(active_dir, "current", "bedrock_server.exe")
+        linked = os.stat(exe).st_nlink > 1
+
+        # fail the rename that retires the old version, once, after the worlds have been moved to the new one
+        install_old_version()
+        rename = os.rename
+
+        def failing_rename(src, dst):
+            if os.path.basename(dst).startswith(".retired_"):
+                os.rename = rename
+                raise PermissionError(f"benchmarking a failed promotion: {src}")
+            rename(src, dst)
+
+        os.rename = failing_rename
+        try:
+            update.try_update()
+            raise RuntimeError("try_update did not fail")
+        except PermissionError:
+            pass
+        finally:
+            os.rename = rename
+        update.versions.get_catalog().invalidate()
+        world = os.path.join(active_dir, "current", "worlds", "Bedrock level", "db")
+        rolled_back = (
+            os.path.isdir(world) and len(os.listdir(world)) >= args.world_files
+            and not os.path.exists(os.path.join(active_dir, ".updating_to"))
+            and paths.get_current_version() == "1.0.0.1" and update.need_update()
+        )
+        if not rolled_back:
+            raise RuntimeError("failed promotion was not rolled back")
+        if not update.try_update() or len(os.listdir(world)) < args.world_files:
+            raise RuntimeError("update after the rollback did not go through")
+
+        print(f"version: {args.exe_mb} MiB exe, {args.pack_files} pack files; world: {args.world_files} files")
+        print(f"  copytree promotion: {old_seconds:7.2f}s downtime")
+        print(f"  linked promotion:   {new_seconds:7.2f}s downtime (exe hardlinked: {linked})")
+        print("  failed promotion rolled back, worlds kept, retried update went through: ok")
+
+
+if __name__ == '__main__':
+    main()
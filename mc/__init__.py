@@ -5,8 +5,25 @@ import dotenv
 dotenv.load_dotenv("../.env")
 
 from . import paths  # noqa
+from . import governor  # noqa
+from . import metrics  # noqa
+from . import archive  # noqa
+from . import save_query  # noqa
+from . import events  # noqa
+from . import backup_store  # noqa
+from . import backup_catalog  # noqa
+from . import staging  # noqa
+from . import scheduler  # noqa
 from . import server_runtime  # noqa
+from . import restore  # noqa
+from . import versions  # noqa
+from . import discovery  # noqa
 from . import update  # noqa
 from . import downloads  # noqa
+from . import log_handlers  # noqa
+from . import log_index  # noqa
+from . import supervisor  # noqa
+from . import fleet  # noqa
+from . import async_runtime  # noqa
 
 from .server_runtime import ServerRuntime  # noqa
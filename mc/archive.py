@@ -0,0 +1,427 @@
+"""
+Holds the ArchiveWriter, which streams many files into a single zip archive through one open handle, and
+extract_archive, which unpacks one in parallel
+
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import zipfile
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from mc import governor
+
+_log = logging.getLogger(__name__)
+
+# codec name -> zipfile compression constant
+CODECS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "lzma": zipfile.ZIP_LZMA,
+}
+if hasattr(zipfile, "ZIP_ZSTANDARD"):  # python 3.14+
+    CODECS["zstd"] = zipfile.ZIP_ZSTANDARD
+
+# valid compression levels per codec, None means the codec ignores the level
+_CODEC_LEVELS = {
+    "stored": None,
+    "deflate": range(1, 10),
+    "lzma": None,  # zipfile ignores compresslevel for lzma
+    "zstd": range(1, 23),
+}
+
+_COPY_BUFFER_SIZE = 1024 ** 2
+
+# members bigger than this are streamed on the calling thread rather than buffered whole in a worker
+_PARALLEL_MAX_MEMBER_SIZE = 64 * 1024 ** 2
+
+
+def get_backup_codec() -> tuple[str, int | None]:
+    """
+    Get the codec and level to use for backups, from MC_BACKUP_CODEC and MC_BACKUP_LEVEL, falling back to deflate 9
+    (the historic behaviour) if either is missing or bad.
+
+    :return: (codec, level)
+    """
+    codec = os.environ.get("MC_BACKUP_CODEC", "deflate").replace("'", "").replace('"', "").strip().lower()
+    if codec not in CODECS:
+        _log.warning(f"MC_BACKUP_CODEC is set to '{codec}', which is not available, using deflate")
+        codec = "deflate"
+
+    level = None
+    level_str = os.environ.get("MC_BACKUP_LEVEL")
+    if level_str is not None:
+        try:
+            level = int(level_str.replace("'", "").replace('"', "").strip())
+        except ValueError:
+            _log.warning(f"MC_BACKUP_LEVEL is set to '{level_str}', which is not an integer, ignoring")
+
+    valid_levels = _CODEC_LEVELS[codec]
+    if valid_levels is None:
+        level = None
+    elif level is None:
+        level = max(valid_levels) if codec == "deflate" else 3
+    elif level not in valid_levels:
+        _log.warning(f"MC_BACKUP_LEVEL {level} is not valid for {codec}, using {max(valid_levels)}")
+        level = max(valid_levels)
+
+    return codec, level
+
+
+def get_archive_workers() -> int:
+    """
+    Get the number of compression workers from MC_ARCHIVE_WORKERS, defaulting to the number of cpus
+    """
+    default = os.cpu_count() or 1
+    workers_str = os.environ.get("MC_ARCHIVE_WORKERS")
+    if workers_str is None:
+        return default
+    try:
+        workers = int(workers_str.replace("'", "").replace('"', "").strip())
+    except ValueError:
+        _log.warning(f"MC_ARCHIVE_WORKERS is set to '{workers_str}', which is not an integer, using {default}")
+        return default
+    return max(workers, 1)
+
+
+def _compress_member(src: str, arcname: str, length: int | None, compress_type: int, level: int | None):
+    """
+    Read and compress a whole member in one go, run on the worker pool (zlib, lzma and bz2 all release the GIL)
+
+    :return: (ZipInfo with sizes and CRC filled in, compressed bytes)
+    """
+    zinfo = zipfile.ZipInfo.from_file(src, arcname)
+    zinfo.compress_type = compress_type
+    with open(src, "rb") as f:
+        data = f.read() if length is None else f.read(length)
+    governor.throttle(len(data))
+
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    compressor = zipfile._get_compressor(compress_type, level)  # noqa  # same compressor ZipFile.write would use
+    if compressor is None:  # stored
+        compressed = data
+    else:
+        compressed = compressor.compress(data) + compressor.flush()
+    zinfo.compress_size = len(compressed)
+    return zinfo, compressed
+
+
+class ArchiveWriter:
+    """
+    Writes files into a zip archive through a single open handle, so the central directory is only written once on
+    close (rather than once per member, as happens when reopening in 'a' mode per file).
+
+    The archive is written to a .partial file next to the destination and only renamed into place once it is closed
+    cleanly, so a crash part way through never leaves a truncated zip that looks like a real backup.
+
+    Use as a context manager:
+
+        with ArchiveWriter(path, codec="deflate", level=9) as writer:
+            writer.add_tree(world_path)
+
+    With workers > 1, add_files/add_tree compress members concurrently on a thread pool, and the compressed members
+    are then written into the archive in order on the calling thread.
+
+    """
+
+    def __init__(self, path: str, codec: str = "deflate", level: int | None = 9, workers: int = 1):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown or unavailable codec: {codec}, expected one of {list(CODECS)}")
+
+        valid_levels = _CODEC_LEVELS[codec]
+        if valid_levels is None:
+            level = None
+        elif level is not None and level not in valid_levels:
+            raise ValueError(f"Invalid level for {codec}: {level}")
+
+        self.path = path
+        self.codec = codec
+        self.level = level
+        self.workers = max(workers, 1)
+        self.bytes_in = 0
+        self.files_written = 0
+
+        self._partial_path = path + ".partial"
+        self._zip = zipfile.ZipFile(
+            self._partial_path, 'w', CODECS[codec], compresslevel=level
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def bytes_out(self) -> int:
+        """Size of the finished archive on disk (only meaningful after close)"""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def add_file(self, src: str, arcname: str, length: int | None = None) -> int:
+        """
+        Stream a file into the archive.
+
+        :param src: path to the file on disk
+        :param arcname: name of the member inside the archive
+        :param length: if given, only the first `length` bytes of the file are stored
+        :return: the number of bytes stored
+        """
+        zinfo = zipfile.ZipInfo.from_file(src, arcname)
+        zinfo.compress_type = self._zip.compression
+        zinfo._compresslevel = self._zip.compresslevel  # noqa  # how ZipFile.write passes the level through
+
+        written = 0
+        with open(src, "rb") as f_in, self._zip.open(zinfo, 'w') as f_out:
+            while length is None or written < length:
+                chunk = f_in.read(_COPY_BUFFER_SIZE if length is None else min(_COPY_BUFFER_SIZE, length - written))
+                if not chunk:
+                    break
+                governor.throttle(len(chunk))
+                f_out.write(chunk)
+                governor.written(self._zip.fp, len(chunk))
+                written += len(chunk)
+
+        self.bytes_in += written
+        self.files_written += 1
+        return written
+
+    def _write_compressed(self, zinfo: zipfile.ZipInfo, compressed: bytes):
+        """
+        Write an already compressed member, mirroring what ZipFile does internally when a member is written
+        """
+        zf = self._zip
+        if zinfo.compress_type == zipfile.ZIP_LZMA:
+            zinfo.flag_bits |= 0x02  # compressed data includes an end-of-stream marker
+        zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+        with zf._lock:  # noqa
+            zf.fp.seek(zf.start_dir)
+            zinfo.header_offset = zf.fp.tell()
+            zf._writecheck(zinfo)  # noqa
+            zf._didModify = True  # noqa
+            zf.fp.write(zinfo.FileHeader(zip64))
+            zf.fp.write(compressed)
+            governor.written(zf.fp, len(compressed))
+            zf.filelist.append(zinfo)
+            zf.NameToInfo[zinfo.filename] = zinfo
+            zf.start_dir = zf.fp.tell()
+
+        self.bytes_in += zinfo.file_size
+        self.files_written += 1
+
+    def add_files(self, files: list[tuple[str, str, int | None]]) -> int:
+        """
+        Add many files, compressing them concurrently if this writer has more than one worker. Files that cannot be
+        read (e.g. locked by the server) are skipped and logged.
+
+        :param files: list of (path on disk, name in the archive, length to store or None for the whole file)
+        :return: the number of files stored
+        """
+        if self.workers == 1:
+            count = 0
+            for src, arcname, length in files:
+                try:
+                    self.add_file(src, arcname, length=length)
+                    count += 1
+                except Exception as e:
+                    _log.debug(f"Error adding file to archive: {e}")
+            return count
+
+        count = 0
+        max_in_flight = self.workers * 2  # bounds the compressed data held in memory
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="archive",
+                                initializer=governor.maintenance_thread) as pool:
+            in_flight = []
+
+            def drain(keep: int):
+                nonlocal count
+                while len(in_flight) > keep:
+                    arcname, future = in_flight.pop(0)
+                    try:
+                        self._write_compressed(*future.result())
+                        count += 1
+                    except Exception as e:
+                        _log.debug(f"Error adding file to archive: {e}")
+
+            for src, arcname, length in files:
+                try:
+                    size = os.path.getsize(src) if length is None else length
+                except OSError as e:
+                    _log.debug(f"Error adding file to archive: {e}")
+                    continue
+
+                if size > _PARALLEL_MAX_MEMBER_SIZE:
+                    drain(0)  # keep members in order
+                    try:
+                        self.add_file(src, arcname, length=length)
+                        count += 1
+                    except Exception as e:
+                        _log.debug(f"Error adding file to archive: {e}")
+                    continue
+
+                in_flight.append((arcname, pool.submit(
+                    _compress_member, src, arcname, length, self._zip.compression, self.level
+                )))
+                drain(max_in_flight)
+            drain(0)
+        return count
+
+    def add_tree(self, root: str) -> int:
+        """
+        Walk a directory and add every file in it to the archive, relative to root. Files that cannot be read (e.g.
+        locked by the server) are skipped and logged.
+
+        :return: the number of files stored
+        """
+        files = []
+        for dir_path, dirs, file_names in os.walk(root):
+            for file in file_names:
+                src = os.path.join(dir_path, file)
+                files.append((src, os.path.relpath(src, root), None))
+        return self.add_files(files)
+
+    def close(self):
+        if self._zip is None:
+            return
+        self._zip.close()
+        self._zip = None
+        os.replace(self._partial_path, self.path)
+
+    def abort(self):
+        """Close and throw away the partially written archive"""
+        if self._zip is None:
+            return
+        try:
+            self._zip.close()
+        except Exception:  # noqa  # we are throwing it away anyway
+            pass
+        self._zip = None
+        try:
+            os.remove(self._partial_path)
+        except OSError:  # noqa  # doesn't matter, quick cleanup
+            pass
+
+
+# local file header: signature, versions, flags, method, time, date, crc, sizes, then the name and extra lengths
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+def _member_path(dst_dir: str, filename: str) -> str:
+    """
+    :return: where a member is extracted to, refusing names that would land outside dst_dir
+    """
+    parts = [p for p in filename.replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or ".." in parts or os.path.isabs(filename) or os.path.splitdrive(filename)[0]:
+        raise zipfile.BadZipFile(f"Unsafe member name in archive: {filename}")
+    return os.path.join(dst_dir, *parts)
+
+
+def _extract_member(mm: mmap.mmap, zinfo: zipfile.ZipInfo, dst: str) -> int:
+    """
+    Decompress one member straight out of the mapped archive into dst, checking its CRC, run on the worker pool
+    (zlib releases the GIL)
+
+    :return: the number of bytes written
+    """
+    header = _LOCAL_HEADER.unpack_from(mm, zinfo.header_offset)
+    if header[0] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {zinfo.filename}")
+    start = zinfo.header_offset + _LOCAL_HEADER.size + header[9] + header[10]
+
+    # every view of the mapping is released in a with block, even on error, or the mmap can't be closed
+    crc = 0
+    written = 0
+    with memoryview(mm) as view, view[start:start + zinfo.compress_size] as data, open(dst, "wb") as f:
+        if zinfo.compress_type == zipfile.ZIP_STORED:
+            for i in range(0, len(data), _COPY_BUFFER_SIZE):
+                with data[i:i + _COPY_BUFFER_SIZE] as chunk:
+                    governor.throttle(len(chunk))
+                    crc = zlib.crc32(chunk, crc)
+                    written += f.write(chunk)
+                    governor.written(f, len(chunk))
+        else:  # deflate, anything else is handed to zipfile by the caller
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            for i in range(0, len(data), _COPY_BUFFER_SIZE):
+                with data[i:i + _COPY_BUFFER_SIZE] as compressed:
+                    chunk = decompressor.decompress(compressed, _COPY_BUFFER_SIZE)
+                    while chunk:
+                        governor.throttle(len(chunk))
+                        crc = zlib.crc32(chunk, crc)
+                        written += f.write(chunk)
+                        governor.written(f, len(chunk))
+                        # bounded output per call, so a highly compressible member never balloons in memory
+                        chunk = decompressor.decompress(decompressor.unconsumed_tail, _COPY_BUFFER_SIZE)
+            tail = decompressor.flush()
+            crc = zlib.crc32(tail, crc)
+            written += f.write(tail)
+
+    if written != zinfo.file_size or crc != zinfo.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC or size for {zinfo.filename}")
+    return written
+
+
+def _extract_member_zipfile(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, dst: str) -> int:
+    # zipfile checks the CRC itself as the member is read to the end
+    with zf.open(zinfo) as f_in, open(dst, "wb") as f_out:
+        while chunk := f_in.read(_COPY_BUFFER_SIZE):
+            governor.throttle(len(chunk))
+            f_out.write(chunk)
+            governor.written(f_out, len(chunk))
+        return f_out.tell()
+
+
+def extract_archive(path: str, dst_dir: str, workers: int | None = None, select=None) -> int:
+    """
+    Extract every member of a zip archive into dst_dir, verifying each member's CRC.
+
+    The archive is memory mapped and members are decompressed concurrently straight from the mapping, so each
+    compressed byte is read from disk once without being copied through read() buffers. Stored and deflated members
+    (everything the Bedrock server zips use) take that path, anything else goes through zipfile.
+
+    :param workers: threads to decompress with, defaults to get_archive_workers()
+    :param select: called with each member's name, returns the name to extract it as (relative to dst_dir) or None to
+        skip it, by default every member is extracted as it is named
+    :return: the number of bytes extracted
+    :raises zipfile.BadZipFile: if a member is corrupt or has an unsafe name, some members may already be extracted
+    """
+    workers = workers if workers is not None else get_archive_workers()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+
+        with zipfile.ZipFile(f) as zf:
+            members = []
+            for zinfo in zf.infolist():
+                name = zinfo.filename if select is None else select(zinfo.filename)
+                if name is None:
+                    continue
+                dst = _member_path(dst_dir, name)
+                if zinfo.is_dir():
+                    os.makedirs(dst, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                members.append((zinfo, dst))
+
+            def extract(zinfo: zipfile.ZipInfo, dst: str) -> int:
+                if zinfo.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) and not zinfo.flag_bits & 0x1:
+                    return _extract_member(mm, zinfo, dst)
+                return _extract_member_zipfile(zf, zinfo, dst)
+
+            if workers == 1:
+                return sum(extract(zinfo, dst) for zinfo, dst in members)
+
+            # largest first, so one big member doesn't start last and hold up the finish
+            members.sort(key=lambda m: m[0].file_size, reverse=True)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract",
+                                    initializer=governor.maintenance_thread) as pool:
+                futures = [pool.submit(extract, zinfo, dst) for zinfo, dst in members]
+                return sum(future.result() for future in futures)
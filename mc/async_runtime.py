@@ -0,0 +1,295 @@
+"""
+Holds the AsyncServerRuntime, an asyncio alternative to ServerRuntime for code that wants to await the server's answers
+
+Pipe reading, command responses and the save hold of a backup run on the caller's event loop, with only blocking file
+work pushed to executor threads. Supervising the server (restarts, timed backups, updates) is left to the Supervisor.
+Commands can wait for the server's answer:
+
+    lines = await runtime.command("list", expect=r"players online", timeout=5)
+
+"""
+
+import os
+import re
+import asyncio
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from mc import staging
+from mc import save_query
+from mc import events
+from mc import governor
+from mc import metrics
+from mc import server_runtime
+
+_print_log = logging.getLogger("out")
+_log = logging.getLogger(__name__)
+
+
+def _stage_unthrottled(world_path: str, staging_dir: str, to_copy: list[tuple[str, int | None]]) -> dict[str, int]:
+    with governor.unthrottled():  # the server is holding its saves until this is done
+        return staging.stage_files(world_path, staging_dir, to_copy)
+
+
+class _OutputWaiter:
+    def __init__(self, predicate, future: asyncio.Future):
+        self.predicate = predicate
+        self.future = future
+        self.lines: list[str] = []
+
+
+class AsyncServerRuntime:
+    def __init__(self, path_to_exe: str):
+        if not os.path.isfile(path_to_exe):
+            raise FileNotFoundError(f"Could not find executable: {path_to_exe}")
+
+        self.path_to_exe = path_to_exe
+        self._current_level_name = None
+        self.process: asyncio.subprocess.Process | None = None
+        self._readers: list[asyncio.Task] = []
+        self._waiters: list[_OutputWaiter] = []
+        self._stdout_listeners = []
+        self.events = events.EventParser()
+        self._archive_tasks: set[asyncio.Task] = set()
+        self._archive_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="backup", initializer=governor.maintenance_thread
+        )
+        self._backup_lock = asyncio.Lock()
+        self.last_backup_hold_seconds = None
+
+    def _popen_args(self):
+        """
+        What to launch, overridden to run a stand-in server in the benchmarks
+        """
+        return self.path_to_exe
+
+    def get_current_level_name(self):
+        if self._current_level_name is None:
+            self._current_level_name = server_runtime.read_level_name(self.path_to_exe)
+        return self._current_level_name
+
+    def started(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def add_stdout_listener(self, listener):
+        """
+        Register a callable to be called with every line the server writes to stdout (on the event loop)
+        """
+        self._stdout_listeners.append(listener)
+
+    def remove_stdout_listener(self, listener):
+        try:
+            self._stdout_listeners.remove(listener)
+        except ValueError:
+            pass
+
+    async def start(self):
+        self.get_current_level_name()  # initialize level name before starting
+
+        if self.process is not None:
+            raise RuntimeError("Process already running")
+
+        args = self._popen_args()
+        if isinstance(args, str):
+            args = [args]
+        self.process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self._readers = [
+            asyncio.create_task(self._read_stdout(self.process.stdout)),
+            asyncio.create_task(self._read_stderr(self.process.stderr)),
+        ]
+
+    async def _read_stdout(self, stream: asyncio.StreamReader):
+        _print_log.info("Starting stdout reader")
+        try:
+            while True:
+                raw = await stream.readline()
+                if not raw:
+                    return
+                line = raw.decode(errors="replace").rstrip("\r\n")
+                _print_log.info(line)
+                self.events.feed(line)
+
+                for listener in list(self._stdout_listeners):
+                    try:
+                        listener(line)
+                    except Exception as e:
+                        _log.error(f"Error in stdout listener: {e}")
+
+                for waiter in list(self._waiters):
+                    if waiter.future.done():
+                        continue
+                    waiter.lines.append(line)
+                    try:
+                        matched = waiter.predicate(line)
+                    except Exception as e:
+                        waiter.future.set_exception(e)
+                        continue
+                    if matched:
+                        waiter.future.set_result(waiter.lines)
+        except Exception as e:
+            _log.error(f"Error reading stdout: {e}, dying...")
+
+    async def _read_stderr(self, stream: asyncio.StreamReader):
+        _print_log.info("Starting stderr reader")
+        try:
+            while True:
+                raw = await stream.readline()
+                if not raw:
+                    return
+                line = raw.decode(errors="replace").rstrip("\r\n")
+                _print_log.error(line)
+                self.events.feed(line, is_stderr=True)
+        except Exception as e:
+            _log.error(f"Error reading stderr: {e}, dying...")
+
+    async def command(self, message: str, expect=None, timeout: float = 10.0) -> list[str]:
+        """
+        Write a command to the server, optionally waiting for its answer.
+
+        :param message: the command
+        :param expect: a regex (string or compiled) or a callable taking a line and returning a bool. If given, we
+            wait for the first stdout line after the command that matches
+        :param timeout: seconds to wait for a matching line, raises asyncio.TimeoutError if none arrives
+        :return: every stdout line read after the command was sent, up to and including the matching one (empty if
+            expect was not given)
+        """
+        if not self.started():
+            raise RuntimeError("Server not started")
+
+        waiter = None
+        if expect is not None:
+            if callable(expect):
+                predicate = expect
+            else:
+                pattern = re.compile(expect) if isinstance(expect, str) else expect
+                predicate = lambda line: pattern.search(line) is not None  # noqa
+            waiter = _OutputWaiter(predicate, asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)  # registered before writing, so we can't miss a fast answer
+
+        try:
+            self.process.stdin.write((message + "\n").encode())
+            _print_log.info(f">>> {message}")
+            await self.process.stdin.drain()
+            if waiter is None:
+                return []
+            return await asyncio.wait_for(waiter.future, timeout)
+        finally:
+            if waiter is not None:
+                self._waiters.remove(waiter)
+
+    async def query_save_files(self, timeout: float = 60, retry_interval: float = 1) -> list[tuple[str, int]] | None:
+        """
+        Send `save query` until the server reports the held data is ready to copy. Assumes `save hold` has been sent.
+
+        :return: list of (path relative to the worlds dir, length to copy), or None if the server never answered
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+
+            waiter = save_query.SaveQueryWaiter()
+            self.events.subscribe(events.SaveQueryResult, waiter.on_result)
+            self.events.subscribe(events.SaveQueryNotReady, waiter.on_not_ready)
+            try:
+                # the parser sees each line before command waiters do, so the waiter is already answered by then
+                await self.command("save query", expect=lambda _: waiter.answered,  # noqa  # this attempt's waiter
+                                   timeout=min(remaining, retry_interval * 5))
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                self.events.unsubscribe(events.SaveQueryResult, waiter.on_result)
+                self.events.unsubscribe(events.SaveQueryNotReady, waiter.on_not_ready)
+            if waiter.ready:
+                return waiter.files
+            await asyncio.sleep(min(retry_interval, max(deadline - loop.time(), 0)))
+
+    async def backup(self) -> asyncio.Task:
+        """
+        Back up the current world, staging the files the server lists while saves are held, then archiving the staged
+        copy in the background.
+
+        :return: a Task that completes when the background archive has been written
+        """
+        if not self.started():
+            raise RuntimeError("Server not started")
+        if self._backup_lock.locked():
+            raise RuntimeError("Backup already in progress")
+
+        loop = asyncio.get_running_loop()
+        async with self._backup_lock:
+            await self.command("say Backing up server...")
+
+            level_name = self.get_current_level_name()
+            world_path = os.path.join(os.path.dirname(self.path_to_exe), "worlds", level_name)
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            staging_dir = server_runtime.get_staging_dir(self.path_to_exe, level_name, timestamp)
+
+            await self.command("save hold")
+            hold_start = loop.time()
+            try:
+                files = await self.query_save_files()
+                to_copy = await loop.run_in_executor(None, server_runtime.world_files_to_copy, world_path, files)
+                counts = await loop.run_in_executor(None, _stage_unthrottled, world_path, staging_dir, to_copy)
+            finally:  # never leave the server holding saves
+                if self.started():
+                    await self.command("save resume")
+                self.last_backup_hold_seconds = loop.time() - hold_start
+                metrics.save_hold_seconds.observe(self.last_backup_hold_seconds, world=level_name)
+            _log.info(f"Save hold released after {self.last_backup_hold_seconds:.3f}s, staged {counts}")
+
+        task = asyncio.create_task(self._archive_staged(staging_dir, level_name, timestamp))
+        self._archive_tasks.add(task)
+        task.add_done_callback(self._archive_tasks.discard)
+        return task
+
+    async def _archive_staged(self, staging_dir: str, level_name: str, timestamp: str):
+        await asyncio.get_running_loop().run_in_executor(
+            self._archive_executor, server_runtime.archive_staged_backup, staging_dir, level_name, timestamp
+        )
+        if self.started():
+            try:
+                await self.command("say Backup complete!")
+            except Exception:  # noqa  # server may have stopped in the meantime
+                pass
+
+    async def wait(self) -> int:
+        """
+        Wait for the server process to exit
+
+        :return: its exit code
+        """
+        if self.process is None:
+            raise RuntimeError("Server not started")
+        return await self.process.wait()
+
+    async def stop(self, timeout: float = 5.0):
+        if self.process is None:
+            return
+
+        process = self.process
+        if process.returncode is None:
+            try:
+                await self.command("stop")
+            except (ConnectionError, RuntimeError) as e:
+                _log.debug(f"Could not send stop: {e}")
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                _log.warning(f"Server did not stop within {timeout} seconds, killing")
+                process.kill()
+                await process.wait()
+
+        await asyncio.gather(*self._readers, return_exceptions=True)
+        for waiter in self._waiters:
+            if not waiter.future.done():
+                waiter.future.cancel()
+        self.process = None
+        self._readers = []
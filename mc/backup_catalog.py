@@ -0,0 +1,348 @@
+"""
+Holds the BackupCatalog, a persistent SQLite index of every backup, and the RetentionPolicy used to prune them
+
+Every backup written (runtime zips, incremental snapshots and pre-update backups) is recorded here with its instance,
+world, time, size, codec, source version and checksum, so listing and "latest backup for world X" never need to walk
+the backup directory. The instance is the fleet server the backup was taken of (see mc.fleet and
+paths.get_instance_name), None for the server in the default active dir, so servers sharing a level name (they all
+default to "Bedrock level") never share each other's backups or retention.
+
+"""
+
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import datetime
+from threading import RLock
+from mc import paths
+from mc import backup_store
+
+_log = logging.getLogger(__name__)
+
+KIND_RUNTIME = "runtime"  # zip of one world, written by ServerRuntime.backup
+KIND_SNAPSHOT = "snapshot"  # incremental snapshot in the BackupStore, path is the snapshot id
+KIND_UPDATE = "update"  # zip of the config and worlds carried over by an update, see update.stage_update_backup
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    instance TEXT,
+    world TEXT,
+    created REAL NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    codec TEXT,
+    source_version TEXT,
+    checksum TEXT
+);
+CREATE INDEX IF NOT EXISTS backups_world_created ON backups (world, created);
+CREATE INDEX IF NOT EXISTS backups_kind_created ON backups (kind, created);
+"""
+
+_COLUMNS = ("id", "kind", "instance", "world", "created", "path", "size", "codec", "source_version", "checksum")
+
+_timestamp_pattern = re.compile(r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}")
+
+
+def get_path_to_catalog() -> str:
+    return os.path.join(paths.get_path_to_backup_dir(), "catalog.sqlite3")
+
+
+def file_checksum(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _env_int(name: str, default: int | None) -> int | None:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    value = value.replace("'", "").replace('"', "").strip()
+    if value.lower() in ("", "none"):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        _log.warning(f"{name} is set to '{value}', which is not an integer, using {default}")
+        return default
+
+
+class RetentionPolicy:
+    """
+    Grandfather-father-son retention. Within each (kind, instance, world) group, a backup is kept if it is the newest
+    backup in one of the `hourly` most recent hours, `daily` most recent days or `weekly` most recent ISO weeks that
+    have backups. Anything older than `max_age` is dropped regardless. The newest backup of each group is always kept.
+
+    A cap of None means unlimited for that tier.
+
+    """
+
+    def __init__(self, hourly: int | None = 48, daily: int | None = 14, weekly: int | None = 8,
+                 max_age: datetime.timedelta | None = None):
+        self.hourly = hourly
+        self.daily = daily
+        self.weekly = weekly
+        self.max_age = max_age
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        max_age_days = _env_int("MC_RETENTION_MAX_AGE_DAYS", None)
+        return cls(
+            hourly=_env_int("MC_RETENTION_HOURLY", 48),
+            daily=_env_int("MC_RETENTION_DAILY", 14),
+            weekly=_env_int("MC_RETENTION_WEEKLY", 8),
+            max_age=datetime.timedelta(days=max_age_days) if max_age_days is not None else None,
+        )
+
+    def select_keep(self, created: list[tuple[int, float]], now: float) -> set[int]:
+        """
+        :param created: (id, created timestamp) for one group
+        :param now: current timestamp
+        :return: the ids to keep
+        """
+        if not created:
+            return set()
+        newest_first = sorted(created, key=lambda c: c[1], reverse=True)
+        keep = {newest_first[0][0]}
+
+        tiers = (
+            (self.hourly, lambda d: (d.year, d.month, d.day, d.hour)),
+            (self.daily, lambda d: (d.year, d.month, d.day)),
+            (self.weekly, lambda d: d.isocalendar()[:2]),
+        )
+        for cap, bucket_of in tiers:
+            seen = set()
+            for backup_id, ts in newest_first:
+                bucket = bucket_of(datetime.datetime.fromtimestamp(ts))
+                if bucket in seen:
+                    continue
+                if cap is not None and len(seen) >= cap:
+                    break
+                seen.add(bucket)
+                keep.add(backup_id)
+
+        if self.max_age is not None:
+            cutoff = now - self.max_age.total_seconds()
+            keep = {backup_id for backup_id, ts in newest_first if backup_id in keep and ts >= cutoff}
+            keep.add(newest_first[0][0])
+
+        return keep
+
+
+class BackupCatalog:
+    def __init__(self, path: str | None = None):
+        self.path = path if path is not None else get_path_to_catalog()
+        is_new = not os.path.exists(self.path)
+
+        self.__lock = RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+        if is_new:
+            self.import_existing()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self.__lock:
+            self._conn.close()
+
+    def record(self, kind: str, path: str, world: str | None = None, instance: str | None = None,
+               created: float | None = None, size: int | None = None, codec: str | None = None,
+               source_version: str | None = None, checksum: str | None = None) -> int:
+        """
+        Record a backup, replacing any existing entry for the same path
+
+        :param instance: the fleet server it was taken of, None for the default server
+        :return: the backup id
+        """
+        if created is None:
+            created = datetime.datetime.now().timestamp()
+        with self.__lock:
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO backups "
+                "(kind, instance, world, created, path, size, codec, source_version, checksum) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, instance, world, created, path, size, codec, source_version, checksum)
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def list_backups(self, world: str | None = None, kind: str | None = None,
+                     instance: str | None = None) -> list[dict]:
+        """
+        :param instance: only this fleet server's, by default every server's
+        :return: backups as dicts, oldest first
+        """
+        query = f"SELECT {', '.join(_COLUMNS)} FROM backups"
+        clauses, args = [], []
+        if instance is not None:
+            clauses.append("instance = ?")
+            args.append(instance)
+        if world is not None:
+            clauses.append("world = ?")
+            args.append(world)
+        if kind is not None:
+            clauses.append("kind = ?")
+            args.append(kind)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY created"
+        with self.__lock:
+            return [dict(zip(_COLUMNS, row)) for row in self._conn.execute(query, args)]
+
+    def get(self, backup_id: int) -> dict | None:
+        with self.__lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM backups WHERE id = ?", (backup_id,)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row is not None else None
+
+    def latest(self, world: str, kind: str | None = None, instance: str | None = None) -> dict | None:
+        """
+        :param instance: the fleet server the world is on, None for the default server
+        """
+        query = f"SELECT {', '.join(_COLUMNS)} FROM backups WHERE world = ? AND instance IS ?"
+        args = [world, instance]
+        if kind is not None:
+            query += " AND kind = ?"
+            args.append(kind)
+        query += " ORDER BY created DESC LIMIT 1"
+        with self.__lock:
+            row = self._conn.execute(query, args).fetchone()
+        return dict(zip(_COLUMNS, row)) if row is not None else None
+
+    def source_versions(self, kind: str | None = None) -> set[str]:
+        """
+        :return: the server versions backups were taken from
+        """
+        query = "SELECT DISTINCT source_version FROM backups WHERE source_version IS NOT NULL"
+        args = []
+        if kind is not None:
+            query += " AND kind = ?"
+            args.append(kind)
+        with self.__lock:
+            return {row[0] for row in self._conn.execute(query, args)}
+
+    def import_existing(self):
+        """
+        Record any backups already on disk from before the catalog existed. This is the only directory walk the
+        catalog ever does, and only runs when the catalog is first created.
+        """
+        backup_dir = paths.get_path_to_backup_dir()
+        if not os.path.isdir(backup_dir):
+            return
+
+        # (kind, instance, world, directory): backup/<level-name>/, backup/instances/<instance>/<level-name>/,
+        # backup/updates/ and backup/updates/<instance>/
+        zip_dirs = []
+        for name in os.listdir(backup_dir):
+            sub_dir = os.path.join(backup_dir, name)
+            if not os.path.isdir(sub_dir) or name.startswith(".") or name == "store":
+                continue
+            if name == "updates":
+                zip_dirs.append((KIND_UPDATE, None, None, sub_dir))
+                zip_dirs.extend((KIND_UPDATE, instance, None, os.path.join(sub_dir, instance))
+                                for instance in os.listdir(sub_dir) if os.path.isdir(os.path.join(sub_dir, instance)))
+            elif name == "instances":
+                for instance in os.listdir(sub_dir):
+                    instance_dir = os.path.join(sub_dir, instance)
+                    if os.path.isdir(instance_dir):
+                        zip_dirs.extend((KIND_RUNTIME, instance, world, os.path.join(instance_dir, world))
+                                        for world in os.listdir(instance_dir)
+                                        if os.path.isdir(os.path.join(instance_dir, world)))
+            else:
+                zip_dirs.append((KIND_RUNTIME, None, name, sub_dir))
+
+        count = 0
+        for kind, instance, world, sub_dir in zip_dirs:
+            for file in os.listdir(sub_dir):
+                if not file.endswith(".zip"):
+                    continue
+                path = os.path.join(sub_dir, file)
+                match = _timestamp_pattern.search(file)
+                if match is not None:
+                    created = datetime.datetime.strptime(match.group(0), "%Y-%m-%d_%H-%M-%S").timestamp()
+                else:
+                    created = os.path.getmtime(path)
+                source_version = file.split("_to_")[0] if kind == KIND_UPDATE else None
+                self.record(kind, path, world=world, instance=instance, created=created, size=os.path.getsize(path),
+                            source_version=source_version)
+                count += 1
+
+        # incremental snapshots
+        if os.path.isdir(backup_store.get_path_to_store_dir()):
+            for snapshot_id in backup_store.BackupStore().list_snapshots():
+                # <level-name>/<time> or <instance>/<level-name>/<time>, <time>-1 etc. for another in the same second
+                world, name = snapshot_id.rsplit("/", 1)
+                instance, _, world = world.rpartition("/")
+                created = datetime.datetime.strptime(name[:19], "%Y-%m-%d_%H-%M-%S").timestamp()
+                self.record(KIND_SNAPSHOT, snapshot_id, world=world, instance=instance or None, created=created,
+                            codec="zlib")
+                count += 1
+
+        if count:
+            _log.info(f"Imported {count} existing backups into the catalog")
+
+    def prune(self, policy: RetentionPolicy, now: float | None = None) -> list[dict]:
+        """
+        Apply the retention policy to every (kind, instance, world) group in one pass, deleting the pruned backups from
+        disk and from the catalog.
+
+        :return: the pruned backups
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+
+        with self.__lock:
+            groups: dict[tuple, list[tuple[int, float]]] = {}
+            rows = {}
+            for row in self.list_backups():
+                group = (row["kind"], row["instance"], row["world"])
+                groups.setdefault(group, []).append((row["id"], row["created"]))
+                rows[row["id"]] = row
+
+            to_delete = []
+            for group in groups.values():
+                keep = policy.select_keep(group, now)
+                to_delete.extend(rows[backup_id] for backup_id, _ in group if backup_id not in keep)
+
+            if not to_delete:
+                return []
+
+            store = None
+            deleted = []
+            for row in to_delete:
+                try:
+                    if row["kind"] == KIND_SNAPSHOT:
+                        if store is None:
+                            store = backup_store.BackupStore()
+                        store.delete_snapshot(row["path"])
+                    else:
+                        os.remove(row["path"])
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    # e.g. a zip that is open on windows, its row stays so the next prune tries again
+                    _log.error(f"Error deleting backup {row['path']}, keeping it for the next prune: {e}")
+                    continue
+                deleted.append(row)
+
+            self._conn.executemany("DELETE FROM backups WHERE id = ?", [(row["id"],) for row in deleted])
+            self._conn.commit()
+
+        if store is not None:
+            store.gc()
+        _log.info(f"Pruned {len(deleted)} backups")
+        return deleted
@@ -0,0 +1,293 @@
+"""
+Holds the BackupStore, a content-addressed, deduplicating backup repository
+
+Files are split into fixed size chunks, and each unique chunk is stored once (compressed) under its sha256. A snapshot
+is then just a small JSON manifest listing each file and the chunks that make it up, so an hourly backup of a LevelDB
+world only costs the chunks that actually changed (most .ldb files are immutable between backups).
+
+Layout, under <backup dir>/store:
+
+    objects/ab/abcdef0123...        zlib compressed chunk, named by the sha256 of the uncompressed data
+    snapshots/<level-name>/<time>.json    (<time>-1.json etc. for more than one in the same second)
+    snapshots/<instance>/<level-name>/<time>.json    the same, for a server in a fleet (see mc.fleet)
+
+Every BackupStore on the same root shares one lock, so a gc() from one (e.g. pruning through the catalog) never runs
+while another is in the middle of a snapshot, whose chunks aren't referenced until its manifest is written.
+
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+import time
+import datetime
+from threading import Lock, RLock
+from concurrent.futures import ThreadPoolExecutor
+from mc import paths
+from mc import archive
+from mc import governor
+
+_log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 ** 2
+_COMPRESS_LEVEL = 6
+_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+_root_locks: dict[str, RLock] = {}
+_root_locks_lock = Lock()
+
+
+def get_path_to_store_dir() -> str:
+    return os.path.join(paths.get_path_to_backup_dir(), "store")
+
+
+def _get_root_lock(root: str) -> RLock:
+    key = os.path.normcase(os.path.realpath(root))
+    with _root_locks_lock:
+        lock = _root_locks.get(key)
+        if lock is None:
+            lock = _root_locks[key] = RLock()
+        return lock
+
+
+class BackupStore:
+    def __init__(self, root: str | None = None):
+        self.root = root if root is not None else get_path_to_store_dir()
+        self._objects_dir = os.path.join(self.root, "objects")
+        self._snapshots_dir = os.path.join(self.root, "snapshots")
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._snapshots_dir, exist_ok=True)
+        self.last_bytes_read = 0  # of the last snapshot
+        self.last_bytes_written = 0  # new chunks it stored, compressed
+
+        self.__lock = _get_root_lock(self.root)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def _snapshot_path(self, snapshot_id: str) -> str:
+        world_name, name = snapshot_id.rsplit("/", 1)
+        return os.path.join(self._snapshots_dir, *world_name.split("/"), name + ".json")
+
+    def _put_chunk(self, data: bytes) -> tuple[str, int]:
+        """
+        Store a chunk if we don't already have it
+
+        :return: (digest, bytes written to disk, 0 if the chunk was already stored)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        try:
+            os.utime(path)  # reused, so a gc that started before now leaves it alone
+            return digest, 0
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, _COMPRESS_LEVEL)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return digest, len(compressed)
+
+    def _get_chunk(self, digest: str) -> bytes:
+        with open(self._object_path(digest), "rb") as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk is corrupt: {digest}")
+        return data
+
+    def list_snapshots(self, world_name: str | None = None) -> list[str]:
+        """
+        :param world_name: only this world's, "<level-name>" or "<instance>/<level-name>"
+        :return: snapshot ids ("<level-name>/<time>", or "<instance>/<level-name>/<time>"), oldest first
+        """
+        if world_name is None:
+            world_dirs = sorted(dir_path for dir_path, dirs, names in os.walk(self._snapshots_dir)
+                                if any(name.endswith(".json") for name in names))
+        else:
+            world_dirs = [os.path.join(self._snapshots_dir, *world_name.split("/"))]
+
+        snapshots = []
+        for world_dir in world_dirs:
+            if not os.path.isdir(world_dir):
+                continue
+            world = os.path.relpath(world_dir, self._snapshots_dir).replace(os.sep, "/")
+            # sorted without the extension, so <time> comes before <time>-1
+            names = sorted(name[:-len(".json")] for name in os.listdir(world_dir) if name.endswith(".json"))
+            snapshots.extend(f"{world}/{name}" for name in names)
+        return snapshots
+
+    def load_manifest(self, snapshot_id: str) -> dict:
+        with open(self._snapshot_path(snapshot_id), "r") as f:
+            return json.load(f)
+
+    def snapshot(self, world_name: str, world_path: str, files: list[tuple[str, int | None]] | None = None) -> str:
+        """
+        Take a snapshot of a world.
+
+        Files whose size and mtime match the latest snapshot of the same world reuse its chunk list without being
+        read again.
+
+        :param world_name: the level name, or "<instance>/<level-name>" for a server in a fleet, snapshots are grouped
+            (and reuse each other's chunk lists) by this
+        :param world_path: path to the world folder
+        :param files: (path relative to world_path, length to store or None for the whole file), if not given, the
+            whole world folder is walked
+        :return: the snapshot id
+        :raises OSError: if any file couldn't be read, no snapshot is written then
+        """
+        if files is None:
+            files = []
+            for root, dirs, file_names in os.walk(world_path):
+                for file in file_names:
+                    files.append((os.path.relpath(os.path.join(root, file), world_path), None))
+
+        with self.__lock:
+            previous = {}
+            existing = self.list_snapshots(world_name)
+            if existing:
+                try:
+                    previous = {e["path"]: e for e in self.load_manifest(existing[-1])["files"]}
+                except Exception as e:
+                    _log.warning(f"Could not load previous snapshot, storing everything: {e}")
+
+            entries = []
+            bytes_read = 0
+            bytes_written = 0
+            for rel_path, length in files:
+                rel_path = rel_path.replace(os.sep, "/")
+                src = os.path.join(world_path, rel_path)
+                try:
+                    stat = os.stat(src)
+                    size = stat.st_size if length is None else min(length, stat.st_size)
+
+                    prev = previous.get(rel_path)
+                    if prev is not None and prev["size"] == size and prev["mtime_ns"] == stat.st_mtime_ns:
+                        entries.append(prev)
+                        continue
+
+                    chunks = []
+                    with open(src, "rb") as f:
+                        remaining = size
+                        while remaining > 0:
+                            data = f.read(min(CHUNK_SIZE, remaining))
+                            if not data:
+                                break
+                            governor.throttle(len(data))
+                            remaining -= len(data)
+                            bytes_read += len(data)
+                            digest, written = self._put_chunk(data)
+                            bytes_written += written
+                            chunks.append(digest)
+                    entries.append({
+                        "path": rel_path,
+                        "size": size - remaining,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "chunks": chunks,
+                    })
+                except OSError as e:
+                    # a snapshot missing a file would look complete in the catalog, better to have none
+                    _log.error(f"Error adding file to snapshot, not writing it: {rel_path}: {e}")
+                    raise
+
+            created = datetime.datetime.now()
+            snapshot_id = f"{world_name}/{created.strftime(_TIME_FORMAT)}"
+            suffix = 0
+            while os.path.exists(self._snapshot_path(snapshot_id)):  # another one in the same second
+                suffix += 1
+                snapshot_id = f"{world_name}/{created.strftime(_TIME_FORMAT)}-{suffix}"
+            manifest_path = self._snapshot_path(snapshot_id)
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"world": world_name, "created": created.isoformat(), "files": entries}, f)
+            os.replace(tmp_path, manifest_path)  # manifest last, so a snapshot only exists once its chunks do
+
+        self.last_bytes_read = bytes_read
+        self.last_bytes_written = bytes_written
+        _log.info(f"Snapshot {snapshot_id}: {len(entries)} files, read {bytes_read} bytes, "
+                  f"stored {bytes_written} new bytes")
+        return snapshot_id
+
+    def restore(self, snapshot_id: str, dst_dir: str, files=None, workers: int | None = None) -> int:
+        """
+        Rebuild a snapshot into dst_dir, which must not exist yet. Files are rebuilt concurrently (zlib and sha256
+        release the GIL), and every chunk is checked against its hash.
+
+        :param files: called with each file's path in the snapshot, True to restore it, by default all of them are
+        :param workers: threads to restore with, defaults to archive.get_archive_workers()
+        :return: the number of bytes restored
+        """
+        manifest = self.load_manifest(snapshot_id)
+        if os.path.exists(dst_dir):
+            raise FileExistsError(f"Restore destination already exists: {dst_dir}")
+
+        entries = [e for e in manifest["files"] if files is None or files(e["path"])]
+        os.makedirs(dst_dir)
+        for entry in entries:
+            os.makedirs(os.path.dirname(os.path.join(dst_dir, entry["path"])), exist_ok=True)
+
+        def restore_file(entry: dict) -> int:
+            written = 0
+            with open(os.path.join(dst_dir, entry["path"]), "wb") as f:
+                for digest in entry["chunks"]:
+                    data = self._get_chunk(digest)
+                    governor.throttle(len(data))
+                    written += f.write(data)
+                    governor.written(f, len(data))
+            return written
+
+        workers = workers if workers is not None else archive.get_archive_workers()
+        if workers == 1:
+            restored = sum(restore_file(entry) for entry in entries)
+        else:
+            # largest first, so one big file doesn't start last and hold up the finish
+            entries.sort(key=lambda e: e["size"], reverse=True)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="restore",
+                                    initializer=governor.maintenance_thread) as pool:
+                restored = sum(pool.map(restore_file, entries))
+        _log.info(f"Restored snapshot {snapshot_id} to: {dst_dir}")
+        return restored
+
+    def delete_snapshot(self, snapshot_id: str):
+        """
+        Delete a snapshot's manifest, call gc() afterwards to free any chunks only it used
+        """
+        with self.__lock:
+            os.remove(self._snapshot_path(snapshot_id))
+
+    def gc(self) -> int:
+        """
+        Delete every chunk not referenced by any snapshot. Chunks still being written (.tmp) or written since the gc
+        started are left alone, in case a snapshot outside this process is adding them.
+
+        :return: the number of chunks deleted
+        """
+        started = time.time()
+        with self.__lock:
+            referenced = set()
+            for snapshot_id in self.list_snapshots():
+                for entry in self.load_manifest(snapshot_id)["files"]:
+                    referenced.update(entry["chunks"])
+
+            deleted = 0
+            for prefix in os.listdir(self._objects_dir):
+                prefix_dir = os.path.join(self._objects_dir, prefix)
+                for digest in os.listdir(prefix_dir):
+                    if digest in referenced or digest.endswith(".tmp"):
+                        continue
+                    path = os.path.join(prefix_dir, digest)
+                    try:
+                        if os.path.getmtime(path) >= started:
+                            continue
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    deleted += 1
+        if deleted:
+            _log.info(f"Deleted {deleted} unreferenced chunks")
+        return deleted
@@ -0,0 +1,178 @@
+"""
+Holds the DiscoveryClient, which fetches the pages the latest download link is read from
+
+Every request goes through one pooled requests.Session, and each response is cached on disk (data dir
+/discovery_cache.json) with its ETag / Last-Modified. Within the TTL a fetch returns the cached body without touching
+the network, after it a conditional request usually comes back as a 304. Failures are cached too, and the next attempt
+is held off with exponential backoff and jitter, so repeated polls never hammer a site that is down or rate limiting.
+
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import requests
+from threading import RLock
+from mc import paths
+from mc import metrics
+
+_log = logging.getLogger(__name__)
+
+CACHE_TTL = 5 * 60  # seconds a successful response is reused without asking the server
+BACKOFF_BASE = 30  # seconds, doubled for each consecutive failure
+BACKOFF_MAX = 60 * 60
+
+_client: "DiscoveryClient | None" = None
+
+
+def get_path_to_cache() -> str:
+    return os.path.join(paths.get_path_to_data_dir(), "discovery_cache.json")
+
+
+def get_client() -> "DiscoveryClient":
+    """
+    :return: the shared client, so every caller uses the same connection pool and cache
+    """
+    global _client
+    if _client is None:
+        _client = DiscoveryClient()
+    return _client
+
+
+class DiscoveryClient:
+    """
+    Use the shared one from get_client(). The lock only guards the cache, requests are made outside of it, so callers
+    polling different urls (or asking retry_in) never wait on each other's network round trip.
+    """
+
+    def __init__(self, cache_path: str | None = None, ttl: float = CACHE_TTL, backoff_base: float = BACKOFF_BASE,
+                 backoff_max: float = BACKOFF_MAX):
+        self.cache_path = cache_path if cache_path is not None else get_path_to_cache()
+        self.ttl = ttl
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "Mozilla/5.0"
+        self.requests_sent = 0
+        self.__lock = RLock()
+        self._cache = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.cache_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            _log.warning(f"Could not read discovery cache, starting empty: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            _log.warning(f"Could not write discovery cache: {e}")
+
+    def _backoff(self, failures: int) -> float:
+        # jittered anywhere up to the exponential cap, so retries don't fall into lockstep with the site's rate limit
+        return random.uniform(self.backoff_base, min(self.backoff_max, self.backoff_base * 2 ** (failures - 1)))
+
+    def retry_in(self, url: str) -> float:
+        """
+        :return: seconds until url may be requested again after failures, 0 if it can be requested now
+        """
+        with self.__lock:
+            entry = self._cache.get(url, {})
+            return max(entry.get("retry_at", 0) - time.time(), 0.0)
+
+    def next_attempt_in(self) -> float:
+        """
+        :return: seconds until the first backed off url may be requested again, 0 if none are backing off
+        """
+        with self.__lock:
+            now = time.time()
+            waits = [entry["retry_at"] - now for entry in self._cache.values() if entry.get("retry_at", 0) > now]
+            return min(waits, default=0.0)
+
+    def fetch(self, url: str, headers: dict | None = None, timeout: float = 30) -> str | None:
+        """
+        Get the body of url, from the cache if it is fresh, otherwise with a conditional request.
+
+        :return: the body, or None if the request failed (or a recent failure is still backing off)
+        """
+        # the lock covers the cache, not the request, so one slow site never holds up another url (or retry_in)
+        with self.__lock:
+            now = time.time()
+            entry = dict(self._cache.get(url, {}))
+
+            if entry.get("retry_at", 0) > now:
+                _log.debug(f"Not requesting {url}, backing off for another {entry['retry_at'] - now:.0f} seconds")
+                return None
+            if "body" in entry and now - entry.get("fetched_at", 0) < self.ttl:
+                metrics.discovery_cached.inc()
+                return entry["body"]
+
+            request_headers = dict(headers or {})
+            if "body" in entry:
+                if entry.get("etag"):
+                    request_headers["If-None-Match"] = entry["etag"]
+                if entry.get("last_modified"):
+                    request_headers["If-Modified-Since"] = entry["last_modified"]
+
+            self.requests_sent += 1
+
+        sent = time.perf_counter()
+        try:
+            r = self.session.get(url, headers=request_headers, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            metrics.discovery_seconds.observe(time.perf_counter() - sent, result="error")
+            return self._failed(url, entry, f"connection error: {e}")
+        metrics.discovery_seconds.observe(
+            time.perf_counter() - sent, result=str(r.status_code) if r.status_code in (200, 304) else "error"
+        )
+
+        if r.status_code == 304 and "body" in entry:
+            _log.debug(f"{url} not modified")
+            entry["fetched_at"] = now
+            entry.pop("failures", None)
+            entry.pop("retry_at", None)
+        elif r.status_code == 200:
+            entry = {
+                "body": r.text,
+                "fetched_at": now,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }
+        else:
+            return self._failed(url, entry, f"status code: {r.status_code}")
+
+        with self.__lock:
+            self._cache[url] = entry
+            self._save()
+        return entry["body"]
+
+    def _failed(self, url: str, entry: dict, reason: str) -> None:
+        # keep the last good body for a conditional request later, but don't serve it as if it were fresh
+        failures = entry.get("failures", 0) + 1
+        delay = self._backoff(failures)
+        entry["failures"] = failures
+        entry["retry_at"] = time.time() + delay
+        with self.__lock:
+            self._cache[url] = entry
+            self._save()
+        _log.error(f"Could not get {url}, {reason}, failure {failures}, next attempt in {delay:.0f} seconds")
+        return None
+
+    def invalidate(self, url: str):
+        """
+        Forget a cached body, e.g. when it parsed but didn't contain what we expected, so the next fetch asks again
+        (unconditionally) instead of serving the same bad body until the TTL is up
+        """
+        with self.__lock:
+            if self._cache.pop(url, None) is not None:
+                self._save()
@@ -1,14 +1,247 @@
 import requests
 import re
 import os
+import json
+import time
+import shutil
+import hashlib
 from mc import paths
+from mc import archive
+from mc import backup_catalog
+from mc import discovery
+from mc import governor
+from mc import metrics
+from mc import versions
 import logging
 import zipfile
 
 _log = logging.getLogger(__name__)
 
-# looking for, want to get the link
-pattern = re.compile(r"bedrock-server-\d+\.\d+\.\d+\.\d+\.zip")
+# a whole link in the download page's HTML: from "https://" up to the end of a server zip name, never crossing a tag
+# or whitespace (if the match spans two "https://", the link starts at the last one)
+link_pattern = re.compile(r"https://[^<> \n]*?bedrock-server-\d+\.\d+\.\d+\.\d+\.zip")
+
+_SCAN_CHUNK_SIZE = 64 * 1024
+_SCAN_MAX_LINK_LENGTH = 4096  # an unfinished "https://..." longer than this at the end of a chunk is not carried over
+
+DOWNLOAD_CHUNK_SIZE = 1024 ** 2
+DOWNLOAD_RETRIES = 5  # consecutive attempts that make no progress before giving up
+PROGRESS_LOG_INTERVAL = 10.0  # seconds
+
+_download_headers = {
+    "User-Agent": "Mozilla/5.0",
+    "Referer": "https://www.minecraft.net/en-us/download/server/bedrock"
+}
+
+
+class DownloadStats:
+    """
+    What a download_file call did, the most recent one is kept in `last_download`
+    """
+
+    def __init__(self, url: str, path: str):
+        self.url = url
+        self.path = path
+        self.size = 0  # final size of the file
+        self.bytes_transferred = 0  # bytes received over the network this call (excludes resumed bytes)
+        self.seconds = 0.0
+        self.resumes = 0  # times the transfer picked up from a partial file
+        self.sha256: str | None = None
+
+    @property
+    def throughput(self) -> float:
+        """
+        :return: bytes per second received over the network
+        """
+        return self.bytes_transferred / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return (f"DownloadStats(size={self.size}, transferred={self.bytes_transferred}, seconds={self.seconds:.2f}, "
+                f"throughput={self.throughput / 1024 ** 2:.2f}MiB/s, resumes={self.resumes})")
+
+
+last_download: DownloadStats | None = None
+
+
+def _hash_file(path: str, hasher, length: int):
+    with open(path, "rb") as f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+
+
+def _total_size(r: requests.Response, offset: int) -> int | None:
+    """
+    :return: size of the whole file, from Content-Range on a 206 or Content-Length on a 200
+    """
+    if r.status_code == 206:
+        content_range = r.headers.get("Content-Range", "")  # bytes 100-199/200
+        total = content_range.rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("Content-Length")
+    return int(length) if length is not None and length.isdigit() else None
+
+
+def scan_download_links(chunks):
+    """
+    Find every server download link in HTML arriving as decoded text chunks (e.g. from
+    codecs.iterdecode(response.iter_content(), "utf-8")), in a single pass.
+
+    Links split across chunks are found by carrying the unfinished tail of each chunk over to the next.
+
+    :return: generator of (link, is windows, is preview)
+    """
+    carry = ""
+    for chunk in chunks:
+        text = carry + chunk
+        end = 0
+        for match in link_pattern.finditer(text):
+            link = match.group()
+            link = link[link.rfind("https://"):]
+            yield link, "win" in link, "preview" in link
+            end = match.end()
+
+        # keep anything after the last match that could still be the start of a link
+        start = text.rfind("https://", end)
+        if start == -1:
+            start = max(len(text) - len("https://"), end)
+        carry = text[start:] if len(text) - start <= _SCAN_MAX_LINK_LENGTH else ""
+
+    for match in link_pattern.finditer(carry):
+        link = match.group()
+        link = link[link.rfind("https://"):]
+        yield link, "win" in link, "preview" in link
+
+
+def download_file(url: str, path: str, expected_size: int | None = None, expected_sha256: str | None = None,
+                  headers: dict | None = None, retries: int = DOWNLOAD_RETRIES, timeout: float = 30,
+                  chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> DownloadStats | None:
+    """
+    Stream url to path with bounded memory.
+
+    The body is written to `<path>.part`, and after a dropped connection (or a previous run that didn't finish) the
+    transfer picks up where it left off with a Range request. The file is only renamed to path once its size matches
+    the server's (and expected_size), and its sha256 matches expected_sha256 if given.
+
+    :return: stats for the download, or None if it failed
+    """
+    global last_download
+
+    part_path = path + ".part"
+    stats = DownloadStats(url, path)
+    hasher = hashlib.sha256()
+    headers = dict(headers if headers is not None else _download_headers)
+    validator = None  # ETag / Last-Modified of the first response, so a resume can't splice two different files
+    total = expected_size
+    failures = 0
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset:
+        _log.info(f"Resuming partial download at {offset} bytes: {part_path}")
+        _hash_file(part_path, hasher, offset)
+
+    start = time.perf_counter()
+    last_progress_log = start
+    while True:
+        request_headers = dict(headers)
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+            if validator is not None:
+                request_headers["If-Range"] = validator
+
+        made_progress = False
+        try:
+            with requests.get(url, headers=request_headers, stream=True, timeout=timeout) as r:
+                if r.status_code == 416 and offset:
+                    # nothing past our offset, either the partial file is already complete or it is from another file
+                    server_total = r.headers.get("Content-Range", "").rpartition("/")[2]  # bytes */200
+                    if server_total.isdigit() and int(server_total) == offset and total in (None, offset):
+                        total = offset
+                    else:
+                        _log.warning(f"Partial download does not match the server's file, restarting from 0 bytes")
+                        offset = 0
+                        hasher = hashlib.sha256()
+                        continue
+                elif r.status_code not in (200, 206):
+                    _log.error(f"Could not download file, status code: {r.status_code}")
+                    if 400 <= r.status_code < 500 and r.status_code != 416:
+                        return None  # won't get better by retrying
+                    raise requests.exceptions.ConnectionError(f"status code {r.status_code}")
+                else:
+                    if r.status_code == 200 and offset:
+                        # the server ignored the range (or the file changed), start over
+                        _log.warning(f"Server did not resume the download, restarting from 0 bytes")
+                        offset = 0
+                        hasher = hashlib.sha256()
+                    elif r.status_code == 206 and offset:
+                        stats.resumes += 1
+
+                    server_total = _total_size(r, offset)
+                    if server_total is not None:
+                        if total is not None and server_total != total:
+                            _log.error(f"Server reports {server_total} bytes, expected {total}, not downloading")
+                            return None
+                        total = server_total
+                    validator = r.headers.get("ETag") or r.headers.get("Last-Modified") or validator
+
+                    with open(part_path, "r+b" if offset else "wb") as f:
+                        f.seek(offset)
+                        f.truncate()
+                        for chunk in r.iter_content(chunk_size=chunk_size):
+                            governor.throttle(len(chunk))
+                            f.write(chunk)
+                            governor.written(f, len(chunk))
+                            hasher.update(chunk)
+                            offset += len(chunk)
+                            stats.bytes_transferred += len(chunk)
+                            made_progress = True
+
+                            now = time.perf_counter()
+                            if now - last_progress_log >= PROGRESS_LOG_INTERVAL:
+                                last_progress_log = now
+                                rate = stats.bytes_transferred / (now - start) / 1024 ** 2
+                                _log.info(f"Downloaded {offset / 1024 ** 2:.1f}"
+                                          f"{f'/{total / 1024 ** 2:.1f}' if total else ''} MiB ({rate:.2f} MiB/s)")
+
+            if total is None or offset >= total:
+                break
+            _log.warning(f"Download ended early at {offset}/{total} bytes")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            _log.warning(f"Download interrupted at {offset} bytes: {e}")
+
+        failures = 0 if made_progress else failures + 1
+        if failures >= retries:
+            _log.error(f"Download failed after {retries} attempts without progress, keeping {part_path} to resume")
+            return None
+        time.sleep(min(2 ** failures, 30))
+
+    stats.seconds = time.perf_counter() - start
+    stats.size = offset
+    stats.sha256 = hasher.hexdigest()
+    metrics.download_bytes.inc(stats.bytes_transferred)
+    metrics.download_seconds.inc(stats.seconds)
+    metrics.download_resumes.inc(stats.resumes)
+
+    if total is not None and offset != total:
+        _log.error(f"Downloaded {offset} bytes, expected {total}, discarding")
+        os.remove(part_path)
+        return None
+    if expected_sha256 is not None and stats.sha256 != expected_sha256.lower():
+        _log.error(f"Downloaded file sha256 {stats.sha256} does not match expected {expected_sha256}, discarding")
+        os.remove(part_path)
+        return None
+
+    os.replace(part_path, path)
+    _log.info(f"Downloaded {url} to {path}: {stats}, sha256 {stats.sha256}")
+    last_download = stats
+    metrics.download_last_throughput.set(stats.throughput)
+    return stats
+
 
 def get_version_from_download_link(download_link: str):
     # e.g. https://minecraft.azureedge.net/bin-win/bedrock-server-1.21.30.03.zip
@@ -45,30 +278,27 @@ def get_latest_download_link():
 
 def get_latest_download_link_new(api_version: str = "v1.0"):
     # post June 2025 links have new links GET dynamically
-    # get with short timeout, it seems like it goes down frequently (or is heavily rate limited)
-    try:
-        r = requests.get(
-            f"https://net-secondary.web.minecraft-services.net/api/{api_version}/download/links",
-            timeout=30,
-            headers={
-                "User-Agent": "Mozilla/5.0",
-                "Referer": "https://www.minecraft.net/"
-            }
-        )
-    except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
-        _log.error("Could not get download link, connection error...")
-        return None
-    if r.status_code != 200:
-        _log.error(f"Could not get download link, status code: {r.status_code}")
+    # through the discovery client, which caches the response and backs off when the API is down or rate limited
+    # a body that parses but doesn't hold the link is dropped from the cache, so the next poll asks the API again
+    client = discovery.get_client()
+    url = f"https://net-secondary.web.minecraft-services.net/api/{api_version}/download/links"
+    body = client.fetch(url, headers={"Referer": "https://www.minecraft.net/"})
+    if body is None:
         return None
 
-    resp_json = r.json()
+    try:
+        resp_json = json.loads(body)
+    except ValueError:
+        _log.error("Could not get download link, response is not JSON")
+        client.invalidate(url)
+        return None
 
     try:
         result = resp_json["result"]
         links = result["links"]
     except KeyError:
         _log.error("Could not get download link, response JSON does not contain expected keys", exc_info=True)
+        client.invalidate(url)
         return None
 
     correct_link = None
@@ -83,6 +313,7 @@ def get_latest_download_link_new(api_version: str = "v1.0"):
 
     if correct_link is None:
         _log.error("Could not get download link, no link found for serverBedrockWindows")
+        client.invalidate(url)
         return None
 
     return correct_link
@@ -90,76 +321,31 @@ def get_latest_download_link_new(api_version: str = "v1.0"):
 
 def get_latest_download_link_old():
     # pre June 2025 links were burned into html
-    # get with short timeout, it seems like it goes down frequently (or is heavily rate limited)
-    try:
-        r = requests.get(
-            "https://www.minecraft.net/en-us/download/server/bedrock",
-            timeout=30,
-            headers={
-                "User-Agent": "Mozilla/5.0",
-                "Referer": "https://www.google.com"
-            }
-        )
-    except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
-        _log.error("Could not get download link, connection error...")
+    # through the discovery client, which caches the page and backs off when the site is down or rate limited
+    client = discovery.get_client()
+    url = "https://www.minecraft.net/en-us/download/server/bedrock"
+    body = client.fetch(url, headers={"Referer": "https://www.google.com"})
+    if body is None:
         return None
-    if r.status_code != 200:
-        _log.error(f"Could not get download link, status code: {r.status_code}")
-        return None
-    # we want to match on any new download link, and so we want to find the indices where we see a version.zip
-    # e.g. 1.21.30.03.zip, and then use that to determine which is the windows download link
-    matches = pattern.findall(r.text)
-
-    # now, to get the full links, we need to get the https:// part of the link
 
-    full_links = []
-
-    for match in matches:
-        # walking backwards, find https://
-        start = r.text.rfind("https://", 0, r.text.find(match))
-        if start == -1:
-            _log.error("Could not get download link, no https:// found")
-            continue
-        full_link = r.text[start:r.text.find(match) + len(match)]
-        full_links.append(full_link)
-
-    # now that we have links, throw out bad ones
-    illegal_chars = ">< \n"  # would appear if our search was bad
-    to_remove = []
-    for link in full_links:
-        if any(char in link for char in illegal_chars):
-            to_remove.append(link)
-    for link in to_remove:
-        full_links.remove(link)
-
-    # now throw out any that don't contain the string "win"
-    to_remove = []
-    for link in full_links:
-        if "win" not in link:
-            to_remove.append(link)
-    for link in to_remove:
-        full_links.remove(link)
-
-    # now throw out any that contain "preview"
-    to_remove = []
-    for link in full_links:
-        if "preview" in link:
-            to_remove.append(link)
-    for link in to_remove:
-        full_links.remove(link)
-
-    # now dedupe via set
-    full_links = list(set(full_links))
+    # one scan over the page for full links, keeping the windows, non-preview ones
+    full_links = {
+        link for link, windows, preview in scan_download_links(body[i:i + _SCAN_CHUNK_SIZE]
+                                                               for i in range(0, len(body), _SCAN_CHUNK_SIZE))
+        if windows and not preview
+    }
 
     # we should hopefully have one link left
     if len(full_links) > 1:
         _log.error("Could not get download link, too many matches in HTML")
+        client.invalidate(url)
         return None
     elif len(full_links) == 0:
         _log.error("Could not get download link, no matches in HTML")
+        client.invalidate(url)
         return None
     else:
-        return full_links[0]
+        return full_links.pop()
 
 
 def download_and_extract(download_link: str) -> bool:
@@ -179,27 +365,18 @@ def download_and_extract(download_link: str) -> bool:
             _log.error(f"Couldn't get version from download link, so not downloading: {download_link}")
             return False
 
-        # download
-        _log.info(f"Sending download request")
-        r = requests.get(
-            download_link,
-            headers={
-                "User-Agent": "Mozilla/5.0",
-                "Referer": "https://www.minecraft.net/en-us/download/server/bedrock"
-            }
-        )
-        if r.status_code != 200:
-            _log.error(f"Could not download file, status code: {r.status_code}")
-            return False
-
-        # save to versions directory
+        # download, streamed to a .part file that is resumed if the connection drops
         download_path = paths.get_path_to_versions_dir()
         download_path = os.path.join(download_path, f"bedrock-server-{version}.zip")
         _log.info(f"Downloading to: {download_path}")
-        with open(download_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 ** 2):
-                f.write(chunk)
-        _log.info(f"Downloaded to: {download_path}")
+        if download_file(download_link, download_path) is None:
+            return False
+
+        # the size matched, make sure what we got is actually a zip before unpacking it
+        if not zipfile.is_zipfile(download_path):
+            _log.error(f"Downloaded file is not a zip file: {download_path}")
+            os.remove(download_path)
+            return False
 
         extract_dir = os.path.join(paths.get_path_to_versions_dir(), version + "_inprogress")
         if os.path.exists(extract_dir):
@@ -208,9 +385,9 @@ def download_and_extract(download_link: str) -> bool:
         extract_dir_confirmed = extract_dir  # don't want to delete the wrong directory
         os.mkdir(extract_dir)
 
-        # extract
-        with zipfile.ZipFile(download_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_dir)
+        # extract, in parallel straight out of the mapped zip (CRCs are checked as it goes)
+        extracted = archive.extract_archive(download_path, extract_dir)
+        _log.info(f"Extracted {extracted / 1024 ** 2:.1f} MiB to: {extract_dir}")
 
         # delete zip
         os.remove(download_path)
@@ -218,6 +395,12 @@ def download_and_extract(download_link: str) -> bool:
         # rename directory
         os.rename(extract_dir, extract_dir.replace("_inprogress", ""))
 
+        # a new version is in, keep the newest few (and any an update backup is rebuilt from)
+        with backup_catalog.BackupCatalog() as backups:
+            pinned = backups.source_versions(kind=backup_catalog.KIND_UPDATE)
+        versions.invalidate_all()  # every server's catalog shares the versions dir
+        versions.get_catalog().prune(pinned=pinned)
+
         return True
 
     except Exception as e:
@@ -228,8 +411,8 @@ def download_and_extract(download_link: str) -> bool:
         except Exception:  # noqa  # doesn't matter, quick cleanup
             pass
 
-        try:  # try to delete the extracted directory if it exists
-            os.rmdir(extract_dir_confirmed)  # noqa  # we don't care if this fails
+        try:  # try to delete the extracted directory if it exists (partly extracted if a member failed its CRC)
+            shutil.rmtree(extract_dir_confirmed)  # noqa  # we don't care if this fails
         except Exception:  # noqa  # doesn't matter, quick cleanup
             pass
 
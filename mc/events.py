@@ -0,0 +1,238 @@
+"""
+Parses the Bedrock server's console output into typed events, and dispatches them to subscribers
+
+Lines look like
+
+    [2024-06-01 12:00:00:123 INFO] Player connected: Steve, xuid: 2535412345678901
+
+The "[timestamp LEVEL]" prefix is split off with plain string operations, then the message is matched once against a
+single precompiled alternation of every known message (rather than trying a list of regexes in turn), and the name of
+the alternative that matched picks the event type.
+
+"""
+
+import re
+import logging
+from collections import deque
+from threading import RLock
+from mc import save_query
+
+_log = logging.getLogger(__name__)
+
+RECENT_EVENTS_SIZE = 1000
+
+
+class ServerEvent:
+    """Base class of every event, subscribe to this to get them all"""
+    __slots__ = ("line", "timestamp", "level")
+
+    def __init__(self, line: str, timestamp: str | None, level: str | None):
+        self.line = line
+        self.timestamp = timestamp
+        self.level = level
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if name != "line")
+        return f"{type(self).__name__}({fields})"
+
+
+class ServerStarted(ServerEvent):
+    __slots__ = ()
+
+
+class ServerStopping(ServerEvent):
+    __slots__ = ()
+
+
+class VersionBanner(ServerEvent):
+    __slots__ = ("version",)
+
+    def __init__(self, line, timestamp, level, version: str):
+        super().__init__(line, timestamp, level)
+        self.version = version
+
+
+class PlayerConnected(ServerEvent):
+    __slots__ = ("player", "xuid")
+
+    def __init__(self, line, timestamp, level, player: str, xuid: str):
+        super().__init__(line, timestamp, level)
+        self.player = player
+        self.xuid = xuid
+
+
+class PlayerDisconnected(ServerEvent):
+    __slots__ = ("player", "xuid")
+
+    def __init__(self, line, timestamp, level, player: str, xuid: str):
+        super().__init__(line, timestamp, level)
+        self.player = player
+        self.xuid = xuid
+
+
+class PlayerList(ServerEvent):
+    """The answer to `list`"""
+    __slots__ = ("online", "max_players")
+
+    def __init__(self, line, timestamp, level, online: int, max_players: int):
+        super().__init__(line, timestamp, level)
+        self.online = online
+        self.max_players = max_players
+
+
+class SaveHeld(ServerEvent):
+    __slots__ = ()
+
+
+class SaveQueryNotReady(ServerEvent):
+    __slots__ = ()
+
+
+class SaveQueryResult(ServerEvent):
+    """The file list following "Data saved. Files are now ready to be copied." """
+    __slots__ = ("files",)
+
+    def __init__(self, line, timestamp, level, files: list[tuple[str, int]]):
+        super().__init__(line, timestamp, level)
+        self.files = files
+
+
+class SaveResumed(ServerEvent):
+    __slots__ = ()
+
+
+class ServerError(ServerEvent):
+    """Any ERROR level line (or stderr line) that isn't a more specific event"""
+    __slots__ = ("message",)
+
+    def __init__(self, line, timestamp, level, message: str):
+        super().__init__(line, timestamp, level)
+        self.message = message
+
+
+# one alternative per message, each wrapped in an outer named group so `lastgroup` names the alternative that matched
+_message_pattern = re.compile(
+    r"(?P<started>Server started\.)"
+    r"|(?P<stopping>Stopping server\.\.\.)"
+    r"|(?P<version>Version:? (?P<version_number>\d+(?:\.\d+)+))"
+    r"|(?P<connected>Player connected: (?P<connected_player>.+?), xuid: (?P<connected_xuid>\d*))"
+    r"|(?P<disconnected>Player disconnected: (?P<disconnected_player>.+?), xuid: (?P<disconnected_xuid>\d*))"
+    r"|(?P<player_list>There are (?P<online>\d+)/(?P<max_players>\d+) players online)"
+    r"|(?P<held>Saving\.\.\.)"
+    r"|(?P<ready>" + re.escape(save_query.READY_MARKER) + r")"
+    r"|(?P<not_ready>" + re.escape(save_query.NOT_READY_MARKER) + r")"
+    r"|(?P<resumed>Changes to the world are resumed\.)"
+)
+
+
+class EventParser:
+    """
+    Fed raw console lines, turns them into events, keeps the most recent in a ring buffer and calls subscribers.
+
+    Subscribers are called on the thread that feeds the parser (the stdout thread for ServerRuntime), so they should
+    be quick.
+
+    """
+
+    def __init__(self, recent_size: int = RECENT_EVENTS_SIZE):
+        self.recent: deque[ServerEvent] = deque(maxlen=recent_size)
+        self._subscribers: dict[type, list] = {}
+        self._expect_file_list = False  # stdout only, stderr lines can arrive between the marker and the list
+        self.__lock = RLock()
+
+    def subscribe(self, event_type: type, callback):
+        """
+        Call callback(event) for every event of event_type (or a subclass, so ServerEvent gets everything)
+        """
+        with self.__lock:
+            self._subscribers.setdefault(event_type, []).append(callback)
+
+    def unsubscribe(self, event_type: type, callback):
+        with self.__lock:
+            try:
+                self._subscribers.get(event_type, []).remove(callback)
+            except ValueError:
+                pass
+
+    def recent_events(self, event_type: type = ServerEvent) -> list[ServerEvent]:
+        with self.__lock:
+            return [e for e in self.recent if isinstance(e, event_type)]
+
+    def parse(self, line: str, is_stderr: bool = False) -> ServerEvent | None:
+        """
+        Turn a line into an event without dispatching it
+
+        :return: the event, or None if the line isn't one we know
+        """
+        line = line.rstrip("\r\n")
+
+        if self._expect_file_list and not is_stderr:
+            # the stdout line after the ready marker is the bare file list
+            self._expect_file_list = False
+            files = save_query.parse_file_list(line)
+            if files:
+                return SaveQueryResult(line, None, None, files)
+            _log.warning(f"Could not parse save query file list: {line}")
+
+        timestamp = level = None
+        message = line
+        if line.startswith("["):
+            end = line.find("] ")
+            if end != -1:
+                timestamp, _, level = line[1:end].rpartition(" ")
+                message = line[end + 2:]
+
+        match = _message_pattern.match(message)
+        if match is None:
+            if is_stderr or level == "ERROR":
+                return ServerError(line, timestamp, level or "ERROR", message)
+            return None
+
+        kind = match.lastgroup
+        if kind == "started":
+            return ServerStarted(line, timestamp, level)
+        elif kind == "stopping":
+            return ServerStopping(line, timestamp, level)
+        elif kind == "version":
+            return VersionBanner(line, timestamp, level, match.group("version_number"))
+        elif kind == "connected":
+            return PlayerConnected(line, timestamp, level, match.group("connected_player"),
+                                   match.group("connected_xuid"))
+        elif kind == "disconnected":
+            return PlayerDisconnected(line, timestamp, level, match.group("disconnected_player"),
+                                      match.group("disconnected_xuid"))
+        elif kind == "player_list":
+            return PlayerList(line, timestamp, level, int(match.group("online")), int(match.group("max_players")))
+        elif kind == "held":
+            return SaveHeld(line, timestamp, level)
+        elif kind == "ready":
+            if not is_stderr:
+                self._expect_file_list = True
+            return None  # the SaveQueryResult comes with the next line
+        elif kind == "not_ready":
+            return SaveQueryNotReady(line, timestamp, level)
+        elif kind == "resumed":
+            return SaveResumed(line, timestamp, level)
+        return None
+
+    def feed(self, line: str, is_stderr: bool = False) -> ServerEvent | None:
+        """
+        Parse a line and dispatch the resulting event (if any) to subscribers
+
+        :return: the event, or None
+        """
+        with self.__lock:
+            event = self.parse(line, is_stderr)
+            if event is None:
+                return None
+            self.recent.append(event)
+            callbacks = []
+            for event_type in type(event).__mro__:
+                callbacks.extend(self._subscribers.get(event_type, ()))
+
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                _log.error(f"Error in event subscriber: {e}")
+        return event
@@ -0,0 +1,198 @@
+"""
+Holds the Fleet, which runs several Bedrock servers (each with its own world, active directory and ports) from one
+process
+
+MC_INSTANCES lists them as name:port pairs, e.g. "survival:19132,creative:19134". Each gets the active directory
+<data dir>/instances/<name> (laid out like the single server's active dir), and its IPv4 port and the one after it for
+IPv6 are written into its server.properties before every start. The instances share the versions directory, the backup
+catalog and a single update discovery thread, so each new version is found and downloaded once for all of them. Backups
+are kept, catalogued and pruned per instance (by the name of its active dir), so worlds sharing a level name stay apart.
+
+Each instance has its own Supervisor (a thread blocking on its queue, so an idle instance costs nothing) with health
+checks on, and the Fleet staggers anything that would otherwise restart them all at once:
+
+    start    each instance is started once the one before it has reported it started (or after START_STAGGER seconds)
+    updates  the update countdown of the i-th instance starts UPDATE_STAGGER * i seconds after the first's, and so
+             does its timed restart countdown (MC_RESTART_CRON)
+
+"""
+
+import os
+import logging
+from threading import Thread
+from mc import paths
+from mc import update
+from mc import supervisor
+
+_log = logging.getLogger(__name__)
+
+START_STAGGER = 60.0  # seconds
+UPDATE_STAGGER = 120.0  # seconds
+HEALTH_CHECK_INTERVAL = 60.0  # seconds
+
+
+def get_path_to_instances_dir() -> str:
+    return os.path.join(paths.get_path_to_data_dir(), "instances")
+
+
+class Instance:
+    """
+    One server in the fleet, `supervisor` is its Supervisor once the Fleet has made it
+    """
+
+    def __init__(self, name: str, port: int, active_dir: str | None = None):
+        self.name = name
+        self.port = port
+        self.port_v6 = port + 1
+        self.active_dir = active_dir if active_dir is not None else os.path.join(get_path_to_instances_dir(), name)
+        self.supervisor: supervisor.Supervisor | None = None
+        self.thread: Thread | None = None
+
+    def __repr__(self):
+        return f"Instance({self.name}, port={self.port}, active_dir={self.active_dir})"
+
+
+def parse_instances(value: str) -> list[Instance]:
+    """
+    :param value: comma separated name:port pairs, e.g. "survival:19132,creative:19134"
+    """
+    instances = []
+    for entry in value.replace("'", "").replace('"', "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, port = entry.partition(":")
+        if not sep or not name.strip() or not port.strip().isdigit():
+            raise ValueError(f"Bad MC_INSTANCES entry '{entry}', expected name:port")
+        instances.append(Instance(name.strip(), int(port)))
+    return instances
+
+
+def get_instances_from_env() -> list[Instance]:
+    """
+    :return: the instances in MC_INSTANCES, empty if it isn't set (a single server in the default active dir)
+    """
+    value = os.environ.get("MC_INSTANCES")
+    if value is None:
+        return []
+    return parse_instances(value)
+
+
+def set_server_ports(path_to_exe: str, port: int, port_v6: int):
+    """
+    Set server-port and server-portv6 in the server.properties next to the executable, only rewriting it if they
+    changed
+    """
+    server_properties = os.path.join(os.path.dirname(path_to_exe), "server.properties")
+    with open(server_properties, "r") as f:
+        lines = f.readlines()
+
+    wanted = {"server-port": str(port), "server-portv6": str(port_v6)}
+    found = set()
+    changed = False
+    for i, line in enumerate(lines):
+        key, sep, value = line.partition("=")
+        if sep and key.strip() in wanted:
+            found.add(key.strip())
+            if value.strip() != wanted[key.strip()]:
+                lines[i] = f"{key.strip()}={wanted[key.strip()]}\n"
+                changed = True
+    for key in wanted.keys() - found:
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        lines.append(f"{key}={wanted[key]}\n")
+        changed = True
+
+    if changed:
+        _log.info(f"Setting server-port={port}, server-portv6={port_v6} in: {server_properties}")
+        with open(server_properties, "w") as f:
+            f.writelines(lines)
+
+
+class Fleet:
+    """
+    install() lays out any instance that doesn't have a server yet, start() starts them all, notify_update_ready() is
+    given to the update discovery thread, shutdown() stops them all.
+
+    """
+
+    def __init__(self, instances: list[Instance], runtime_factory=None,
+                 health_check_interval: float | None = HEALTH_CHECK_INTERVAL,
+                 start_stagger: float = START_STAGGER, update_stagger: float = UPDATE_STAGGER,
+                 restart_cron: str | None = None):
+        names = [instance.name for instance in instances]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Instance names must be unique: {names}")
+        ports = [port for instance in instances for port in (instance.port, instance.port_v6)]
+        if len(set(ports)) != len(ports):
+            raise ValueError(f"Instance ports (and the port after each, for IPv6) must not overlap: {instances}")
+
+        self.instances = instances
+        self.start_stagger = start_stagger
+        self.update_stagger = update_stagger
+        for i, instance in enumerate(instances):
+            instance.supervisor = supervisor.Supervisor(
+                runtime_factory=runtime_factory, active_dir=instance.active_dir, name=instance.name,
+                health_check_interval=health_check_interval,
+                restart_cron=restart_cron, restart_offset=update_stagger * i,
+                on_start=lambda path_to_exe, i=instance: set_server_ports(path_to_exe, i.port, i.port_v6),
+            )
+
+    @classmethod
+    def from_env(cls) -> "Fleet":
+        return cls(get_instances_from_env(), restart_cron=supervisor.get_restart_cron())
+
+    def get(self, name: str) -> Instance:
+        for instance in self.instances:
+            if instance.name == name:
+                return instance
+        raise KeyError(f"No instance named {name}")
+
+    def install(self):
+        """
+        Install (or update) the newest downloaded version into any instance that isn't running it, call with the
+        fleet stopped and a version downloaded
+        """
+        for instance in self.instances:
+            os.makedirs(instance.active_dir, exist_ok=True)
+            if update.need_update(instance.active_dir):
+                _log.info(f"Installing the newest version for {instance.name}")
+                if not update.try_update(instance.active_dir):
+                    raise RuntimeError(f"Could not install a server for {instance.name}")
+
+    def start(self):
+        """
+        Start every instance's supervisor, each once the one before has started (or start_stagger seconds have passed)
+        """
+        for i, instance in enumerate(self.instances):
+            if i > 0 and not self.instances[i - 1].supervisor.started.wait(self.start_stagger):
+                _log.warning(f"{self.instances[i - 1].name} has not started within {self.start_stagger} seconds, "
+                             f"starting {instance.name} anyway")
+            _log.info(f"Starting {instance}")
+            instance.thread = Thread(target=instance.supervisor.run, daemon=True, name=f"supervisor-{instance.name}")
+            instance.thread.start()
+
+    def notify_update_ready(self):
+        """
+        A newer version has been downloaded, start each instance's update countdown, update_stagger seconds apart
+        """
+        for i, instance in enumerate(self.instances):
+            instance.supervisor.call_later(self.update_stagger * i, instance.supervisor.notify_update_ready)
+
+    def send_command(self, command: str, name: str | None = None):
+        """
+        Send a console command to one instance, or all of them
+        """
+        for instance in self.instances if name is None else [self.get(name)]:
+            runtime = instance.supervisor.runtime
+            if runtime is None:
+                _log.error(f"{instance.name} is not running (restarting or updating), command not sent")
+                continue
+            runtime.send_command(command)
+
+    def shutdown(self):
+        for instance in self.instances:
+            instance.supervisor.shutdown()
+        for instance in self.instances:
+            if instance.thread is not None:
+                instance.thread.join()
@@ -0,0 +1,274 @@
+"""
+Keeps maintenance work (backups, update copies and downloads) from taking CPU and disk away from the game server
+
+Three controls, each off unless configured:
+
+    MC_IO_LIMIT_BPS       bytes per second that archiving, copying, extracting and downloading may move between them,
+                          a token bucket every chunk passes through (throttle()) before it is read or written, and
+                          what they write is synced every burst (written()) so the disk sees the same rate
+    MC_MAINTENANCE_NICE   maintenance threads run at this niceness (1-19) and MC_MAINTENANCE_IO_CLASS ("idle" or
+    MC_MAINTENANCE_IO_CLASS  "best-effort") I/O priority on linux; on windows either puts them in background mode,
+    MC_MAINTENANCE_CPUS   which lowers both. MC_MAINTENANCE_CPUS ("2,3" or "2-3") keeps them to those cores
+    MC_SERVER_CPUS        pins bedrock_server to these cores, maintenance then defaults to the others
+
+Maintenance threads call maintenance_thread() as they start (it is the thread pools' initializer), and the settings
+apply per thread, so the supervisor and console threads keep their normal priority. Where the server is waiting on the
+work (the `save hold` copy, and anything done while it is stopped for an update) it runs under unthrottled() on a
+thread that was never deprioritised, as stretching those windows would cost more than the I/O does.
+
+"""
+
+import os
+import time
+import ctypes
+import logging
+import platform
+import threading
+from contextlib import contextmanager
+
+_log = logging.getLogger(__name__)
+
+BURST_SECONDS = 0.25  # how far the I/O bucket can run ahead of its rate
+
+_IO_CLASSES = {"best-effort": 2, "idle": 3}  # linux IOPRIO_CLASS_*
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+_SYS_IOPRIO_SET = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289, "aarch64": 30, "arm64": 30}
+
+# windows
+_THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+_PROCESS_SET_INFORMATION = 0x0200
+_PROCESS_QUERY_INFORMATION = 0x0400
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # windows has no fdatasync
+
+_limits: "Limits | None" = None
+_local = threading.local()
+
+
+def parse_cpu_list(value: str) -> set[int]:
+    """
+    :param value: e.g. "0,2-3"
+    """
+    cpus = set()
+    for part in value.replace("'", "").replace('"', "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def _env_str(name: str) -> str | None:
+    value = os.environ.get(name)
+    if value is None:
+        return None
+    return value.replace("'", "").replace('"', "").strip() or None
+
+
+class TokenBucket:
+    """
+    consume(n) blocks until n bytes are allowed through. Callers may overdraw it by one chunk, and then sleep off the
+    debt, so chunks bigger than the bucket still pass at the right average rate.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        if rate <= 0:
+            raise ValueError(f"I/O limit must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate * BURST_SECONDS
+        self.waited = 0.0  # total seconds callers have been held back, for the benchmarks
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def consume(self, n: int):
+        with self.__lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Limits:
+    def __init__(self, io_limit_bps: int | None = None, nice: int = 0, io_class: str | None = None,
+                 maintenance_cpus: set[int] | None = None, server_cpus: set[int] | None = None):
+        if io_class is not None and io_class not in _IO_CLASSES:
+            raise ValueError(f"Unknown I/O class: {io_class}, expected one of {list(_IO_CLASSES)}")
+        self.io_limit_bps = io_limit_bps
+        self.nice = nice
+        self.io_class = io_class
+        self.server_cpus = server_cpus or None
+        if maintenance_cpus is None and self.server_cpus is not None:
+            # keep off the server's reserved cores, unless that leaves nothing
+            maintenance_cpus = set(range(os.cpu_count() or 1)) - self.server_cpus or None
+        self.maintenance_cpus = maintenance_cpus or None
+        self.io_bucket = TokenBucket(io_limit_bps) if io_limit_bps else None
+
+    @classmethod
+    def from_env(cls) -> "Limits":
+        kwargs = {}
+        for name, key, parse in (
+            ("MC_IO_LIMIT_BPS", "io_limit_bps", int),
+            ("MC_MAINTENANCE_NICE", "nice", int),
+            ("MC_MAINTENANCE_IO_CLASS", "io_class", str),
+            ("MC_MAINTENANCE_CPUS", "maintenance_cpus", parse_cpu_list),
+            ("MC_SERVER_CPUS", "server_cpus", parse_cpu_list),
+        ):
+            value = _env_str(name)
+            if value is None:
+                continue
+            try:
+                kwargs[key] = parse(value)
+            except ValueError:
+                _log.warning(f"{name} is set to '{value}', which is not valid, ignoring it")
+        try:
+            return cls(**kwargs)
+        except ValueError as e:
+            _log.warning(f"Ignoring maintenance limits: {e}")
+            return cls()
+
+    def __repr__(self):
+        return (f"Limits(io_limit_bps={self.io_limit_bps}, nice={self.nice}, io_class={self.io_class}, "
+                f"maintenance_cpus={self.maintenance_cpus}, server_cpus={self.server_cpus})")
+
+
+def get_limits() -> Limits:
+    global _limits
+    if _limits is None:
+        _limits = Limits.from_env()
+        _log.info(f"Maintenance limits: {_limits}")
+    return _limits
+
+
+def set_limits(limits: Limits):
+    """
+    Replace the limits read from the environment, threads already set up by maintenance_thread() keep theirs
+    """
+    global _limits
+    _limits = limits
+
+
+def throttle(n: int):
+    """
+    Account for n bytes about to be (or just) read or written, sleeping if over MC_IO_LIMIT_BPS
+    """
+    bucket = get_limits().io_bucket
+    if bucket is None or getattr(_local, "unthrottled", False):
+        return
+    bucket.consume(n)
+
+
+def written(f, n: int):
+    """
+    Account for n bytes just written to f. Under MC_IO_LIMIT_BPS the file is synced every burst's worth of bytes this
+    thread writes, so they reach the disk at the limited rate, rather than sitting in the page cache until the kernel
+    writes them all back at once and the server's own saves queue up behind them.
+
+    :param f: the open file, or anything with flush() and fileno()
+    """
+    bucket = get_limits().io_bucket
+    if bucket is None or getattr(_local, "unthrottled", False):
+        return
+    _local.unsynced = getattr(_local, "unsynced", 0) + n
+    if _local.unsynced < bucket.capacity:
+        return
+    _local.unsynced = 0
+    f.flush()
+    _fdatasync(f.fileno())
+
+
+@contextmanager
+def unthrottled():
+    """
+    Skip the I/O limit on this thread inside the block, for work the server is waiting on
+    """
+    previous = getattr(_local, "unthrottled", False)
+    _local.unthrottled = True
+    try:
+        yield
+    finally:
+        _local.unthrottled = previous
+
+
+def maintenance_thread():
+    """
+    Lower the calling thread's CPU and I/O priority and keep it to the maintenance cores, as configured. Call at the
+    start of a maintenance thread, or pass as a ThreadPoolExecutor's initializer.
+    """
+    limits = get_limits()
+    if not (limits.nice or limits.io_class or limits.maintenance_cpus):
+        return
+    try:
+        if os.name == "nt":
+            _maintenance_thread_windows(limits)
+        else:
+            _maintenance_thread_posix(limits)
+    except Exception as e:  # never worth failing a backup over
+        _log.warning(f"Could not lower the priority of maintenance thread {threading.current_thread().name}: {e}")
+
+
+def _maintenance_thread_posix(limits: Limits):
+    tid = threading.get_native_id()  # on linux each thread is its own task, so these only apply to this one
+    if limits.nice:
+        os.setpriority(os.PRIO_PROCESS, tid, max(os.getpriority(os.PRIO_PROCESS, tid), limits.nice))
+    if limits.io_class is not None:
+        syscall = _SYS_IOPRIO_SET.get(platform.machine().lower())
+        if syscall is None:
+            _log.debug(f"Don't know ioprio_set on {platform.machine()}, not setting the I/O class")
+        else:
+            libc = ctypes.CDLL(None, use_errno=True)
+            priority = _IO_CLASSES[limits.io_class] << _IOPRIO_CLASS_SHIFT | (7 if limits.io_class != "idle" else 0)
+            if libc.syscall(syscall, _IOPRIO_WHO_PROCESS, tid, priority) != 0:
+                raise OSError(ctypes.get_errno(), "ioprio_set failed")
+    if limits.maintenance_cpus is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(tid, limits.maintenance_cpus)
+
+
+def _maintenance_thread_windows(limits: Limits):
+    kernel32 = ctypes.windll.kernel32  # noqa  # windows only
+    thread = kernel32.GetCurrentThread()
+    if limits.nice or limits.io_class is not None:
+        # background mode lowers the thread's CPU, I/O and memory priority together
+        if not kernel32.SetThreadPriority(thread, _THREAD_MODE_BACKGROUND_BEGIN):
+            raise ctypes.WinError()
+    if limits.maintenance_cpus is not None:
+        if not kernel32.SetThreadAffinityMask(thread, _cpu_mask(limits.maintenance_cpus)):
+            raise ctypes.WinError()
+
+
+def _cpu_mask(cpus: set[int]) -> int:
+    mask = 0
+    for cpu in cpus:
+        mask |= 1 << cpu
+    return mask
+
+
+def pin_server_process(pid: int):
+    """
+    Pin the server process to MC_SERVER_CPUS, if set
+    """
+    cpus = get_limits().server_cpus
+    if cpus is None:
+        return
+    try:
+        if os.name == "nt":
+            kernel32 = ctypes.windll.kernel32  # noqa  # windows only
+            handle = kernel32.OpenProcess(_PROCESS_SET_INFORMATION | _PROCESS_QUERY_INFORMATION, False, pid)
+            if not handle:
+                raise ctypes.WinError()
+            try:
+                if not kernel32.SetProcessAffinityMask(handle, _cpu_mask(cpus)):
+                    raise ctypes.WinError()
+            finally:
+                kernel32.CloseHandle(handle)
+        else:
+            os.sched_setaffinity(pid, cpus)
+        _log.info(f"Pinned the server (pid {pid}) to cpus {sorted(cpus)}")
+    except Exception as e:
+        _log.warning(f"Could not pin the server to cpus {sorted(cpus)}: {e}")
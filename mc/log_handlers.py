@@ -0,0 +1,194 @@
+"""
+Logging handlers for the daily log files in the logs directory
+
+QueuedDailyFileHandler is what gets attached to loggers: emit() only puts the record on a queue, and a single writer
+thread formats records and writes them through a DailyFileHandler, which keeps the current day's file open, batches
+writes, and rolls over to a new file at midnight.
+
+"""
+
+import os
+import copy
+import gzip
+import queue
+import shutil
+import logging
+import datetime
+import logging.handlers
+from threading import Thread
+from mc import paths
+
+_log = logging.getLogger(__name__)
+
+_STOP = object()  # sentinel telling the writer thread to exit
+
+
+def _gzip_file(path: str):
+    try:
+        with open(path, "rb") as f_in, gzip.open(path + ".gz", "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(path)
+    except Exception as e:
+        _log.error(f"Error compressing old log {path}: {e}")
+
+
+class DailyFileHandler(logging.Handler):
+    """
+    Writes records to <logs dir>/<YYYY-mm-dd>.log, keeping the current day's file open.
+
+    Formatted lines are buffered and written out once flush_bytes have built up, or flush_interval seconds have passed
+    since the last write (checked on each record, and by QueuedDailyFileHandler's writer thread when idle). Not
+    thread safe on its own, it expects to be driven by a single writer thread.
+
+    """
+
+    def __init__(self, log_dir: str | None = None, flush_bytes: int = 64 * 1024, flush_interval: float = 1.0,
+                 gzip_old: bool = False, level=logging.NOTSET):
+        super().__init__(level)
+        self.log_dir = log_dir if log_dir is not None else paths.get_path_to_logs_dir()
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.gzip_old = gzip_old
+
+        self._file = None
+        self._path = None
+        self._next_rollover = 0.0  # timestamp of the next midnight
+        self._buffer: list[str] = []
+        self._buffered_records: list[logging.LogRecord] = []
+        self._buffered_bytes = 0
+        self._last_flush = 0.0
+        self.on_write = None  # optional callback(path, offset, records, lines) run after each batch is written
+
+        if gzip_old:
+            Thread(target=self._gzip_old_logs, daemon=True).start()
+
+    def _gzip_old_logs(self):
+        today = datetime.date.today().strftime("%Y-%m-%d") + ".log"
+        for name in os.listdir(self.log_dir):
+            if name.endswith(".log") and name < today:
+                _gzip_file(os.path.join(self.log_dir, name))
+
+    def _rollover(self, created: float):
+        self._write_buffer()
+        previous = self._path
+        if self._file is not None:
+            self._file.close()
+
+        day = datetime.datetime.fromtimestamp(created).date()
+        self._next_rollover = datetime.datetime.combine(
+            day + datetime.timedelta(days=1), datetime.time()
+        ).timestamp()
+        self._path = os.path.join(self.log_dir, f"{day.strftime('%Y-%m-%d')}.log")
+        self._file = open(self._path, "ab")  # binary, so tell() gives byte offsets for the log index
+
+        if self.gzip_old and previous is not None and previous != self._path:
+            Thread(target=_gzip_file, args=(previous,), daemon=True).start()
+
+    def _write_buffer(self):
+        if not self._buffer or self._file is None:
+            return
+        offset = self._file.tell()
+        lines = self._buffer
+        records = self._buffered_records
+        self._file.write("".join(lines).encode("utf-8"))
+        self._file.flush()
+        self._buffer = []
+        self._buffered_records = []
+        self._buffered_bytes = 0
+        if self.on_write is not None:
+            try:
+                self.on_write(self._path, offset, records, lines)
+            except Exception as e:
+                _log.error(f"Error in log write callback: {e}")
+
+    def seconds_until_flush(self, now: float) -> float | None:
+        """
+        :return: how long until buffered lines are due to be written, or None if nothing is buffered
+        """
+        if not self._buffer:
+            return None
+        return max(self._last_flush + self.flush_interval - now, 0.0)
+
+    def emit(self, record):
+        try:
+            if record.created >= self._next_rollover:
+                self._rollover(record.created)
+
+            line = self.format(record) + "\n"
+            if not self._buffer:
+                self._last_flush = record.created
+            self._buffer.append(line)
+            self._buffered_records.append(record)
+            self._buffered_bytes += len(line)
+
+            if self._buffered_bytes >= self.flush_bytes or record.created - self._last_flush >= self.flush_interval:
+                self._write_buffer()
+        except Exception:  # noqa  # logging's own error reporting
+            self.handleError(record)
+
+    def flush(self):
+        self._write_buffer()
+
+    def close(self):
+        try:
+            self._write_buffer()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        finally:
+            super().close()
+
+
+class QueuedDailyFileHandler(logging.handlers.QueueHandler):
+    """
+    Attach this to loggers. Records are queued by the logging thread and written by a dedicated writer thread through
+    a DailyFileHandler, so logging a line never waits on file I/O.
+
+    The formatter set on this handler is used by the writer thread.
+
+    """
+
+    def __init__(self, log_dir: str | None = None, flush_bytes: int = 64 * 1024, flush_interval: float = 1.0,
+                 gzip_old: bool = False, level=logging.NOTSET):
+        super().__init__(queue.SimpleQueue())
+        self.setLevel(level)
+        self.file_handler = DailyFileHandler(
+            log_dir=log_dir, flush_bytes=flush_bytes, flush_interval=flush_interval, gzip_old=gzip_old
+        )
+        self._writer = Thread(target=self._write_loop, daemon=True, name="log-writer")
+        self._writer.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.file_handler.setFormatter(fmt)
+
+    def prepare(self, record):
+        # resolve the message and exception text now (args may change after we return), but leave the formatting
+        # itself to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def _write_loop(self):
+        while True:
+            timeout = self.file_handler.seconds_until_flush(datetime.datetime.now().timestamp())
+            try:
+                record = self.queue.get(timeout=timeout) if timeout is not None else self.queue.get()
+            except queue.Empty:
+                self.file_handler.flush()
+                continue
+            if record is _STOP:
+                self.file_handler.flush()  # on this thread, like every other write
+                return
+            self.file_handler.handle(record)
+
+    def close(self):
+        if self._writer.is_alive():
+            self.queue.put(_STOP)
+            self._writer.join()
+        self.file_handler.close()
+        super().close()
@@ -0,0 +1,328 @@
+"""
+A sidecar index over the daily log files, so time range and player queries seek straight to the right bytes
+
+The index lives in <logs dir>/index.sqlite3 and holds:
+
+    minutes        the byte offset of the first line logged in each minute of each day's file
+    player_events  every player connect/disconnect, with the byte range of its line
+
+LogIndexer is attached to the DailyFileHandler and indexes each batch after it is written, on the log writer thread,
+so the logging path itself never waits on it. LogIndex answers queries, and the module can be run as a CLI:
+
+    python -m mc.log_index --player Steve
+    python -m mc.log_index --since "2024-06-01 02:00" --until "2024-06-01 04:00" --level ERROR
+    python -m mc.log_index --reindex
+
+"""
+
+import os
+import re
+import gzip
+import sqlite3
+import logging
+import argparse
+import datetime
+from threading import RLock
+from mc import paths
+from mc import events
+
+_log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS minutes (
+    day TEXT NOT NULL,
+    minute INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (day, minute)
+);
+CREATE TABLE IF NOT EXISTS player_events (
+    created REAL NOT NULL,
+    day TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    xuid TEXT,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS player_events_player ON player_events (player, created);
+"""
+
+# asctime at the start of each formatted line, e.g. "2024-06-01 12:00:00,123 - out - INFO - ..."
+_line_time_pattern = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})")
+
+
+def get_path_to_index() -> str:
+    return os.path.join(paths.get_path_to_logs_dir(), "index.sqlite3")
+
+
+def _day_of(path: str) -> str:
+    return os.path.basename(path).split(".")[0]
+
+
+def _minute_of(created: float) -> int:
+    t = datetime.datetime.fromtimestamp(created)
+    return t.hour * 60 + t.minute
+
+
+def _player_event(parser: events.EventParser, record: logging.LogRecord):
+    if record.name != "out":
+        return None
+    event = parser.parse(str(record.msg))
+    if isinstance(event, events.PlayerConnected):
+        return "connected", event
+    if isinstance(event, events.PlayerDisconnected):
+        return "disconnected", event
+    return None
+
+
+class LogIndexer:
+    """
+    Indexes log batches as DailyFileHandler writes them, attach with `LogIndexer().attach(handler.file_handler)`
+    """
+
+    def __init__(self, index_path: str | None = None):
+        self.index_path = index_path if index_path is not None else get_path_to_index()
+        self._conn = None
+        self._parser = events.EventParser()
+        self._last_minute: tuple[str, int] | None = None
+
+    def attach(self, file_handler):
+        file_handler.on_write = self.on_write
+
+    def _connect(self):
+        if self._conn is None:
+            # only ever used from one thread at a time (the log writer, or reindex before logging starts)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def on_write(self, path: str, offset: int, records: list[logging.LogRecord], lines: list[str]):
+        day = _day_of(path)
+        minute_rows = []
+        player_rows = []
+        for record, line in zip(records, lines):
+            length = len(line.encode("utf-8"))
+            minute = _minute_of(record.created)
+            if self._last_minute != (day, minute):
+                self._last_minute = (day, minute)
+                minute_rows.append((day, minute, offset))
+
+            player_event = _player_event(self._parser, record)
+            if player_event is not None:
+                kind, event = player_event
+                player_rows.append((record.created, day, offset, length, event.player, event.xuid, kind))
+            offset += length
+
+        if not minute_rows and not player_rows:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO minutes (day, minute, offset) VALUES (?, ?, ?)", minute_rows)
+            conn.executemany(
+                "INSERT INTO player_events (created, day, offset, length, player, xuid, event) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", player_rows
+            )
+
+    def reindex(self, log_dir: str | None = None) -> int:
+        """
+        Rebuild the index for every daily log file on disk (e.g. ones written before the index existed) by scanning
+        them once.
+
+        :return: number of files indexed
+        """
+        log_dir = log_dir if log_dir is not None else paths.get_path_to_logs_dir()
+        conn = self._connect()
+        count = 0
+        for name in sorted(os.listdir(log_dir)):
+            if not (name.endswith(".log") or name.endswith(".log.gz")):
+                continue
+            day = _day_of(name)
+            path = os.path.join(log_dir, name)
+            opener = gzip.open if name.endswith(".gz") else open
+            minute_rows = []
+            player_rows = []
+            last_minute = None
+            offset = 0
+            with opener(path, "rb") as f:
+                for raw in f:
+                    line = raw.decode("utf-8", errors="replace")
+                    match = _line_time_pattern.match(line)
+                    if match is not None:
+                        created = datetime.datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").timestamp()
+                        minute = _minute_of(created)
+                        if minute != last_minute:
+                            last_minute = minute
+                            minute_rows.append((day, minute, offset))
+                        parts = line.rstrip("\n").split(" - ", 3)
+                        if len(parts) == 4:
+                            record = logging.makeLogRecord({"name": parts[1], "msg": parts[3]})
+                            player_event = _player_event(self._parser, record)
+                            if player_event is not None:
+                                kind, event = player_event
+                                player_rows.append(
+                                    (created, day, offset, len(raw), event.player, event.xuid, kind)
+                                )
+                    offset += len(raw)
+
+            with conn:
+                conn.execute("DELETE FROM minutes WHERE day = ?", (day,))
+                conn.execute("DELETE FROM player_events WHERE day = ?", (day,))
+                conn.executemany("INSERT OR IGNORE INTO minutes (day, minute, offset) VALUES (?, ?, ?)",
+                                 minute_rows)
+                conn.executemany(
+                    "INSERT INTO player_events (created, day, offset, length, player, xuid, event) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", player_rows
+                )
+            count += 1
+        return count
+
+
+class LogIndex:
+    """
+    Queries over the log index, opening the day's log files and reading only the indexed byte ranges
+    """
+
+    def __init__(self, index_path: str | None = None, log_dir: str | None = None):
+        self.log_dir = log_dir if log_dir is not None else paths.get_path_to_logs_dir()
+        self.index_path = index_path if index_path is not None else get_path_to_index()
+        self.__lock = RLock()
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self.__lock:
+            self._conn.close()
+
+    def _open_day(self, day: str):
+        path = os.path.join(self.log_dir, f"{day}.log")
+        if os.path.exists(path):
+            return open(path, "rb")
+        if os.path.exists(path + ".gz"):
+            return gzip.open(path + ".gz", "rb")
+        return None
+
+    def _read_range(self, day: str, offset: int, length: int | None) -> bytes:
+        f = self._open_day(day)
+        if f is None:
+            return b""
+        with f:
+            f.seek(offset)
+            return f.read() if length is None else f.read(length)
+
+    def player_events(self, player: str, event: str | None = None, limit: int | None = None) -> list[dict]:
+        """
+        :return: connect/disconnect events for a player, newest first, each with the log line
+        """
+        query = "SELECT created, day, offset, length, xuid, event FROM player_events WHERE player = ?"
+        args: list = [player]
+        if event is not None:
+            query += " AND event = ?"
+            args.append(event)
+        query += " ORDER BY created DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self.__lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [{
+            "time": datetime.datetime.fromtimestamp(created),
+            "event": kind,
+            "xuid": xuid,
+            "line": self._read_range(day, offset, length).decode("utf-8", errors="replace").rstrip("\n"),
+        } for created, day, offset, length, xuid, kind in rows]
+
+    def last_join(self, player: str) -> dict | None:
+        found = self.player_events(player, event="connected", limit=1)
+        return found[0] if found else None
+
+    def _day_range(self, day: str, start_minute: int, end_minute: int) -> tuple[int, int | None] | None:
+        """
+        :return: (offset, length or None for to the end of file) covering [start_minute, end_minute] of a day
+        """
+        with self.__lock:
+            start = self._conn.execute(
+                "SELECT offset FROM minutes WHERE day = ? AND minute >= ? ORDER BY minute LIMIT 1",
+                (day, start_minute)
+            ).fetchone()
+            end = self._conn.execute(
+                "SELECT offset FROM minutes WHERE day = ? AND minute > ? ORDER BY minute LIMIT 1",
+                (day, end_minute)
+            ).fetchone()
+        if start is None:
+            return None
+        if end is None:
+            return start[0], None
+        return start[0], end[0] - start[0]
+
+    def query(self, since: datetime.datetime, until: datetime.datetime, level: str | None = None,
+              contains: str | None = None):
+        """
+        Yield the log records (including continuation lines, e.g. tracebacks) logged between since and until,
+        optionally filtered by level and substring.
+        """
+        day = since.date()
+        while day <= until.date():
+            day_str = day.strftime("%Y-%m-%d")
+            start_minute = since.hour * 60 + since.minute if day == since.date() else 0
+            end_minute = until.hour * 60 + until.minute if day == until.date() else 24 * 60
+            byte_range = self._day_range(day_str, start_minute, end_minute)
+            day += datetime.timedelta(days=1)
+            if byte_range is None:
+                continue
+
+            data = self._read_range(day_str, *byte_range).decode("utf-8", errors="replace")
+            for record in self._split_records(data):
+                match = _line_time_pattern.match(record)
+                if match is None:
+                    continue
+                created = datetime.datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+                if created < since.replace(microsecond=0) or created > until:
+                    continue
+                if level is not None:
+                    parts = record.split(" - ", 3)
+                    if len(parts) < 3 or parts[2] != level:
+                        continue
+                if contains is not None and contains not in record:
+                    continue
+                yield record
+
+    @staticmethod
+    def _split_records(data: str):
+        # a record starts with its timestamp, anything else is a continuation of the previous one
+        current = []
+        for line in data.splitlines():
+            if _line_time_pattern.match(line) and current:
+                yield "\n".join(current)
+                current = []
+            current.append(line)
+        if current:
+            yield "\n".join(current)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the log index")
+    parser.add_argument("--player", help="show connect/disconnect events for a player")
+    parser.add_argument("--since", help="start of a time range, e.g. '2024-06-01 02:00'")
+    parser.add_argument("--until", help="end of a time range (defaults to now)")
+    parser.add_argument("--level", help="only records at this level, e.g. ERROR")
+    parser.add_argument("--contains", help="only records containing this text")
+    parser.add_argument("--reindex", action="store_true", help="rebuild the index from the log files on disk")
+    args = parser.parse_args()
+
+    if args.reindex:
+        print(f"Indexed {LogIndexer().reindex()} log files")
+
+    index = LogIndex()
+    if args.player:
+        for event in index.player_events(args.player):
+            print(f"{event['time']:%Y-%m-%d %H:%M:%S} {event['event']:>12} {event['line']}")
+    if args.since:
+        since = datetime.datetime.fromisoformat(args.since)
+        until = datetime.datetime.fromisoformat(args.until) if args.until else datetime.datetime.now()
+        for record in index.query(since, until, level=args.level, contains=args.contains):
+            print(record)
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
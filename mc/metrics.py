@@ -0,0 +1,405 @@
+"""
+Holds the metrics registry and the /metrics endpoint, which serves it in the Prometheus text format
+
+Set MC_METRICS_PORT to serve it (on 127.0.0.1, or MC_METRICS_HOST), e.g. for Prometheus to scrape every 15 seconds.
+
+Two kinds of numbers go into it. Events are recorded as they happen, into the counters and histograms defined below
+(a backup finishing, an update's downtime, a download, a discovery request): a lock and an add or two each, and they
+happen at most a few times an hour. Everything that changes all the time (stdout lines, the command queue, uptime and
+the server process's CPU, memory and I/O) is only read when /metrics is scraped, from the supervisors registered with
+watch_supervisor(), so the server's hot paths pay nothing more than the plain counters they already keep.
+
+"""
+
+import os
+import bisect
+import logging
+import weakref
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, from a few milliseconds (save hold, a cached discovery) up to an hour (a big backup)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100  # for /proc/<pid>/stat
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_registry: "Registry | None" = None
+_server: ThreadingHTTPServer | None = None
+_supervisors = weakref.WeakSet()
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        """
+        :return: (name with suffix, formatted labels, value) of every sample
+        """
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """Only goes up, inc(amount, **labels)"""
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Goes up and down, set(value, **labels)"""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels) -> float | None:
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+
+class Histogram(_Metric):
+    """Counts observations into buckets (and keeps their sum), observe(value, **labels)"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket (not cumulative, that is worked out when scraped), then +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def get_count(self, **labels) -> int:
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return sum(counts[:-1]) if counts is not None else 0
+
+    def get_sum(self, **labels) -> float:
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return counts[-1] if counts is not None else 0.0
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        samples = []
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, le), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """
+    Use the shared one from get_registry(), which every metric in this module is registered with
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors = []
+        self.__lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self.__lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DURATION_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """
+        :param collector: called on every scrape, returns a list of metrics made up on the spot (e.g. Gauges read
+            from /proc), for numbers that change too often to keep up to date as they happen
+        """
+        with self.__lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        :return: every metric in the Prometheus text format
+        """
+        with self.__lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:  # one bad collector shouldn't take the others down with it
+                _log.error(f"Error in metrics collector {collector}", exc_info=e)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def get_registry() -> Registry:
+    """
+    :return: the shared registry, which /metrics serves
+    """
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+        _registry.add_collector(_collect_supervisors)
+    return _registry
+
+
+def server_label(name: str | None) -> str:
+    """
+    :return: the `server` label for a Supervisor's name, "server" when it is the only one
+    """
+    return name or "server"
+
+
+# --- read when scraped ---
+
+def watch_supervisor(supervisor):
+    """
+    Report a Supervisor's server (uptime, stdout lines, command queue, process CPU, memory and I/O) on every scrape,
+    for as long as the supervisor exists
+    """
+    _supervisors.add(supervisor)
+
+
+def read_process_stats(pid: int) -> dict[str, float]:
+    """
+    Read a process's CPU time, resident memory and I/O from /proc, only on linux (empty elsewhere). The I/O counts
+    are only readable for our own processes, and missing if the kernel doesn't keep them.
+
+    :return: any of cpu_seconds, rss_bytes, read_bytes, write_bytes
+    """
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            # the name (field 2) can contain spaces and brackets, everything after its closing bracket is plain
+            fields = f.read().rsplit(b")", 1)[1].split()
+        stats["cpu_seconds"] = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS  # utime and stime, fields 14 and 15
+        stats["rss_bytes"] = int(fields[21]) * _PAGE_SIZE  # field 24
+    except (OSError, IndexError, ValueError):
+        return stats
+    try:
+        with open(f"/proc/{pid}/io", "rb") as f:
+            for line in f:
+                key, _, value = line.partition(b":")
+                if key in (b"read_bytes", b"write_bytes"):
+                    stats[key.decode()] = int(value)
+    except (OSError, ValueError):
+        pass
+    return stats
+
+
+def _collect_supervisors() -> list[_Metric]:
+    up = Gauge("mc_server_up", "Whether the server is running and has said it started", ("server",))
+    uptime = Gauge("mc_server_uptime_seconds", "Time since the server was (re)started", ("server",))
+    lines = Counter("mc_server_stdout_lines_total", "Lines the server has written to stdout since it started",
+                    ("server",))
+    queue_depth = Gauge("mc_server_command_queue_depth", "Commands waiting to be written to the server's stdin",
+                        ("server",))
+    cpu = Counter("mc_server_process_cpu_seconds_total", "CPU time used by the server process", ("server",))
+    rss = Gauge("mc_server_process_resident_memory_bytes", "Resident memory of the server process", ("server",))
+    read = Counter("mc_server_process_read_bytes_total", "Bytes the server process has read from disk", ("server",))
+    written = Counter("mc_server_process_write_bytes_total", "Bytes the server process has written to disk",
+                      ("server",))
+
+    for supervisor in list(_supervisors):
+        server = server_label(supervisor.name)
+        runtime = supervisor.runtime
+        process = runtime.process if runtime is not None else None
+        up.set(1 if process is not None and supervisor.started.is_set() else 0, server=server)
+        if process is None:
+            continue
+        uptime.set(round(supervisor.uptime, 3), server=server)
+        lines.inc(runtime.stdout_lines, server=server)
+        queue_depth.set(runtime.command_queue_depth(), server=server)
+        stats = read_process_stats(process.pid)
+        for key, counter in (("cpu_seconds", cpu), ("read_bytes", read), ("write_bytes", written)):
+            if key in stats:
+                counter.inc(stats[key], server=server)
+        if "rss_bytes" in stats:
+            rss.set(stats["rss_bytes"], server=server)
+    return [up, uptime, lines, queue_depth, cpu, rss, read, written]
+
+
+# --- recorded as it happens ---
+
+backup_seconds = get_registry().histogram(
+    "mc_backup_duration_seconds", "Time to archive (or snapshot) a staged backup, after the save hold",
+    ("world", "mode")
+)
+backup_bytes_in = get_registry().counter(
+    "mc_backup_bytes_in_total", "Bytes of world files read into backups", ("world", "mode")
+)
+backup_bytes_out = get_registry().counter(
+    "mc_backup_bytes_out_total", "Bytes written by backups, the archive size or the new chunks stored",
+    ("world", "mode")
+)
+backup_failures = get_registry().counter(
+    "mc_backup_failures_total", "Backups that could not be archived", ("world", "mode")
+)
+save_hold_seconds = get_registry().histogram(
+    "mc_backup_save_hold_seconds", "Time the server held its saves while a backup was staged", ("world",)
+)
+update_downtime_seconds = get_registry().histogram(
+    "mc_update_downtime_seconds", "Time from stopping the old version to the new one saying it started", ("server",)
+)
+update_last_downtime_seconds = get_registry().gauge(
+    "mc_update_last_downtime_seconds", "Stop-to-start time of the most recent update", ("server",)
+)
+download_bytes = get_registry().counter(
+    "mc_download_bytes_total", "Bytes received downloading server versions"
+)
+download_seconds = get_registry().counter(
+    "mc_download_seconds_total", "Time spent downloading server versions"
+)
+download_resumes = get_registry().counter(
+    "mc_download_resumes_total", "Times a download picked up from a partial file"
+)
+download_last_throughput = get_registry().gauge(
+    "mc_download_last_throughput_bytes_per_second", "Network throughput of the most recent download"
+)
+discovery_seconds = get_registry().histogram(
+    "mc_discovery_request_duration_seconds", "Time taken by requests for the latest download link",
+    ("result",)
+)
+discovery_cached = get_registry().counter(
+    "mc_discovery_cache_hits_total", "Lookups of the latest download link answered from the cache"
+)
+server_restarts = get_registry().counter(
+    "mc_server_restarts_total", "Times the server was restarted, by why", ("server", "reason")
+)
+
+
+# --- the endpoint ---
+
+def get_metrics_port() -> int | None:
+    """
+    :return: MC_METRICS_PORT, None (the default) for no endpoint
+    """
+    value = os.environ.get("MC_METRICS_PORT", "").replace("'", "").replace('"', "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        _log.warning(f"MC_METRICS_PORT is set to '{value}', which is not a port, not serving metrics")
+        return None
+
+
+def get_metrics_host() -> str:
+    return os.environ.get("MC_METRICS_HOST", "127.0.0.1").replace("'", "").replace('"', "").strip() or "127.0.0.1"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa  # the name BaseHTTPRequestHandler dispatches to
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = get_registry().render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa  # BaseHTTPRequestHandler's signature
+        _log.debug(f"{self.address_string()} {format % args}")
+
+
+def start_server(port: int | None = None, host: str | None = None) -> ThreadingHTTPServer:
+    """
+    Serve /metrics from a daemon thread
+
+    :param port: defaults to get_metrics_port(), 0 for any free port (see server.server_address)
+    :param host: defaults to get_metrics_host()
+    """
+    global _server
+    port = port if port is not None else get_metrics_port()
+    if port is None:
+        raise ValueError("No port to serve metrics on, set MC_METRICS_PORT")
+    server = ThreadingHTTPServer((host if host is not None else get_metrics_host(), port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    _server = server
+    _log.info(f"Serving metrics on http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    return server
+
+
+def stop_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
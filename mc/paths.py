@@ -111,6 +111,19 @@ def get_path_to_active_dir() -> str:
     return _path_to_active_dir
 
 
+def get_instance_name(active_dir: str | None = None) -> str | None:
+    """
+    :param active_dir: a server's active directory, None for the default one
+    :return: what that server's backups are kept and catalogued under, the name of its active dir (its instance name,
+        see mc.fleet), or None for the server in the default active dir
+    """
+    if active_dir is None:
+        return None
+    if os.path.normcase(os.path.realpath(active_dir)) == os.path.normcase(os.path.realpath(get_path_to_active_dir())):
+        return None
+    return os.path.basename(os.path.normpath(active_dir))
+
+
 def get_path_to_versions_dir() -> str:
     # either the environment variable, or root/data/versions
     global _path_to_versions_dir
@@ -137,7 +150,7 @@ def get_path_to_versions_dir() -> str:
     return _path_to_versions_dir
 
 
-def get_current_version(fail_on_updating: bool = False) -> str | None:
+def get_current_version(fail_on_updating: bool = False, active_dir: str | None = None) -> str | None:
     """
     Get the current version of the server, or None if it is not found.
 
@@ -149,9 +162,12 @@ def get_current_version(fail_on_updating: bool = False) -> str | None:
 
     If neither file exists, we return None.
 
+    :param active_dir: the active directory of the server to look at, defaults to get_path_to_active_dir()
+
     """
 
-    active_dir = get_path_to_active_dir()
+    if active_dir is None:
+        active_dir = get_path_to_active_dir()
 
     updating_to_file = os.path.join(active_dir, ".updating_to")
     if os.path.exists(updating_to_file):
@@ -171,7 +187,7 @@ def get_current_version(fail_on_updating: bool = False) -> str | None:
     return None
 
 
-def get_path_to_minecraft_server_exe(fail_on_updating: bool = True) -> str:
+def get_path_to_minecraft_server_exe(fail_on_updating: bool = True, active_dir: str | None = None) -> str:
     """
     Get the path to the minecraft server exe in the active directory. This is most commonly run when we want to start
      the server, and so we normally want to fail if the server crashed while updating.
@@ -179,6 +195,7 @@ def get_path_to_minecraft_server_exe(fail_on_updating: bool = True) -> str:
     :param fail_on_updating: If True, we will raise an error if the server is updating. If False, we will return the
     path to the exe even if the server is updating.
     :type fail_on_updating: bool
+    :param active_dir: the active directory of the server, defaults to get_path_to_active_dir()
 
     :return: The path to the minecraft server exe
     :rtype: str
@@ -186,10 +203,10 @@ def get_path_to_minecraft_server_exe(fail_on_updating: bool = True) -> str:
     """
     try:
         _ = get_current_version(
-            fail_on_updating=fail_on_updating
+            fail_on_updating=fail_on_updating, active_dir=active_dir
         )
     except RuntimeError as e:
         raise RuntimeError("Server is updating, cannot get path to minecraft server exe") from e
 
     # try to find folder the same as the version
-    return os.path.join(get_path_to_active_dir(), "current", "bedrock_server.exe")
+    return os.path.join(active_dir or get_path_to_active_dir(), "current", "bedrock_server.exe")
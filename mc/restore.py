@@ -0,0 +1,212 @@
+"""
+Restores a world, or some of its files, from any backup in the catalog: runtime zips, incremental snapshots and
+pre-update backups
+
+A restore is done in two steps, so the server is only down for the second:
+
+    prepare_restore  unpack the backup next to the live world (worlds/.restore_<level-name>), decompressing in parallel
+                     and checking every CRC (or chunk hash, for snapshots), safe with the server still running
+    swap_in          with the server stopped, swap the unpacked world in with two renames. For a partial restore the
+                     live world is cloned first (hardlinking its .ldb files) and the restored files laid over the clone
+
+The world that was replaced is kept in worlds/.replaced_<level-name> until the next restore, as an undo.
+
+Supervisor.restore_world() does both around a stop and start of the server. With the server not running, the module
+can be run as a CLI:
+
+    python -m mc.restore --list
+    python -m mc.restore 42
+    python -m mc.restore 42 --file db/000123.ldb --file level.dat
+
+"""
+
+import os
+import time
+import shutil
+import logging
+import argparse
+import datetime
+from mc import paths
+from mc import archive
+from mc import staging
+from mc import backup_catalog
+from mc import backup_store
+from mc import server_runtime
+
+_log = logging.getLogger(__name__)
+
+
+def list_restore_points(world: str | None = None, instance: str | None = None) -> list[dict]:
+    """
+    :param world: only backups that hold this world (update backups hold every world)
+    :param instance: only backups of this server in the fleet, by default every server's
+    :return: backups from the catalog, oldest first
+    """
+    with backup_catalog.BackupCatalog() as catalog:
+        return [b for b in catalog.list_backups(instance=instance) if world is None or b["world"] in (world, None)]
+
+
+def get_restore_point(backup_id: int) -> dict:
+    with backup_catalog.BackupCatalog() as catalog:
+        backup = catalog.get(backup_id)
+    if backup is None:
+        raise KeyError(f"No backup with id {backup_id}")
+    return backup
+
+
+def get_path_to_world(level_name: str, path_to_current: str | None = None) -> str:
+    if path_to_current is None:
+        path_to_current = os.path.join(paths.get_path_to_active_dir(), "current")
+    return os.path.join(path_to_current, "worlds", level_name)
+
+
+def _get_path_to_replaced(world_path: str) -> str:
+    return os.path.join(os.path.dirname(world_path), f".replaced_{os.path.basename(world_path)}")
+
+
+def _file_filter(files: list[str] | None):
+    """
+    :return: called with a path relative to the world, True if it is one of files or inside one of them
+    """
+    if files is None:
+        return None
+    wanted = [f.replace("\\", "/").strip("/") for f in files]
+    return lambda rel_path: any(rel_path == f or rel_path.startswith(f + "/") for f in wanted)
+
+
+def prepare_restore(backup: dict, world_path: str, files: list[str] | None = None, workers: int | None = None) -> str:
+    """
+    Unpack a backup's copy of the world next to world_path, checking every CRC / chunk hash. Doesn't touch the live
+    world, so the server can still be running.
+
+    :param backup: a restore point, from list_restore_points or get_restore_point
+    :param world_path: the live world, e.g. active/current/worlds/<level-name>
+    :param files: paths relative to the world (files or directories) to restore, by default the whole world
+    :param workers: threads to decompress with, defaults to archive.get_archive_workers()
+    :return: the directory it was unpacked to, to pass to swap_in
+    """
+    level_name = os.path.basename(world_path)
+    staged = os.path.join(os.path.dirname(world_path), f".restore_{level_name}")
+    shutil.rmtree(staged, ignore_errors=True)  # left over from an earlier attempt
+    # the previous restore's undo goes now rather than in the swap
+    shutil.rmtree(_get_path_to_replaced(world_path), ignore_errors=True)
+    wanted = _file_filter(files)
+
+    start = time.perf_counter()
+    try:
+        restored = _unpack(backup, level_name, staged, wanted, workers)
+    except Exception:
+        shutil.rmtree(staged, ignore_errors=True)
+        raise
+
+    if not os.listdir(staged):
+        shutil.rmtree(staged)
+        raise FileNotFoundError(f"Backup {backup['id']} has nothing to restore for {level_name} ({files or 'world'})")
+    _log.info(f"Unpacked backup {backup['id']} ({restored / 1024 ** 2:.1f} MiB) in {time.perf_counter() - start:.2f}s "
+              f"to: {staged}")
+    return staged
+
+
+def _unpack(backup: dict, level_name: str, staged: str, wanted, workers: int | None) -> int:
+    kind = backup["kind"]
+    if kind == backup_catalog.KIND_SNAPSHOT:
+        return backup_store.BackupStore().restore(backup["path"], staged, files=wanted, workers=workers)
+    else:
+        # runtime zips hold the world's files at the top, update backups under worlds/<level-name>/
+        prefix = f"worlds/{level_name}/" if kind == backup_catalog.KIND_UPDATE else ""
+
+        def select(name: str) -> str | None:
+            name = name.replace("\\", "/")
+            if not name.startswith(prefix):
+                return None
+            rel_path = name[len(prefix):]
+            if not rel_path or (wanted is not None and not wanted(rel_path.rstrip("/"))):
+                return None
+            return rel_path
+
+        os.makedirs(staged)
+        return archive.extract_archive(backup["path"], staged, workers=workers, select=select)
+
+
+def swap_in(staged: str, world_path: str, partial: bool = False):
+    """
+    Replace the live world with an unpacked backup. The server must be stopped.
+
+    :param partial: staged only holds some of the world's files, which replace those in the live world (everything
+        else is kept)
+    """
+    start = time.perf_counter()
+    replaced = _get_path_to_replaced(world_path)
+    shutil.rmtree(replaced, ignore_errors=True)  # normally already gone, see prepare_restore
+
+    if partial and os.path.isdir(world_path):
+        # clone the live world, lay the restored files over it, then swap the whole thing in, so the world is either
+        # untouched or fully restored
+        merged = staged + "_merged"
+        shutil.rmtree(merged, ignore_errors=True)
+        staging.clone_tree(world_path, merged)
+        for dir_path, dirs, file_names in os.walk(staged):
+            for file in file_names:
+                src = os.path.join(dir_path, file)
+                dst = os.path.join(merged, os.path.relpath(src, staged))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(src, dst)  # replaced, not written through, the clone may share it with the live world
+        shutil.rmtree(staged)
+        staged = merged
+
+    if os.path.isdir(world_path):
+        os.rename(world_path, replaced)
+    os.rename(staged, world_path)
+    _log.info(f"Swapped the restored world in in {time.perf_counter() - start:.3f}s, the world it replaced is in: "
+              f"{replaced}")
+
+
+def restore_world(backup_id: int, level_name: str | None = None, files: list[str] | None = None,
+                  path_to_current: str | None = None, workers: int | None = None) -> str:
+    """
+    Restore a world from a backup, with the server not running
+
+    :param level_name: the world to restore, by default the one the backup was taken of (the current level for update
+        backups)
+    :param path_to_current: the server to restore it to, by default the one the backup was taken of
+    :return: the path of the restored world
+    """
+    backup = get_restore_point(backup_id)
+    if path_to_current is None and backup["instance"] is not None:
+        path_to_current = os.path.join(paths.get_path_to_data_dir(), "instances", backup["instance"], "current")
+    if level_name is None:
+        level_name = backup["world"]
+    if level_name is None:
+        if path_to_current is None:
+            path_to_current = os.path.join(paths.get_path_to_active_dir(), "current")
+        level_name = server_runtime.read_level_name(os.path.join(path_to_current, "bedrock_server.exe"))
+    world_path = get_path_to_world(level_name, path_to_current)
+
+    staged = prepare_restore(backup, world_path, files=files, workers=workers)
+    swap_in(staged, world_path, partial=files is not None)
+    return world_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List backups, or restore a world from one (with the server stopped)")
+    parser.add_argument("backup_id", type=int, nargs="?", help="the backup to restore, see --list")
+    parser.add_argument("--list", action="store_true", help="list the backups that can be restored")
+    parser.add_argument("--world", help="the world to list or restore, defaults to the backup's own")
+    parser.add_argument("--instance", help="only list this fleet server's backups")
+    parser.add_argument("--file", action="append", dest="files",
+                        help="a file or directory (relative to the world) to restore, instead of the whole world")
+    args = parser.parse_args()
+
+    if args.list or args.backup_id is None:
+        for backup in list_restore_points(args.world, instance=args.instance):
+            created = datetime.datetime.fromtimestamp(backup["created"])
+            size = f"{backup['size'] / 1024 ** 2:.1f} MiB" if backup["size"] is not None else "?"
+            print(f"{backup['id']:>6} {created:%Y-%m-%d %H:%M:%S} {backup['kind']:>8} {backup['instance'] or '':<12} "
+                  f"{backup['world'] or '(all)':<20} {size:>12} {backup['source_version'] or ''}")
+        return
+
+    print(f"Restored: {restore_world(args.backup_id, level_name=args.world, files=args.files)}")
+
+
+if __name__ == '__main__':
+    main()
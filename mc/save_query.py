@@ -0,0 +1,77 @@
+"""
+Parsing for the Bedrock server's `save hold` / `save query` / `save resume` protocol
+
+After `save hold`, each `save query` either answers that the previous save is still in progress, or that the data is
+ready, followed by a line listing every file the backup needs and the length it should be truncated to, e.g.
+
+    Data saved. Files are now ready to be copied.
+    Bedrock level/db/000005.ldb:1234, Bedrock level/db/CURRENT:16, Bedrock level/level.dat:2048
+
+The paths are relative to the worlds directory, and so start with the level name.
+
+"""
+
+import re
+from threading import Event, Lock
+
+READY_MARKER = "Data saved. Files are now ready to be copied."
+NOT_READY_MARKER = "A previous save has not been completed."
+
+# "<path>:<length>" entries separated by ", ", non-greedy so paths containing ':' still parse
+_file_entry_pattern = re.compile(r"(.+?):(\d+)(?:, |$)")
+
+
+def parse_file_list(line: str) -> list[tuple[str, int]]:
+    """
+    Parse the file list line of a `save query` response.
+
+    :return: list of (path relative to the worlds dir, length to copy)
+    """
+    line = line.strip()
+    files = []
+    for match in _file_entry_pattern.finditer(line):
+        files.append((match.group(1).strip(), int(match.group(2))))
+    return files
+
+
+class SaveQueryWaiter:
+    """
+    Subscribed to an EventParser's SaveQueryResult and SaveQueryNotReady events, and collects the response to
+    `save query`.
+
+    Each call to `reset()` starts a new attempt, `wait()` then blocks until the server answers that attempt.
+
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._answered = Event()
+        self.ready = False
+        self.files: list[tuple[str, int]] = []
+
+    def reset(self):
+        with self._lock:
+            self._answered.clear()
+            self.ready = False
+            self.files = []
+
+    def on_result(self, event):
+        with self._lock:
+            self.files = event.files
+            self.ready = True
+            self._answered.set()
+
+    def on_not_ready(self, event):  # noqa  # event unused, signature matches the subscriber callback
+        with self._lock:
+            self.ready = False
+            self._answered.set()
+
+    @property
+    def answered(self) -> bool:
+        return self._answered.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        :return: True if the server answered within the timeout (check `ready` for which answer)
+        """
+        return self._answered.wait(timeout)
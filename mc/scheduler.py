@@ -0,0 +1,350 @@
+"""
+Holds the Scheduler, which runs every timed task (hourly backups, timed restarts, update countdowns, health checks and
+the supervisor's own timers) from one thread
+
+A task is a callback and a trigger saying when it is due:
+
+    Interval(3600)         every so many seconds
+    Cron("0 4 * * *")      whenever a cron expression (minute hour day-of-month month day-of-week, local time) matches
+    Steps([0, 600, 900])   once at each of these offsets from when it was scheduled, e.g. a countdown
+
+Callbacks run on the scheduler thread, so they should be quick, anything slow hands itself to its own thread or
+executor (the Supervisor's post themselves to its queue). Between tasks the thread sleeps in a single blocking get,
+which times out exactly when the next one is due or returns when a new one is added, so it uses no CPU while idle.
+
+Named tasks are persistent: when each last ran is kept in data/schedule.json, so a restart of the process doesn't
+reset them, e.g. an hourly backup is still due an hour after the last one rather than an hour after the restart. Runs
+that fell due while the process was down are skipped, not made up.
+
+"""
+
+import os
+import json
+import time
+import heapq
+import queue
+import logging
+import datetime
+from threading import Thread, Lock
+from mc import paths
+
+_log = logging.getLogger(__name__)
+
+_scheduler: "Scheduler | None" = None
+
+_ADD = "add"
+_SHUTDOWN = "shutdown"
+
+
+def get_scheduler() -> "Scheduler":
+    """
+    :return: the shared scheduler, so every server in the process uses the one thread
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
+
+
+def get_path_to_schedule() -> str:
+    return os.path.join(paths.get_path_to_data_dir(), "schedule.json")
+
+
+class Interval:
+    skips_missed = True  # after falling behind (e.g. the machine slept) runs once, not once per missed interval
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError(f"Interval must be positive, got {seconds}")
+        self.seconds = seconds
+
+    def first(self, now: float) -> float | None:
+        return now + self.seconds
+
+    def next_after(self, previous: float) -> float | None:
+        """
+        :param previous: when it was last due (time.time())
+        :return: when it is next due, None for never
+        """
+        return previous + self.seconds
+
+    def __repr__(self):
+        return f"Interval({self.seconds})"
+
+
+class Steps:
+    """Once at each offset (seconds) from when it was scheduled, one Steps per task"""
+    skips_missed = False  # every step runs, however late
+
+    def __init__(self, offsets: list[float]):
+        if not offsets:
+            raise ValueError("Steps needs at least one offset")
+        self.offsets = sorted(offsets)
+        self._start = None
+        self._index = 0
+
+    def first(self, now: float) -> float | None:
+        self._start = now
+        self._index = 0
+        return now + self.offsets[0]
+
+    def next_after(self, previous: float) -> float | None:
+        self._index += 1
+        if self._start is None or self._index >= len(self.offsets):
+            return None
+        return self._start + self.offsets[self._index]
+
+    def __repr__(self):
+        return f"Steps({self.offsets})"
+
+
+class Cron:
+    """
+    Standard five field cron expressions, in local time: each field is *, a number, a range (a-b), a step (*/n or
+    a-b/n) or a comma separated list of those. Day of week is 0-6 from Sunday (7 is Sunday too). As in cron, when both
+    day of month and day of week are restricted a day matching either is due.
+    """
+
+    skips_missed = True
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields (minute hour day month weekday): '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self._RANGES)
+        )
+        self.weekdays = {d % 7 for d in weekdays}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set[int]:
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(p) for p in part.split("-", 1))
+            else:
+                start = end = int(part)
+            step = int(step) if step else 1
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Cron field '{field}' out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day: datetime.datetime) -> bool:
+        in_month = day.day in self.days
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return in_week
+        if self._any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def first(self, now: float) -> float | None:
+        return self.next_after(now)
+
+    def next_after(self, previous: float) -> float | None:
+        t = datetime.datetime.fromtimestamp(previous).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5)  # e.g. 0 0 29 2 1 can be years away, 31 2 never is
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + datetime.timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(t):
+                t = (t + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif t.hour not in self.hours:
+                t = (t + datetime.timedelta(hours=1)).replace(minute=0)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t.timestamp()
+        return None
+
+    def __repr__(self):
+        return f"Cron('{self.expression}')"
+
+
+class Task:
+    """
+    Returned by Scheduler.schedule (and friends), cancel() stops it from running again. `due` is when it next runs
+    (time.time()), None once it is finished.
+    """
+    __slots__ = ("trigger", "callback", "name", "due", "runs", "cancelled")
+
+    def __init__(self, trigger, callback, name: str | None = None):
+        self.trigger = trigger
+        self.callback = callback
+        self.name = name
+        self.due: float | None = None
+        self.runs = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return f"Task({self.name or self.callback}, {self.trigger}, due={self.due})"
+
+
+class Scheduler:
+    """
+    Use the shared one from get_scheduler(). Its thread is started with the first task, and is a daemon, so it
+    doesn't hold the process open.
+
+    """
+
+    def __init__(self, path_to_state: str | None = None):
+        """
+        :param path_to_state: where named tasks' last runs are kept, defaults to get_path_to_schedule()
+        """
+        self.path_to_state = path_to_state
+        self.wakeups = 0  # times the thread woke up, for checking it really idles
+        self._events = queue.SimpleQueue()
+        self._heap: list[tuple[float, int, Task]] = []
+        self._seq = 0
+        self._thread: Thread | None = None
+        self._last_runs: dict[str, float] | None = None  # loaded with the first named task
+        self.__lock = Lock()
+
+    # --- called from any thread ---
+
+    def schedule(self, trigger, callback, name: str | None = None) -> Task:
+        """
+        Run callback() on the scheduler thread whenever trigger is due
+
+        :param name: makes the task persistent, it picks up from when a task of this name last ran (if it is still
+            to come), see the module docstring
+        """
+        return self.add(Task(trigger, callback, name))
+
+    def call_later(self, delay: float, callback) -> Task:
+        """
+        Run callback() on the scheduler thread once, after delay seconds
+        """
+        return self.schedule(Steps([delay]), callback)
+
+    def sequence(self, steps: list[tuple[float, object]]) -> Task:
+        """
+        Run each callback of steps, a list of (seconds from now, callback), at its time, e.g. a countdown. Cancelling
+        the task cancels whichever steps haven't run yet.
+        """
+        steps = sorted(steps, key=lambda step: step[0])
+        callbacks = iter([callback for _, callback in steps])
+        return self.schedule(Steps([delay for delay, _ in steps]), lambda: next(callbacks)())
+
+    def add(self, task: Task) -> Task:
+        """
+        Schedule a Task made by hand, for callers that need the task before it can run (e.g. to check it was
+        cancelled from inside its own callback)
+        """
+        now = time.time()
+        due = task.trigger.first(now)
+        if task.name is not None:
+            last_run = self._get_last_run(task.name)
+            if last_run is not None:
+                resumed = task.trigger.next_after(last_run)
+                due = resumed if resumed is not None and resumed > now else task.trigger.next_after(now)
+        task.due = due
+        if due is not None:
+            self._ensure_started()
+            self._events.put((_ADD, task))
+        return task
+
+    def shutdown(self):
+        """
+        Stop the scheduler thread, dropping every task
+        """
+        self._events.put((_SHUTDOWN, None))
+
+    # --- persistence ---
+
+    def _get_path_to_state(self) -> str:
+        return self.path_to_state if self.path_to_state is not None else get_path_to_schedule()
+
+    def _get_last_run(self, name: str) -> float | None:
+        with self.__lock:
+            if self._last_runs is None:
+                self._last_runs = self._load()
+            return self._last_runs.get(name)
+
+    def _load(self) -> dict[str, float]:
+        try:
+            with open(self._get_path_to_state(), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            _log.warning(f"Could not read the schedule, named tasks start afresh: {e}")
+            return {}
+
+    def _record_run(self, name: str, when: float):
+        with self.__lock:
+            if self._last_runs is None:
+                self._last_runs = self._load()
+            self._last_runs[name] = when
+            path = self._get_path_to_state()
+            tmp_path = path + ".tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(self._last_runs, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                _log.warning(f"Could not write the schedule: {e}")
+
+    # --- scheduler thread ---
+
+    def _ensure_started(self):
+        with self.__lock:
+            if self._thread is None:
+                self._thread = Thread(target=self.run, daemon=True, name="scheduler")
+                self._thread.start()
+
+    def _push(self, task: Task):
+        # the heap runs on time.monotonic(), so a wall clock change doesn't bunch up or stall what is already waiting
+        self._seq += 1
+        heapq.heappush(self._heap, (time.monotonic() + (task.due - time.time()), self._seq, task))
+
+    def _run_due(self):
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, task = heapq.heappop(self._heap)
+            if task.cancelled:
+                continue
+            due = task.due
+            task.runs += 1
+            try:
+                task.callback()
+            except Exception as e:
+                _log.error(f"Error in scheduled task {task}", exc_info=e)
+            if task.name is not None:
+                self._record_run(task.name, due)
+            task.due = task.trigger.next_after(due)
+            if task.due is not None and task.due < time.time() and task.trigger.skips_missed:
+                task.due = task.trigger.next_after(time.time())
+            if task.due is not None and not task.cancelled:
+                self._push(task)
+
+    def run(self):
+        while True:
+            timeout = None
+            if self._heap:
+                timeout = max(self._heap[0][0] - time.monotonic(), 0.0)
+            try:
+                kind, payload = self._events.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload = None, None
+            self.wakeups += 1
+
+            if kind == _ADD:
+                self._push(payload)
+            elif kind == _SHUTDOWN:
+                self._heap.clear()
+                with self.__lock:
+                    self._thread = None
+                return
+            self._run_due()
@@ -4,18 +4,170 @@ Holds the ServerRuntime class, for interacting with the runtime environment
 """
 
 import os
+import queue
 import shutil
 import subprocess
 import logging
 import time
 import datetime
-from threading import Thread, RLock
+from threading import Thread, RLock, Lock
+from concurrent.futures import Future, ThreadPoolExecutor
 from mc import paths
-import zipfile
+from mc import archive
+from mc import save_query
+from mc import events
+from mc import backup_store
+from mc import backup_catalog
+from mc import staging
+from mc import scheduler
+from mc import governor
+from mc import metrics
 
 _print_log = logging.getLogger("out")
 _log = logging.getLogger(__name__)
 
+# commands waiting to be written to the server's stdin, beyond this send_command fails rather than blocking
+COMMAND_QUEUE_SIZE = 256
+
+_STOP_WRITER = object()  # sentinel telling the stdin writer thread to exit
+
+STOP_TIMEOUT = 5  # seconds a server gets to stop when asked before it is killed
+
+BACKUP_INTERVAL = 60 * 60  # seconds between runtime backups, kept across restarts (see mc.scheduler)
+
+
+def get_backup_mode() -> str:
+    """
+    Get the backup mode from MC_BACKUP_MODE, either "zip" (a full archive per backup, the default) or "incremental"
+    (a deduplicated snapshot in the BackupStore)
+    """
+    mode = os.environ.get("MC_BACKUP_MODE", "zip").replace("'", "").replace('"', "").strip().lower()
+    if mode not in ("zip", "incremental"):
+        _log.warning(f"MC_BACKUP_MODE is set to '{mode}', expected 'zip' or 'incremental', using zip")
+        mode = "zip"
+    return mode
+
+
+def world_files_to_copy(world_path: str, files: list[tuple[str, int]] | None) -> list[tuple[str, int | None]]:
+    """
+    Turn a save query file list (relative to the worlds dir) into paths relative to the world, falling back to every
+    file in the world folder if the server never answered.
+
+    :return: list of (path relative to the world folder, length to copy or None for the whole file)
+    """
+    worlds_path = os.path.dirname(world_path)
+
+    if files is None:
+        _log.warning("Server never reported save query results, backing up the whole world folder")
+        to_copy = []
+        for root, dirs, file_names in os.walk(world_path):
+            for file in file_names:
+                to_copy.append((os.path.relpath(os.path.join(root, file), world_path), None))
+        return to_copy
+
+    to_copy = []
+    for rel_path, length in files:
+        src = os.path.normpath(os.path.join(worlds_path, rel_path))
+        rel_to_world = os.path.relpath(src, world_path)
+        if rel_to_world.startswith(".."):
+            _log.warning(f"Save query listed a file outside the world, skipping: {rel_path}")
+            continue
+        to_copy.append((rel_to_world, length))
+    return to_copy
+
+
+def get_staging_dir(path_to_exe: str, level_name: str, timestamp: str) -> str:
+    # staging lives next to current in the active dir, so hardlinks stay on the same filesystem
+    return os.path.join(os.path.dirname(os.path.dirname(path_to_exe)), ".backup_staging", f"{level_name}_{timestamp}")
+
+
+def get_backup_world(level_name: str, active_dir: str | None = None) -> str:
+    """
+    :return: what a world's snapshots and metrics are kept under, "<instance>/<level-name>" for a server in a fleet, so
+        instances that share a level name don't share backups
+    """
+    instance = paths.get_instance_name(active_dir)
+    return level_name if instance is None else f"{instance}/{level_name}"
+
+
+def archive_staged_backup(staging_dir: str, level_name: str, timestamp: str, active_dir: str | None = None):
+    """
+    Phase two of a backup: archive (or snapshot) a staged copy of a world, record it in the catalog, prune old
+    backups, and delete the staged copy.
+
+    :param active_dir: the active directory of the server the world is from, for its version and instance
+    """
+    mode = get_backup_mode()
+    instance = paths.get_instance_name(active_dir)
+    world = get_backup_world(level_name, active_dir)
+    start = time.perf_counter()
+    try:
+        to_copy = []
+        for root, dirs, file_names in os.walk(staging_dir):
+            for file in file_names:
+                to_copy.append((os.path.relpath(os.path.join(root, file), staging_dir), None))
+
+        with backup_catalog.BackupCatalog() as catalog:
+            source_version = paths.get_current_version(active_dir=active_dir)
+            if mode == "incremental":
+                store = backup_store.BackupStore()
+                snapshot_id = store.snapshot(world, staging_dir, to_copy)
+                bytes_in, bytes_out = store.last_bytes_read, store.last_bytes_written
+                catalog.record(
+                    backup_catalog.KIND_SNAPSHOT, snapshot_id, world=level_name, instance=instance, codec="zlib",
+                    size=sum(e["size"] for e in store.load_manifest(snapshot_id)["files"]),
+                    source_version=source_version
+                )
+            else:
+                backup_subdir = os.path.join(paths.get_path_to_backup_dir(), level_name)
+                if instance is not None:
+                    backup_subdir = os.path.join(paths.get_path_to_backup_dir(), "instances", instance, level_name)
+                os.makedirs(backup_subdir, exist_ok=True)
+                backup_file = os.path.join(backup_subdir, f"{timestamp}.zip")
+
+                # one archive handle for the whole walk, so the central directory is only written once
+                codec, level = archive.get_backup_codec()
+                with archive.ArchiveWriter(
+                        backup_file, codec=codec, level=level, workers=archive.get_archive_workers()
+                ) as writer:
+                    writer.add_files([
+                        (os.path.join(staging_dir, rel_path), rel_path, None) for rel_path, _ in to_copy
+                    ])
+                _log.info(f"Backed up {writer.files_written} files ({writer.bytes_in} bytes) to: {backup_file}")
+                bytes_in, bytes_out = writer.bytes_in, writer.bytes_out
+                catalog.record(
+                    backup_catalog.KIND_RUNTIME, backup_file, world=level_name, instance=instance,
+                    size=writer.bytes_out,
+                    codec=f"{codec}-{level}" if level is not None else codec, source_version=source_version,
+                    checksum=backup_catalog.file_checksum(backup_file)
+                )
+
+            catalog.prune(backup_catalog.RetentionPolicy.from_env())
+    except Exception as e:
+        _log.error("Error archiving staged backup", exc_info=e)
+        metrics.backup_failures.inc(world=world, mode=mode)
+        raise
+    else:
+        metrics.backup_seconds.observe(time.perf_counter() - start, world=world, mode=mode)
+        metrics.backup_bytes_in.inc(bytes_in, world=world, mode=mode)
+        metrics.backup_bytes_out.inc(bytes_out, world=world, mode=mode)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def read_level_name(path_to_exe: str) -> str | None:
+    """
+    Read level-name from the server.properties next to the executable
+    """
+    server_properties = os.path.join(os.path.dirname(path_to_exe), "server.properties")
+    if not os.path.isfile(server_properties):
+        raise FileNotFoundError(f"Could not find server.properties: {server_properties}")
+    with open(server_properties, "r") as f:
+        for line in f:
+            if line.startswith("level-name="):
+                return line.split("=")[1].strip()
+    return None
+
 
 class ServerRuntime:
     def __init__(self, path_to_exe: str):
@@ -27,8 +179,24 @@ class ServerRuntime:
         self.process = None
         self._stdout_thread = None
         self._stderr_thread = None
+        self._stdin_thread = None
+        self._command_queue = None
+        self._stdout_listeners = []
+        self.events = events.EventParser()
+        # scheduled backups stage the world (under save hold) at normal priority, only the archive is deprioritised
+        self._hold_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backup-hold")
+        self._backup_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="backup", initializer=governor.maintenance_thread
+        )
+        self._backup_task: scheduler.Task | None = None
+        self.last_backup_hold_seconds = None
+        self.stdout_lines = 0  # only written by the stdout thread, read by mc.metrics
 
+        # __lock only guards the process lifecycle (start/stop), commands go through the queue and backups take
+        # __backup_lock, so neither waits on the other
         self.__lock = RLock()
+        self.__listeners_lock = RLock()
+        self.__backup_lock = Lock()
 
     def __del__(self):
         try:
@@ -40,7 +208,16 @@ class ServerRuntime:
         _print_log.info("Starting stdout packer")
         try:
             for line in self.process.stdout:
+                self.stdout_lines += 1
                 _print_log.info(f"{line}")
+                self.events.feed(line)
+                with self.__listeners_lock:
+                    listeners = list(self._stdout_listeners)
+                for listener in listeners:
+                    try:
+                        listener(line)
+                    except Exception as e:
+                        _log.error(f"Error in stdout listener: {e}")
         except Exception as e:
             _log.error(f"Error reading stdout: {e}, dying...")
 
@@ -49,9 +226,47 @@ class ServerRuntime:
         try:
             for line in self.process.stderr:
                 _print_log.error(f"{line}")
+                self.events.feed(line, is_stderr=True)
         except Exception as e:
             _log.error(f"Error reading stderr: {e}, dying...")
 
+    def __stdin_writer(self, process: subprocess.Popen, command_queue: queue.Queue):
+        while True:
+            message = command_queue.get()
+            if message is _STOP_WRITER:
+                return
+            try:
+                process.stdin.write((message + "\n"))
+                _print_log.info(f">>> {message}")
+                process.stdin.flush()
+            except Exception as e:
+                _log.error(f"Error writing command to server: {e}")
+
+    @staticmethod
+    def __stop_writer(command_queue: queue.Queue, timeout: float) -> bool:
+        try:
+            if timeout:
+                command_queue.put(_STOP_WRITER, timeout=timeout)
+            else:
+                command_queue.put_nowait(_STOP_WRITER)
+            return True
+        except queue.Full:
+            return False
+
+    def add_stdout_listener(self, listener):
+        """
+        Register a callable to be called with every line the server writes to stdout (from the stdout thread)
+        """
+        with self.__listeners_lock:
+            self._stdout_listeners.append(listener)
+
+    def remove_stdout_listener(self, listener):
+        with self.__listeners_lock:
+            try:
+                self._stdout_listeners.remove(listener)
+            except ValueError:
+                pass
+
     def start(self):
         """
 
@@ -64,31 +279,37 @@ class ServerRuntime:
                 raise RuntimeError("Process already running")
 
             self.process = subprocess.Popen(
-                self.path_to_exe,
+                self._popen_args(),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 stdin=subprocess.PIPE,
                 universal_newlines=True
             )
+            governor.pin_server_process(self.process.pid)
+            self._command_queue = queue.Queue(maxsize=COMMAND_QUEUE_SIZE)
             self._stdout_thread = Thread(target=self.__stdout_packer)
             self._stderr_thread = Thread(target=self.__stderr_packer)
-            Thread(target=self._backup_thread, daemon=True).start()
+            self._stdin_thread = Thread(target=self.__stdin_writer, args=(self.process, self._command_queue))
+            # hourly backups, named after the server's directory so the hour carries over a restart of the process
+            self._backup_task = scheduler.get_scheduler().schedule(
+                scheduler.Interval(BACKUP_INTERVAL),
+                lambda: self._hold_executor.submit(self._scheduled_backup),
+                name=f"backup {os.path.dirname(self.path_to_exe)}",
+            )
             self._stdout_thread.start()
             self._stderr_thread.start()
+            self._stdin_thread.start()
+
+    def _popen_args(self):
+        """
+        What to launch, overridden to run a stand-in server in the benchmarks
+        """
+        return self.path_to_exe
 
     def get_current_level_name(self):
-        if self._current_level_name is not None:
-            return self._current_level_name
-        else:
-            root_path = os.path.dirname(self.path_to_exe)
-            server_properties = os.path.join(root_path, "server.properties")
-            if not os.path.isfile(server_properties):
-                raise FileNotFoundError(f"Could not find server.properties: {server_properties}")
-            with open(server_properties, "r") as f:
-                for line in f:
-                    if line.startswith("level-name="):
-                        self._current_level_name = line.split("=")[1].strip()
-                        return self._current_level_name
+        if self._current_level_name is None:
+            self._current_level_name = read_level_name(self.path_to_exe)
+        return self._current_level_name
 
     def started(self, blocking: bool = True) -> bool:
         """
@@ -103,79 +324,185 @@ class ServerRuntime:
             return self.process is not None
 
     def send_command(self, message: str):
+        """
+        Queue a command to be written to the server's stdin. This never waits on backups or other file work, only
+        (briefly) on the queue if the server has stopped reading its input.
+        """
+        command_queue = self._command_queue
+        if not self.started(blocking=False) or command_queue is None:
+            raise RuntimeError("Server not started")
+
+        try:
+            command_queue.put(message, timeout=1)
+        except queue.Full:
+            raise RuntimeError(f"Command queue is full, dropping command: {message}")
+
+    def command_queue_depth(self) -> int:
+        command_queue = self._command_queue
+        return command_queue.qsize() if command_queue is not None else 0
+
+    def query_save_files(self, timeout: float = 60, retry_interval: float = 1) -> list[tuple[str, int]] | None:
+        """
+        Send `save query` until the server reports the held data is ready to copy. Assumes `save hold` has been sent.
+
+        :param timeout: total seconds to keep retrying for
+        :param retry_interval: seconds between queries when the server says the save is not complete
+        :return: list of (path relative to the worlds dir, length to copy), or None if the server never answered
+        """
+        waiter = save_query.SaveQueryWaiter()
+        self.events.subscribe(events.SaveQueryResult, waiter.on_result)
+        self.events.subscribe(events.SaveQueryNotReady, waiter.on_not_ready)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                waiter.reset()
+                self.send_command("save query")
+                if waiter.wait(min(remaining, retry_interval * 5)) and waiter.ready:
+                    return waiter.files
+                time.sleep(min(retry_interval, max(deadline - time.monotonic(), 0)))
+        finally:
+            self.events.unsubscribe(events.SaveQueryResult, waiter.on_result)
+            self.events.unsubscribe(events.SaveQueryNotReady, waiter.on_not_ready)
+
+    def backup(self) -> Future:
+        """
+        Back up the current world in two phases. While the server is in `save hold`, the files it lists are staged
+        with a fast raw copy (or reflink/hardlink), then saves are resumed straight away. The staged copy is then
+        archived in the background, off the hold window.
+
+        :return: a Future that completes when the background archive has been written
+        """
         if not self.started():
             raise RuntimeError("Server not started")
 
-        with self.__lock:
-            self.process.stdin.write((message + "\n"))
-            _print_log.info(f">>> {message}")
-            self.process.stdin.flush()
+        if not self.__backup_lock.acquire(blocking=False):
+            raise RuntimeError("Backup already in progress")
+        try:
+            return self.__backup()
+        finally:
+            self.__backup_lock.release()
 
-    def backup(self):
-        # we aren't going to bother trying to read the output, so we will just do it in a dirtier way
+    def stage_world(self, staging_dir: str) -> dict[str, int]:
+        """
+        Put a consistent copy of the current world in staging_dir, holding saves only for as long as the copy takes
+        (used for the pre-update backup, which archives it itself)
+
+        :return: count of files per method used, see staging.stage_files
+        """
         if not self.started():
             raise RuntimeError("Server not started")
 
-        self.send_command("say Backing up server...")
-        time.sleep(0.5)
+        if not self.__backup_lock.acquire(blocking=False):
+            raise RuntimeError("Backup already in progress")
+        try:
+            return self.__stage_world(staging_dir)
+        finally:
+            self.__backup_lock.release()
+
+    def __stage_world(self, staging_dir: str) -> dict[str, int]:
+        level_name = self.get_current_level_name()
+        world_path = os.path.join(os.path.dirname(self.path_to_exe), "worlds", level_name)
 
+        # stage a raw copy of exactly what the server listed, truncated to the lengths it reported
         self.send_command("save hold")
-        time.sleep(10)
-        self.send_command("save query")
-        time.sleep(1)
-        # okay, now let's just copy whatever files we can
+        hold_start = time.monotonic()
+        try:
+            to_copy = world_files_to_copy(world_path, self.query_save_files())
+            with governor.unthrottled():  # the server is holding its saves until this is done
+                counts = staging.stage_files(world_path, staging_dir, to_copy)
+        finally:  # never leave the server holding saves
+            if self.started(blocking=False):
+                self.send_command("save resume")
+            self.last_backup_hold_seconds = time.monotonic() - hold_start
+            metrics.save_hold_seconds.observe(
+                self.last_backup_hold_seconds,
+                world=get_backup_world(level_name, os.path.dirname(os.path.dirname(self.path_to_exe)))
+            )
+        _log.info(f"Save hold released after {self.last_backup_hold_seconds:.3f}s, staged {counts}")
+        return counts
+
+    def __backup(self) -> Future:
+        self.send_command("say Backing up server...")
 
         backup_dir = paths.get_path_to_backup_dir()
         if not os.path.exists(backup_dir):
             os.mkdir(backup_dir)
 
-        backup_subdir = os.path.join(backup_dir, self.get_current_level_name())
-        backup_file_current_time = os.path.join(
-            backup_subdir,
-            datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S.zip")
-        )
+        level_name = self.get_current_level_name()
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
-        root_path = os.path.dirname(self.path_to_exe)
-        world_path = os.path.join(root_path, "worlds", self.get_current_level_name())
+        staging_dir = get_staging_dir(self.path_to_exe, level_name, timestamp)
 
-        # for each file flatly and subdir, try to compress and add to zip
-        with self.__lock:
-            for root, dirs, files in os.walk(world_path):
-                for file in files:
-                    try:
-                        src = os.path.join(root, file)
-                        dst = os.path.relpath(src, world_path)
-                        with zipfile.ZipFile(
-                                backup_file_current_time, 'a', zipfile.ZIP_DEFLATED, compresslevel=9
-                        ) as zip_ref:
-                            zip_ref.write(src, dst)
-                    except Exception as e:
-                        _log.debug(f"Error copying file in backup: {e}")
+        # phase one, stage a raw copy of the world under `save hold`
+        self.__stage_world(staging_dir)
+
+        # phase two, archive the staged copy in the background
+        return self._backup_executor.submit(self._archive_staged, staging_dir, level_name, timestamp)
 
-        self.send_command("save resume")
-        self.send_command("say Backup complete!")
+    def _archive_staged(self, staging_dir: str, level_name: str, timestamp: str):
+        active_dir = os.path.dirname(os.path.dirname(self.path_to_exe))
+        archive_staged_backup(staging_dir, level_name, timestamp, active_dir=active_dir)
 
-    def _backup_thread(self):
-        while True:  # daemon thread
+        if self.started(blocking=False):
             try:
-                time.sleep(60 * 60)
-                self.backup()
-            except Exception as e:
-                _log.error(f"!!! Error in backup thread: {e}")
-                break
+                self.send_command("say Backup complete!")
+            except Exception:  # noqa  # server may have stopped in the meantime
+                pass
+
+    def _scheduled_backup(self):
+        # on the hold executor, so the save hold copy isn't niced or kept to the maintenance cores, the archive goes to
+        # the backup executor
+        try:
+            self.backup()
+        except Exception as e:
+            _log.error(f"!!! Error in scheduled backup: {e}")
 
     def stop(self):
         if not self.started():
             return
 
         with self.__lock:
-            self.send_command("stop")
             pro: subprocess.Popen = self.process
+            command_queue = self._command_queue
+            if self._backup_task is not None:
+                self._backup_task.cancel()
+                self._backup_task = None
+            if pro.poll() is None:  # no point telling a crashed server to stop
+                try:
+                    command_queue.put_nowait("stop")
+                except queue.Full:
+                    _log.warning("Command queue is full, could not send stop, the server will be killed")
             self.process = None
-            time.sleep(5)  # give it a chance to stop gracefully
+            self._command_queue = None
+
+        # let the writer drain anything queued before the stop, then give the server a chance to stop gracefully.
+        # Nothing here waits without a timeout: a server that stopped reading its input leaves the writer stuck in
+        # write(), and only killing it gets the writer out
+        deadline = time.monotonic() + STOP_TIMEOUT
+        writer_told = self.__stop_writer(command_queue, timeout=0)
+        self._stdin_thread.join(timeout=STOP_TIMEOUT)
+
+        try:
+            pro.wait(timeout=max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            _log.warning(f"Server did not stop within {STOP_TIMEOUT} seconds, killing")
             pro.kill()
             pro.wait()
-            pro.terminate()
+
+        if self._stdin_thread.is_alive() or not writer_told:
+            # the writer's writes fail fast now the process is gone, so the queue drains
+            self.__stop_writer(command_queue, timeout=STOP_TIMEOUT)
+            self._stdin_thread.join(timeout=STOP_TIMEOUT)
+            if self._stdin_thread.is_alive():
+                _log.error("Stdin writer thread did not exit")
+        try:
+            pro.stdin.close()
+        except Exception:  # noqa  # broken pipe from a dead server, nothing to do about it
+            pass
+
         try:
             self._stdout_thread.join()
         except Exception as e:
@@ -188,3 +515,4 @@ class ServerRuntime:
 
         self._stdout_thread = None
         self._stderr_thread = None
+        self._stdin_thread = None
@@ -0,0 +1,153 @@
+"""
+Fast raw copies of files: world files into a staging directory, used to get out of `save hold` as quickly as possible,
+and server version trees into the active directory during an update
+
+Where the filesystem allows it, files are reflinked (copy-on-write clones, e.g. btrfs/xfs) or hardlinked instead of
+copied. Hardlinks are only used for files that are never modified in place (LevelDB .ldb tables are written once and
+then only ever deleted, server binaries are only ever replaced), as a hardlink to a file that is later appended to
+would change the other copy too.
+
+"""
+
+import os
+import errno
+import shutil
+import logging
+from mc import governor
+
+_log = logging.getLogger(__name__)
+
+# files that are written once and never modified in place, and so are safe to hardlink
+IMMUTABLE_EXTENSIONS = (".ldb",)
+
+_COPY_BUFFER_SIZE = 1024 ** 2
+_FICLONE = 0x40049409  # linux ioctl, from linux/fs.h
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+
+def _try_reflink(src: str, dst: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+            fcntl.ioctl(f_out.fileno(), _FICLONE, f_in.fileno())
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+            _log.debug(f"Unexpected error reflinking {src}: {e}")
+        try:
+            os.remove(dst)
+        except OSError:  # noqa  # doesn't matter, quick cleanup
+            pass
+        return False
+
+
+def _try_hardlink(src: str, dst: str) -> bool:
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:  # cross device, unsupported filesystem, etc.
+        return False
+
+
+def copy_prefix(src: str, dst: str, length: int | None = None) -> int:
+    """
+    Copy the first `length` bytes (or all) of src to dst
+
+    :return: bytes copied
+    """
+    copied = 0
+    with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+        while length is None or copied < length:
+            chunk = f_in.read(_COPY_BUFFER_SIZE if length is None else min(_COPY_BUFFER_SIZE, length - copied))
+            if not chunk:
+                break
+            governor.throttle(len(chunk))
+            f_out.write(chunk)
+            governor.written(f_out, len(chunk))
+            copied += len(chunk)
+    shutil.copystat(src, dst)
+    return copied
+
+
+def clone_file(src: str, dst: str, length: int | None = None, immutable: bool | None = None) -> str:
+    """
+    Put a copy of src (truncated to length, if given) at dst, as cheaply as the filesystem allows
+
+    :param immutable: whether src is safe to hardlink, by default decided by IMMUTABLE_EXTENSIONS
+    :return: how it was done, one of "reflink", "hardlink" or "copy"
+    """
+    if immutable is None:
+        immutable = src.endswith(IMMUTABLE_EXTENSIONS)
+    if length is None or length >= os.path.getsize(src):
+        if _try_reflink(src, dst):
+            shutil.copystat(src, dst)
+            return "reflink"
+        if immutable and _try_hardlink(src, dst):
+            return "hardlink"
+    copy_prefix(src, dst, length)
+    return "copy"
+
+
+def stage_files(src_root: str, dst_root: str, files: list[tuple[str, int | None]]) -> dict[str, int]:
+    """
+    Clone each file (relative to src_root, with optional truncation length) into the same relative path in dst_root.
+    Files that can't be read are skipped and logged.
+
+    :return: count of files per method used ("reflink", "hardlink", "copy", "error")
+    """
+    counts = {"reflink": 0, "hardlink": 0, "copy": 0, "error": 0}
+    for rel_path, length in files:
+        src = os.path.join(src_root, rel_path)
+        dst = os.path.join(dst_root, rel_path)
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            counts[clone_file(src, dst, length)] += 1
+        except Exception as e:
+            _log.error(f"Error staging file {rel_path}: {e}")
+            counts["error"] += 1
+    return counts
+
+
+def clone_tree(src_root: str, dst_root: str, is_immutable=None) -> dict[str, int]:
+    """
+    Clone a whole directory tree into dst_root (which must not exist), like shutil.copytree but reflinking or
+    hardlinking where possible
+
+    :param is_immutable: called with each file's path relative to src_root, True if it is safe to hardlink
+    :return: count of files per method used ("reflink", "hardlink", "copy")
+    """
+    counts = {"reflink": 0, "hardlink": 0, "copy": 0}
+    os.makedirs(dst_root)
+    for dir_path, dirs, files in os.walk(src_root):
+        rel_dir = os.path.relpath(dir_path, src_root)
+        dst_dir = dst_root if rel_dir == "." else os.path.join(dst_root, rel_dir)
+        for dir_ in dirs:
+            os.mkdir(os.path.join(dst_dir, dir_))
+        for file in files:
+            rel_path = file if rel_dir == "." else os.path.join(rel_dir, file)
+            immutable = is_immutable(rel_path) if is_immutable is not None else None
+            counts[clone_file(os.path.join(dir_path, file), os.path.join(dst_dir, file), immutable=immutable)] += 1
+    return counts
+
+
+def move_tree(src: str, dst: str) -> str:
+    """
+    Move a directory with a single rename, falling back to copying (then deleting src) across filesystems
+
+    :return: "rename" or "copy"
+    """
+    try:
+        os.rename(src, dst)
+        return "rename"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    _log.info(f"{src} and {dst} are on different filesystems, copying instead of renaming")
+    shutil.copytree(src, dst)
+    shutil.rmtree(src)
+    return "copy"
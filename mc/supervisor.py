@@ -0,0 +1,581 @@
+"""
+Holds the Supervisor, which keeps the server running and updates it, blocking on events rather than polling
+
+Everything the supervisor reacts to arrives on one queue, and its thread sleeps in a single blocking get until
+something does:
+
+    exited        a waiter thread per server process blocks in Popen.wait() and posts the moment it exits
+    update ready  posted by the update discovery thread (notify_update_ready) once a new version is downloaded
+    timers        call_later() callbacks, countdowns, health checks and timed restarts, all tasks on the shared
+                  mc.scheduler thread, which posts each callback here when it is due
+
+So a crash is seen within milliseconds, and with nothing due the thread uses no CPU at all.
+
+Updates are staged: as soon as the countdown starts, the new version is cloned and given the current config on a
+background thread, while players carry on. At the end of the countdown the world is staged for the pre-update backup
+under `save hold`, only the world handover and directory swap are left for the stop window, and the backup is archived
+once the new version is up. The time from telling the old server to stop until the new one reports it has started is
+recorded for every update (update.record_update_downtime).
+
+With health_check_interval set, the server is also sent `list` that often, and restarted if it stops answering. With
+restart_cron set (MC_RESTART_CRON, e.g. "0 4 * * *" for 4am) the server is warned, backed up and restarted whenever it
+matches.
+
+"""
+
+import os
+import time
+import queue
+import logging
+from threading import Event, Thread
+from concurrent.futures import Future
+from mc import events
+from mc import governor
+from mc import metrics
+from mc import paths
+from mc import restore
+from mc import scheduler
+from mc import update
+from mc import server_runtime
+
+_log = logging.getLogger(__name__)
+
+# seconds after the update is announced, and what to tell players
+UPDATE_COUNTDOWN = [
+    (0, "say Server will be restarting in 15 minutes for an update!"),
+    (600, "say Server will be restarting in 5 minutes for an update!!"),
+    (840, "say Server will be restarting in 1 minute for an update!!!"),
+    (900, "say Server is restarting for an update!!!!"),
+]
+UPDATE_RETRY_DELAY = 5.0
+UPDATE_PREPARE_WAIT = 1.0  # how often to check back at the end of the countdown if the update isn't prepared yet
+RESTART_DELAY = 0.0  # after a crash, doubled for each crash that comes soon after a start
+RESTART_DELAY_MAX = 60.0
+CRASH_LOOP_WINDOW = 60.0  # a crash within this many seconds of starting counts towards the backoff
+HEALTH_CHECK_TIMEOUT = 10.0  # seconds to wait for an answer to `list`
+HEALTH_CHECK_FAILURES = 3  # unanswered health checks in a row before the server is restarted
+# seconds after a timed restart is announced, and what to tell players
+RESTART_COUNTDOWN = [
+    (0, "say Server will be restarting in 5 minutes!"),
+    (240, "say Server will be restarting in 1 minute!!"),
+    (300, "say Server is restarting!!!"),
+]
+
+_EXITED = "exited"
+_UPDATE_READY = "update ready"
+_CALL = "call"
+_SHUTDOWN = "shutdown"
+
+
+def get_restart_cron() -> str | None:
+    """
+    :return: MC_RESTART_CRON, when to restart the server (a cron expression, see scheduler.Cron), None for never
+    """
+    value = os.environ.get("MC_RESTART_CRON")
+    if value is None:
+        return None
+    value = value.replace("'", "").replace('"', "").strip()
+    return value or None
+
+
+class Supervisor:
+    """
+    Start with run() on its own thread (or the main thread), talk to it from anywhere with notify_update_ready(),
+    call_later(), call_soon() and shutdown(). `runtime` is the ServerRuntime currently running, for sending commands.
+    Timers are tasks on the shared scheduler (mc.scheduler), whose callbacks are posted back to the supervisor thread.
+
+    """
+
+    def __init__(self, runtime_factory=None, path_to_exe: str | None = None, restart_delay: float = RESTART_DELAY,
+                 active_dir: str | None = None, name: str | None = None, health_check_interval: float | None = None,
+                 on_start=None, restart_cron: str | None = None, restart_offset: float = 0.0,
+                 task_scheduler: "scheduler.Scheduler | None" = None):
+        """
+        :param runtime_factory: called with the exe path to make each ServerRuntime, defaults to ServerRuntime
+        :param path_to_exe: defaults to paths.get_path_to_minecraft_server_exe(), looked up on every (re)start
+        :param active_dir: the server's active directory, defaults to paths.get_path_to_active_dir()
+        :param name: the server's name in logs and the update history, when there are several (see mc.fleet)
+        :param health_check_interval: seconds between `list` health checks, None for none
+        :param on_start: called with the exe path before each (re)start, e.g. to set the port in server.properties
+        :param restart_cron: when to back up and restart the server, a cron expression, None for never
+        :param restart_offset: seconds after restart_cron matches to start the restart countdown, to stagger several
+            servers
+        :param task_scheduler: defaults to the shared scheduler.get_scheduler()
+        """
+        self.runtime_factory = runtime_factory if runtime_factory is not None else server_runtime.ServerRuntime
+        self.path_to_exe = path_to_exe
+        self.restart_delay = restart_delay
+        self.active_dir = active_dir
+        self.name = name
+        self.health_check_interval = health_check_interval
+        self.on_start = on_start
+        self.restart_cron = scheduler.Cron(restart_cron) if restart_cron is not None else None
+        self.restart_offset = restart_offset
+        self.scheduler = task_scheduler if task_scheduler is not None else scheduler.get_scheduler()
+        self.runtime: server_runtime.ServerRuntime | None = None
+        self._log = _log if name is None else logging.getLogger(f"{__name__}.{name}")
+
+        self.crashes = 0
+        self.last_exit_detected: float | None = None  # time.perf_counter() when the last unexpected exit was seen
+        self.wakeups = 0  # times the loop woke up, for checking it really idles
+        self.last_update_downtime: float | None = None  # stop-to-start seconds of the last update
+        self.health_failures = 0  # health checks in a row that went unanswered
+        self.last_health_check_seconds: float | None = None  # how long the last answered one took
+        self.started = Event()  # set once the first server has said it started, for staggering starts (mc.fleet)
+
+        self._events = queue.SimpleQueue()
+        self._tasks: list[scheduler.Task] = []  # recurring tasks and countdowns, cancelled on shutdown
+        self._started_at = 0.0
+        self._consecutive_crashes = 0
+        self._updating = False  # from the update countdown starting until the new version is running
+        self._update_in_progress = False  # from stopping the server for the update until the new version starts
+        self._preparing = False  # prepare_update is running on its thread
+        self._prepared: update.PreparedUpdate | None = None
+        self._prepare_failed = False
+        self._update_stopped_at: float | None = None  # time.perf_counter() when the server was stopped to update
+        self._update_from: str | None = None
+        self._update_backup_thread: Thread | None = None  # archiving the last update's pre-update backup
+        self._restoring = False  # from a restore being requested until the server is back up
+        self._restore_in_progress = False  # from stopping the server for a restore until it is started again
+        self._ready_runtime: server_runtime.ServerRuntime | None = None  # the runtime, once it has said it started
+        self._health_check_id = 0
+        self._health_answered = 0
+        self._timed_restart = False  # from a timed restart's countdown starting until the server is restarted
+        metrics.watch_supervisor(self)
+
+    @property
+    def uptime(self) -> float:
+        """
+        :return: seconds since the current server was started, 0 if it isn't running
+        """
+        return time.monotonic() - self._started_at if self.runtime is not None else 0.0
+
+    def _count_restart(self, reason: str):
+        metrics.server_restarts.inc(server=metrics.server_label(self.name), reason=reason)
+
+    # --- called from any thread ---
+
+    def notify_update_ready(self):
+        """
+        A newer version has been downloaded, start the update countdown (ignored if one is already running)
+        """
+        self._events.put((_UPDATE_READY, None))
+
+    def call_later(self, delay: float, callback) -> scheduler.Task:
+        """
+        Run callback() on the supervisor thread after delay seconds, cancel() on what is returned stops it if it hasn't
+        run yet
+        """
+        task = scheduler.Task(scheduler.Steps([delay]), None)
+        task.callback = lambda: self._events.put((_CALL, lambda: None if task.cancelled else callback()))
+        return self.scheduler.add(task)
+
+    def call_soon(self, callback):
+        """
+        Run callback() on the supervisor thread as soon as it is free
+        """
+        self._events.put((_CALL, callback))
+
+    def restore_world(self, backup_id: int, files: list[str] | None = None) -> Future:
+        """
+        Restore the current world (or some of its files) from a backup in the catalog: it is unpacked while the
+        server runs, which is then stopped only for the swap, see mc.restore
+
+        :return: a Future that completes with the seconds from the stop until the server was started again
+        """
+        future = Future()
+        self.call_soon(lambda: self._start_restore(backup_id, files, future))
+        return future
+
+    def shutdown(self):
+        """
+        Stop the server and return from run()
+        """
+        self._events.put((_SHUTDOWN, None))
+
+    # --- supervisor thread ---
+
+    def _get_path_to_exe(self) -> str:
+        if self.path_to_exe is not None:
+            return self.path_to_exe
+        return paths.get_path_to_minecraft_server_exe(active_dir=self.active_dir)
+
+    def _start_runtime(self):
+        path_to_exe = self._get_path_to_exe()
+        if self.on_start is not None:
+            self.on_start(path_to_exe)
+        runtime = self.runtime_factory(path_to_exe)
+        if self._update_stopped_at is not None:
+            self._watch_update_downtime(runtime)
+
+        def on_started(event):
+            runtime.events.unsubscribe(events.ServerStarted, on_started)
+            self.call_soon(lambda: self._on_started(runtime))
+
+        runtime.events.subscribe(events.ServerStarted, on_started)
+        runtime.start()
+        self.runtime = runtime
+        self._started_at = time.monotonic()
+
+        process = runtime.process
+
+        def wait_for_exit():
+            process.wait()
+            self._events.put((_EXITED, runtime))
+
+        Thread(target=wait_for_exit, daemon=True, name="server-exit-waiter").start()
+
+    def _on_started(self, runtime: server_runtime.ServerRuntime):
+        if runtime is self.runtime:
+            self._ready_runtime = runtime
+            self.health_failures = 0
+            self.started.set()
+
+    def _stop_runtime(self):
+        runtime, self.runtime = self.runtime, None  # cleared first, so its exit isn't taken for a crash
+        if runtime is not None:
+            runtime.stop()
+
+    def _on_exited(self, runtime: server_runtime.ServerRuntime):
+        if runtime is not self.runtime:
+            return  # one we stopped ourselves
+        self.last_exit_detected = time.perf_counter()
+        self.crashes += 1
+        self._count_restart("crash")
+        self.runtime = None
+        try:
+            runtime.stop()  # joins its reader/writer threads
+        except Exception:  # noqa  # it is already dead, this is only cleanup
+            pass
+
+        if time.monotonic() - self._started_at < CRASH_LOOP_WINDOW:
+            self._consecutive_crashes += 1
+        else:
+            self._consecutive_crashes = 1
+        delay = self.restart_delay
+        if self._consecutive_crashes > 1:
+            delay = min(max(self.restart_delay, 1.0) * 2 ** (self._consecutive_crashes - 2), RESTART_DELAY_MAX)
+        self._log.critical(f"Server process has died unceremoniously, restarting in {delay:.1f} seconds...")
+        self.call_later(delay, self._restart)
+
+    def _restart(self):
+        if self.runtime is not None or self._update_in_progress or self._restore_in_progress:
+            return  # already back up, or the update will start the new version
+        try:
+            self._start_runtime()
+        except Exception as e:
+            self._log.critical(
+                f"Could not restart the server, trying again in {UPDATE_RETRY_DELAY} seconds", exc_info=e
+            )
+            self.call_later(UPDATE_RETRY_DELAY, self._restart)
+
+    def _on_update_ready(self):
+        if self._updating or self._restoring or self._timed_restart or not update.need_update(self.active_dir):
+            return
+        self._updating = True
+        self._log.info("New version ready, starting the update countdown")
+        self._countdown(UPDATE_COUNTDOWN, self._do_update)
+        self._start_prepare()
+
+    def _start_prepare(self):
+        self._preparing = True
+        self._prepared = None
+        self._prepare_failed = False
+
+        def prepare():
+            governor.maintenance_thread()
+            try:
+                prepared = update.prepare_update(self.active_dir)
+            except Exception as e:
+                self._log.error(
+                    "Could not prepare the update in the background, it will be done after the stop", exc_info=e
+                )
+                self.call_soon(lambda: self._on_prepared(None, failed=True))
+            else:
+                self.call_soon(lambda: self._on_prepared(prepared))
+
+        Thread(target=prepare, daemon=True, name="update-prepare").start()
+
+    def _on_prepared(self, prepared: "update.PreparedUpdate | None", failed: bool = False):
+        self._preparing = False
+        self._prepared = prepared
+        self._prepare_failed = failed
+        if prepared is not None:
+            self._log.info(f"Update ready to hand over: {prepared}")
+
+    def _countdown(self, countdown: list[tuple[float, str]], then):
+        """
+        Tell players each message of countdown at its time, then call then() half a second after the last
+        """
+        steps = [(delay, self._on_thread(lambda m=message: self._say(m))) for delay, message in countdown]
+        steps.append((countdown[-1][0] + 0.5, self._on_thread(then)))
+        self._tasks = [task for task in self._tasks if task.due is not None]  # drop finished countdowns
+        self._tasks.append(self.scheduler.sequence(steps))
+
+    def _on_thread(self, callback):
+        """
+        :return: a function that runs callback on the supervisor thread, for scheduler tasks
+        """
+        return lambda: self._events.put((_CALL, callback))
+
+    def _on_restart_due(self):
+        if self.runtime is None or self._updating or self._restoring or self._timed_restart:
+            return  # it is being restarted anyway
+        self._timed_restart = True
+        self._log.info("Timed restart due, starting the restart countdown")
+        self._countdown(RESTART_COUNTDOWN, self._do_timed_restart)
+
+    def _do_timed_restart(self):
+        # back up just in case, backup() returns once the world is staged, it is archived while the server restarts
+        try:
+            self.runtime.backup()
+        except Exception as e:
+            self._log.error(f"Could not back up before the timed restart, restarting anyway: {e}")
+        self._log.info("Restarting the server (timed restart)")
+        self._count_restart("timed")
+        self._stop_runtime()
+        self._timed_restart = False
+        self._restart()
+        if update.need_update(self.active_dir):  # any update that came in meanwhile was held back
+            self._on_update_ready()
+
+    def _say(self, message: str):
+        if self.runtime is not None:
+            try:
+                self.runtime.send_command(message)
+            except Exception as e:
+                self._log.error(f"Error sending countdown message: {e}")
+
+    def _do_update(self):
+        if self._preparing:
+            self._log.info("Countdown over but the update is still being prepared, waiting for it...")
+            self.call_later(UPDATE_PREPARE_WAIT, self._do_update)
+            return
+        if self._update_backup_thread is not None and self._update_backup_thread.is_alive():
+            # a retry, the failed attempt's backup is still being archived from the staging directory it would reuse
+            self._log.info("Waiting for the failed update's backup to be written before trying again...")
+            self.call_later(UPDATE_PREPARE_WAIT, self._do_update)
+            return
+
+        prepared, self._prepared = self._prepared, None
+        self._update_in_progress = True
+        backup_staging_dir = None
+        if prepared is not None and prepared.our_version:
+            # staged while the server can still hold saves, archived once the new version is running
+            try:
+                with governor.unthrottled():  # under save hold
+                    backup_staging_dir = update.stage_update_backup(
+                        prepared.our_version, prepared.new_version, prepared.path_to_current, runtime=self.runtime
+                    )
+            except Exception as e:
+                self._log.critical("Could not stage the pre-update backup, updating after the stop instead", exc_info=e)
+                prepared = None
+
+        if self._update_stopped_at is None:  # the first stop of this update, a retry's server is already down
+            self._update_from = (
+                prepared.our_version if prepared is not None else paths.get_current_version(active_dir=self.active_dir)
+            )
+            self._update_stopped_at = time.perf_counter()
+            self._count_restart("update")
+        self._stop_runtime()
+        try:
+            with governor.unthrottled():  # the server is down until this is done
+                if prepared is not None:
+                    success = update.finish_update(prepared)
+                else:  # preparing failed, or found nothing to update to at the time, do the whole update now
+                    success = update.try_update(self.active_dir)
+        except Exception as e:
+            self._log.critical("Update failed", exc_info=e)
+            success = False
+        if backup_staging_dir is not None:
+            # archived whether or not the update went through, by now the worlds may have been moved and the retry
+            # can't stage them again, and it is only deleted once it has been recorded
+            self._update_backup_thread = update.write_update_backup_in_background(
+                prepared.our_version, prepared.new_version, backup_staging_dir, self.active_dir
+            )
+        if not success and update.need_update(self.active_dir):
+            self._log.critical(f"Update failed, trying again in {UPDATE_RETRY_DELAY} seconds...")
+            self.call_later(UPDATE_RETRY_DELAY, self._do_update)
+            return
+        if not success:
+            self._update_stopped_at = None  # nothing was updated, not an update's downtime
+
+        self._update_in_progress = False
+        self._updating = False
+        self._restart()
+
+    def _start_restore(self, backup_id: int, files: list[str] | None, future: Future):
+        if self._restoring or self._updating or self._timed_restart:
+            future.set_exception(RuntimeError("A restore, update or timed restart is already in progress"))
+            return
+        try:
+            backup = restore.get_restore_point(backup_id)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        path_to_exe = self._get_path_to_exe()
+        instance = paths.get_instance_name(os.path.dirname(os.path.dirname(path_to_exe)))
+        if backup["instance"] != instance:
+            # each server's backups are its own, even when the worlds share a level name
+            future.set_exception(ValueError(
+                f"Backup {backup_id} is of {backup['instance'] or 'the default server'}, "
+                f"not {instance or 'the default server'}"
+            ))
+            return
+        self._restoring = True
+        if self.runtime is not None:
+            level_name = self.runtime.get_current_level_name()
+        else:
+            level_name = server_runtime.read_level_name(path_to_exe)
+        world_path = restore.get_path_to_world(level_name, os.path.dirname(path_to_exe))
+        self._log.info(f"Restoring {world_path} from backup {backup_id} ({files or 'whole world'})")
+
+        def prepare():
+            governor.maintenance_thread()
+            try:
+                staged = restore.prepare_restore(backup, world_path, files=files)
+            except Exception as e:
+                self._log.error(f"Could not unpack backup {backup_id}", exc_info=e)
+                self.call_soon(lambda: self._end_restore(future, error=e))
+            else:
+                self.call_soon(lambda: self._finish_restore(staged, world_path, files is not None, future))
+
+        Thread(target=prepare, daemon=True, name="restore-prepare").start()
+
+    def _finish_restore(self, staged: str, world_path: str, partial: bool, future: Future):
+        self._say("say Server is restarting to restore a backup!")
+        self._restore_in_progress = True
+        stopped_at = time.perf_counter()
+        self._count_restart("restore")
+        self._stop_runtime()
+        try:
+            with governor.unthrottled():
+                restore.swap_in(staged, world_path, partial=partial)
+        except Exception as e:
+            self._log.critical(
+                "Could not swap the restored world in, starting the server on the world it had", exc_info=e
+            )
+            self._end_restore(future, error=e)
+            return
+        self._end_restore(future, downtime=time.perf_counter() - stopped_at)
+
+    def _end_restore(self, future: Future, downtime: float | None = None, error: Exception | None = None):
+        self._restore_in_progress = False
+        self._restoring = False
+        self._restart()
+        if update.need_update(self.active_dir):  # any update that came in meanwhile was held back
+            self._on_update_ready()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            self._log.info(f"Restore done, the server was down for {downtime:.2f} seconds")
+            future.set_result(downtime)
+
+    def _watch_update_downtime(self, runtime: server_runtime.ServerRuntime):
+        stopped_at = self._update_stopped_at
+        from_version = self._update_from
+        self._update_stopped_at = None
+
+        def on_started(event):
+            seconds = time.perf_counter() - stopped_at
+            runtime.events.unsubscribe(events.ServerStarted, on_started)
+            self.call_soon(lambda: self._record_update_downtime(from_version, seconds))
+
+        runtime.events.subscribe(events.ServerStarted, on_started)
+
+    def _record_update_downtime(self, from_version: str | None, seconds: float):
+        self.last_update_downtime = seconds
+        metrics.update_downtime_seconds.observe(seconds, server=metrics.server_label(self.name))
+        metrics.update_last_downtime_seconds.set(seconds, server=metrics.server_label(self.name))
+        update.record_update_downtime(
+            from_version, paths.get_current_version(active_dir=self.active_dir), seconds, instance=self.name
+        )
+
+    def _health_check(self):
+        runtime = self.runtime
+        if runtime is None or runtime is not self._ready_runtime:
+            return  # not up (yet), nothing to check
+        if self._update_in_progress or self._restore_in_progress:
+            return
+
+        self._health_check_id += 1
+        check_id = self._health_check_id
+        sent = time.perf_counter()
+
+        def on_list(event):
+            runtime.events.unsubscribe(events.PlayerList, on_list)
+            seconds = time.perf_counter() - sent
+            self.call_soon(lambda: self._on_health_answer(check_id, seconds))
+
+        runtime.events.subscribe(events.PlayerList, on_list)
+        try:
+            runtime.send_command("list")
+        except Exception as e:
+            self._log.warning(f"Could not send health check: {e}")
+        self.call_later(HEALTH_CHECK_TIMEOUT, lambda: self._on_health_timeout(runtime, check_id, on_list))
+
+    def _on_health_answer(self, check_id: int, seconds: float):
+        self._health_answered = max(self._health_answered, check_id)
+        self.health_failures = 0
+        self.last_health_check_seconds = seconds
+
+    def _on_health_timeout(self, runtime: server_runtime.ServerRuntime, check_id: int, on_list):
+        if self._health_answered >= check_id or runtime is not self.runtime:
+            return
+        runtime.events.unsubscribe(events.PlayerList, on_list)
+        self.health_failures += 1
+        self._log.warning(f"Server did not answer a health check within {HEALTH_CHECK_TIMEOUT} seconds "
+                          f"({self.health_failures}/{HEALTH_CHECK_FAILURES})")
+        if self.health_failures >= HEALTH_CHECK_FAILURES:
+            self._log.critical("Server has stopped answering, restarting it")
+            self.health_failures = 0
+            self._count_restart("unresponsive")
+            self._stop_runtime()
+            self._restart()
+
+    def _call(self, callback):
+        try:
+            callback()
+        except Exception as e:
+            self._log.error("Error in supervisor callback", exc_info=e)
+
+    def run(self):
+        """
+        Start the server and supervise it until shutdown()
+        """
+        try:
+            self._start_runtime()
+        except Exception as e:
+            # not fatal to this thread, otherwise nothing would ever start it and the console would wait on it forever
+            self._log.critical(
+                f"Could not start the server, trying again in {UPDATE_RETRY_DELAY} seconds", exc_info=e
+            )
+            self.call_later(UPDATE_RETRY_DELAY, self._restart)
+        if update.need_update(self.active_dir):
+            self._on_update_ready()
+        if self.health_check_interval is not None:
+            self._tasks.append(self.scheduler.schedule(
+                scheduler.Interval(self.health_check_interval), self._on_thread(self._health_check)
+            ))
+        if self.restart_cron is not None:
+            self._tasks.append(self.scheduler.schedule(
+                self.restart_cron, lambda: self.call_later(self.restart_offset, self._on_restart_due)
+            ))
+
+        try:
+            while True:
+                kind, payload = self._events.get()
+                self.wakeups += 1
+
+                if kind == _EXITED:
+                    self._on_exited(payload)
+                elif kind == _UPDATE_READY:
+                    self._on_update_ready()
+                elif kind == _CALL:
+                    self._call(payload)
+                elif kind == _SHUTDOWN:
+                    return
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            self._stop_runtime()
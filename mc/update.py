@@ -1,40 +1,36 @@
+import json
 import random
 
+from mc import archive
+from mc import backup_catalog
+from mc import discovery
 from mc import downloads
+from mc import governor
 from mc import paths
+from mc import staging
+from mc import versions
 import os
 import shutil
 import logging
 import time
 import zipfile
+from threading import Thread
 
 _log = logging.getLogger(__name__)
 
 
 def _get_most_recent_downloaded_version():
+    # newest by version number, from the cached catalog (old versions are pruned after each download, not here)
+    return versions.get_catalog().latest()
 
-    # grab all of the folder names in the versions directory
-    versions_dir = paths.get_path_to_versions_dir()
-    versions = os.listdir(versions_dir)
-    versions = [v for v in versions if os.path.isdir(os.path.join(versions_dir, v))]
-    if not versions:
-        return None
-
-    versions.sort(reverse=True)
-
-    if len(versions) > 5:
-        # if we have more than 5 versions, delete the oldest
-        for version in versions[5:]:
-            shutil.rmtree(os.path.join(versions_dir, version))
-
-    return versions[0]
 
-
-def need_update() -> bool:
+def need_update(active_dir: str | None = None) -> bool:
     # if we don't have a version, we need an update
     # if we have a version and it is not our most recent downloaded version, we need an update
-    our_version = paths.get_current_version()
-    most_recent_downloaded_version = _get_most_recent_downloaded_version()
+    # called every second, and answered from the catalog's cache without touching the filesystem
+    catalog = versions.get_catalog(active_dir)
+    our_version = catalog.current_version()
+    most_recent_downloaded_version = catalog.latest()
 
     if our_version is None:
         return True
@@ -47,11 +43,11 @@ def need_update() -> bool:
 def download_version_if_required() -> str | None:
     while True:
         download_link = downloads.get_latest_download_link()
-        sleep_time = random.random() * 15 * 60  # sleep between 0 and 15 minutes
         if download_link is not None:
             break
-        else:
-            _log.error(f"Failed to retrieve most recent version, trying again in {sleep_time:.2f} seconds...")
+        # the discovery client backs off exponentially (with jitter) per url, wait until one of them may be retried
+        sleep_time = discovery.get_client().next_attempt_in() or discovery.BACKOFF_BASE
+        _log.error(f"Failed to retrieve most recent version, trying again in {sleep_time:.2f} seconds...")
 
         time.sleep(sleep_time)
 
@@ -81,16 +77,22 @@ def download_version_if_required() -> str | None:
         return version
 
 
-def get_most_recent_update_thread():
+def get_most_recent_update_thread(on_update_ready=None, active_dirs: list[str] | None = None):
     """
     Intended to be run in a daemonic thread
 
     Note to self, run this after one manual download_version_if_required() before an attempt to update on first start
 
+    :param on_update_ready: called (from this thread) whenever a check finds a downloaded version we aren't running,
+    e.g. Supervisor.notify_update_ready
+    :param active_dirs: the servers to check, when there are several (see mc.fleet), by default the one active dir
     """
+    governor.maintenance_thread()  # downloads and extracts on this thread
     while True:
         try:
             download_version_if_required()
+            if on_update_ready is not None and any(need_update(d) for d in active_dirs or [None]):
+                on_update_ready()
 
             # check again in 5-40 minutes (to avoid spamming the server, and maybe make it look more human)
             minutes_to_sleep = 60 * 5 * ((random.random() * 3) + 1)
@@ -102,135 +104,471 @@ def get_most_recent_update_thread():
             time.sleep(60 * 5)
 
 
-def try_update() -> bool:
+def _is_immutable_version_file(rel_path: str) -> bool:
     """
-    This function assumes that the server is not running, and that we are in a safe state to update the server.
+    Whether a file in a server version is safe to hardlink from versions/: the binaries, and the vanilla packs and
+    definitions, which are only ever replaced by the next version. Config files at the top level and in config/ are
+    copied, as they are edited in place.
+    """
+    parts = rel_path.replace("\\", "/").split("/")
+    if len(parts) == 1:
+        return rel_path.lower().endswith((".exe", ".dll", ".pdb"))
+    return parts[0] in ("behavior_packs", "resource_packs", "definitions")
+
+
+CONFIG_FILES = [
+    "allowlist.json",
+    "permissions.json",
+    "server.properties",
+]
+
+WORLD_DIRS = [
+    "worlds",
+]
+
+# written into every update backup, what to rebuild the rest of the server from
+UPDATE_BACKUP_MANIFEST = "update_backup.json"
+
 
+def get_path_to_update_backup(our_version: str, new_version: str, active_dir: str | None = None) -> str:
+    # servers other than the default one (see mc.fleet) keep theirs in a folder named after their active dir
+    update_backup_dir = os.path.join(paths.get_path_to_backup_dir(), "updates")
+    instance = paths.get_instance_name(active_dir)
+    if instance is not None:
+        update_backup_dir = os.path.join(update_backup_dir, instance)
+    return os.path.join(update_backup_dir, f"{our_version}_to_{new_version}.zip")
+
+
+def stage_update_backup(our_version: str, new_version: str, path_to_current: str, runtime=None) -> str:
+    """
+    Phase one of the pre-update backup: stage a copy of the state an update carries over (the config files and the
+    worlds), which is all an update backup holds. The server binaries and packs are left out, they are still in
+    versions/<our_version>.
+
+    :param runtime: the running ServerRuntime, if there is one, its world is staged under `save hold`
+    :return: the staging directory, to pass to write_update_backup
+    """
+    active_dir = os.path.dirname(path_to_current)
+    staging_dir = os.path.join(active_dir, ".backup_staging", f"update_{our_version}_to_{new_version}")
+    shutil.rmtree(staging_dir, ignore_errors=True)  # left over from an earlier attempt
+    os.makedirs(staging_dir)
+
+    for file in CONFIG_FILES:
+        src = os.path.join(path_to_current, file)
+        if os.path.exists(src):
+            staging.clone_file(src, os.path.join(staging_dir, file))
+
+    live_world = None
+    if runtime is not None:
+        live_world = runtime.get_current_level_name()
+        runtime.stage_world(os.path.join(staging_dir, "worlds", live_world))
+
+    # anything else in worlds/ isn't being written to, and is cloned as it is (world .ldb files are hardlinked)
+    for dir_ in WORLD_DIRS:
+        src_dir = os.path.join(path_to_current, dir_)
+        if not os.path.isdir(src_dir):
+            continue
+        for entry in os.scandir(src_dir):
+            if entry.is_dir() and not (dir_ == "worlds" and entry.name == live_world):
+                staging.clone_tree(entry.path, os.path.join(staging_dir, dir_, entry.name))
+
+    with open(os.path.join(staging_dir, UPDATE_BACKUP_MANIFEST), "w") as f:
+        json.dump({"source_version": our_version, "target_version": new_version, "created": time.time()}, f)
+    return staging_dir
+
+
+def write_update_backup(our_version: str, new_version: str, staging_dir: str, active_dir: str | None = None) -> str:
+    """
+    Phase two of the pre-update backup: archive the staged copy with the backup codec on all cores, record it in the
+    catalog and delete the staged copy. Doesn't need the server stopped, and is done whether or not the update went
+    through. A backup already written for the same versions (by a failed attempt) is kept, this one gets a -N suffix.
+
+    :param active_dir: the server's active directory, if it isn't the default one
+    :return: the backup file
     """
+    this_update_backup_file = get_path_to_update_backup(our_version, new_version, active_dir)
+    os.makedirs(os.path.dirname(this_update_backup_file), exist_ok=True)
+    # an update that failed and was tried again already archived the copy staged before it touched anything, keep it
+    base, ext = os.path.splitext(this_update_backup_file)
+    attempt = 1
+    while os.path.exists(this_update_backup_file):
+        this_update_backup_file = f"{base}-{attempt}{ext}"
+        attempt += 1
     try:
+        _log.info(f"Backing up current version to: {this_update_backup_file}")
+        codec, level = archive.get_backup_codec()
+        with archive.ArchiveWriter(
+                this_update_backup_file, codec=codec, level=level, workers=archive.get_archive_workers()
+        ) as writer:
+            writer.add_tree(staging_dir)
+        _log.info(f"Backed up {writer.files_written} files ({writer.bytes_in} bytes) to: {this_update_backup_file}")
+        with backup_catalog.BackupCatalog() as catalog:
+            catalog.record(
+                backup_catalog.KIND_UPDATE, this_update_backup_file, instance=paths.get_instance_name(active_dir),
+                size=writer.bytes_out, codec=f"{codec}-{level}" if level is not None else codec,
+                source_version=our_version,
+                checksum=backup_catalog.file_checksum(this_update_backup_file)
+            )
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return this_update_backup_file
+
+
+def write_update_backup_in_background(our_version: str, new_version: str, staging_dir: str,
+                                      active_dir: str | None = None) -> Thread:
+    def write():
+        governor.maintenance_thread()
         try:
-            our_version = paths.get_current_version(fail_on_updating=True)
-        except RuntimeError as e:
-            _log.critical("Server is updating, cannot update...")
-            raise RuntimeError("Server is updating, cannot update...") from e
+            write_update_backup(our_version, new_version, staging_dir, active_dir)
+        except Exception as e:
+            _log.error("Error writing the pre-update backup", exc_info=e)
+
+    # not daemonic, so exiting straight after an update still finishes the backup
+    thread = Thread(target=write, name="update-backup")
+    thread.start()
+    return thread
+
+
+def read_update_backup_manifest(backup_path: str) -> dict | None:
+    """
+    :return: the manifest of an update backup, None for one written before update backups left out the binaries
+    (a zip of the whole of active/current)
+    """
+    with zipfile.ZipFile(backup_path) as zf:
+        try:
+            return json.loads(zf.read(UPDATE_BACKUP_MANIFEST))
+        except KeyError:
+            return None
+
+
+def restore_update_backup(backup_path: str, dst_path: str) -> str | None:
+    """
+    Rebuild the full server tree an update backup was taken from into dst_path (which must not exist): the source
+    version is cloned from versions/, then the backed up config and worlds are extracted over it
+
+    :return: the version the backup was taken from, None for an old full backup whose version isn't known
+    """
+    manifest = read_update_backup_manifest(backup_path)
+    if manifest is None:
+        os.makedirs(dst_path)
+        archive.extract_archive(backup_path, dst_path)
+        return None
+
+    source_version = manifest["source_version"]
+    src_path = os.path.join(paths.get_path_to_versions_dir(), source_version)
+    if not os.path.isdir(src_path):
+        raise RuntimeError(f"Version {source_version} is no longer in {paths.get_path_to_versions_dir()}, cannot "
+                           f"rebuild the server from {backup_path}")
+
+    staging.clone_tree(src_path, dst_path, is_immutable=_is_immutable_version_file)
+    for file in CONFIG_FILES:  # replaced, not written through, in case the filesystem shared it with versions/
+        try:
+            os.remove(os.path.join(dst_path, file))
+        except FileNotFoundError:
+            pass
+    archive.extract_archive(backup_path, dst_path)
+    os.remove(os.path.join(dst_path, UPDATE_BACKUP_MANIFEST))
+    _log.info(f"Restored {backup_path} onto version {source_version} in {dst_path}")
+    return source_version
+
+
+# stop-to-start seconds of the most recent update, see record_update_downtime
+last_update_downtime: float | None = None
+
+
+def get_path_to_update_history() -> str:
+    return os.path.join(paths.get_path_to_data_dir(), "update_history.jsonl")
+
+
+def record_update_downtime(from_version: str | None, to_version: str | None, seconds: float,
+                           instance: str | None = None):
+    """
+    Record how long players were without a server for an update, from the old server being told to stop until the
+    new one reported it had started. Appended to <data dir>/update_history.jsonl, one JSON object per update.
+
+    :param instance: which server, when there are several (see mc.fleet)
+    """
+    global last_update_downtime
+    last_update_downtime = seconds
+    _log.info(f"Update {from_version} -> {to_version}: server was down for {seconds:.2f} seconds")
+    entry = {"at": time.time(), "from": from_version, "to": to_version, "stop_to_start_seconds": round(seconds, 3)}
+    if instance is not None:
+        entry["instance"] = instance
+    try:
+        with open(get_path_to_update_history(), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        _log.warning(f"Could not write update history: {e}")
+
+
+class PreparedUpdate:
+    """
+    A new version laid out in active/<version> next to the running server, returned by prepare_update() and
+    finished by finish_update() once the server has stopped
+    """
 
+    def __init__(self, our_version: str | None, new_version: str, path: str, path_to_current: str,
+                 active_dir: str | None = None):
+        self.our_version = our_version
+        self.new_version = new_version
+        self.path = path
+        self.path_to_current = path_to_current
+        self.active_dir = active_dir  # None for the default one
+        self.config_mtimes: dict[str, float] = {}  # config file -> mtime in current when it was carried over
+        self.seconds = 0.0  # time taken to prepare
+
+    def __repr__(self):
+        return f"PreparedUpdate({self.our_version} -> {self.new_version}, prepared in {self.seconds:.2f}s)"
+
+
+def _copy_config_file(path_to_current: str, dst_path: str, file: str) -> float | None:
+    """
+    :return: the mtime of the copied file, None if current doesn't have it
+    """
+    src = os.path.join(path_to_current, file)
+    dst = os.path.join(dst_path, file)
+    try:
+        mtime = os.stat(src).st_mtime
+    except FileNotFoundError:
+        _log.debug(f"File does not exist, skipping: {src}")
+        return None
+    if os.path.exists(dst):
+        os.remove(dst)
+    shutil.copy(src, dst)
+    return mtime
+
+
+def prepare_update(active_dir: str | None = None) -> PreparedUpdate | None:
+    """
+    Everything in an update that doesn't need the server stopped: clone the newest downloaded version into
+    active/<version> and carry the config files over from current. Safe to call while the server is running.
+
+    :param active_dir: the active directory of the server to update, defaults to paths.get_path_to_active_dir()
+    :return: the prepared update to pass to finish_update(), or None if there is nothing to update to
+    """
+    start = time.perf_counter()
+    try:
+        our_version = paths.get_current_version(fail_on_updating=True, active_dir=active_dir)
+    except RuntimeError as e:
+        _log.critical("Server is updating, cannot update...")
+        raise RuntimeError("Server is updating, cannot update...") from e
+
+    if our_version is None:
+        _log.info("No version found, which probably means this is first start...")
+
+    most_recent_downloaded_version = _get_most_recent_downloaded_version()
+    if most_recent_downloaded_version is None:  # we should have downloaded a version by now
+        _log.error("No versions downloaded, cannot update...")
         if our_version is None:
-            _log.info("No version found, which probably means this is first start...")
-
-        most_recent_downloaded_version = _get_most_recent_downloaded_version()
-        if most_recent_downloaded_version is None:  # we should have downloaded a version by now
-            _log.error("No versions downloaded, cannot update...")
-            if our_version is None:
-                _log.critical("No versions downloaded, and out version is None, which means we are in a bad state...")
-                raise RuntimeError("No versions downloaded, and out version is None, which means we are in a bad state...")
-            return False
+            _log.critical("No versions downloaded, and out version is None, which means we are in a bad state...")
+            raise RuntimeError("No versions downloaded, and out version is None, which means we are in a bad state...")
+        return None
 
-        if our_version == most_recent_downloaded_version:
-            _log.info(f"Server is up to date: {our_version}")
-            return False
+    if our_version == most_recent_downloaded_version:
+        _log.info(f"Server is up to date: {our_version}")
+        return None
+
+    src_path = os.path.join(paths.get_path_to_versions_dir(), most_recent_downloaded_version)
+    dst_path = os.path.join(active_dir or paths.get_path_to_active_dir(), most_recent_downloaded_version)
+    path_to_current = os.path.join(active_dir or paths.get_path_to_active_dir(), "current")
+
+    if our_version:
+        if not os.path.exists(path_to_current):
+            _log.critical(f"Current version does not exist: {path_to_current}")
+            raise RuntimeError(f"Current version does not exist: {path_to_current}")
+
+    if os.path.exists(dst_path):
+        # no .updating_to (checked above), so nothing was handed over to it yet, it is an earlier preparation
+        _log.warning(f"Removing a previously prepared version: {dst_path}")
+        shutil.rmtree(dst_path)
+
+    if not os.path.exists(src_path):
+        _log.critical(f"Source path does not exist, cannot update: {src_path}")
+        raise RuntimeError(f"Source path does not exist, cannot update: {src_path}")
+
+    # step one, the server binaries are never modified in place, so they are reflinked or hardlinked from versions/
+    # rather than copied (anything the server or an admin might edit is still copied)
+    _log.info(f"Cloning {src_path} to {dst_path}")
+    counts = staging.clone_tree(src_path, dst_path, is_immutable=_is_immutable_version_file)
+    _log.info(f"Cloned new version: {counts}")
+
+    prepared = PreparedUpdate(our_version, most_recent_downloaded_version, dst_path, path_to_current, active_dir)
+    if our_version:
+        # step two, copy the config files from the current version to the new version (blowing away the defaults),
+        # finish_update copies them again if they are changed before the server stops
+        for file in CONFIG_FILES:
+            mtime = _copy_config_file(path_to_current, dst_path, file)
+            if mtime is not None:
+                prepared.config_mtimes[file] = mtime
+
+    prepared.seconds = time.perf_counter() - start
+    _log.info(f"Prepared update to {most_recent_downloaded_version} in {prepared.seconds:.2f} seconds")
+    return prepared
+
+
+def finish_update(prepared: PreparedUpdate) -> bool:
+    """
+    The part of an update that needs the server stopped: hand the worlds over to the prepared version and swap it in
+    as current. Only renames, unless active/ spans filesystems.
+
+    :return: True once the new version is current
+    """
+    start = time.perf_counter()
+    our_version = prepared.our_version
+    new_version = prepared.new_version
+    dst_path = prepared.path
+    try:
+        if paths.get_current_version(fail_on_updating=True, active_dir=prepared.active_dir) != our_version:
+            raise RuntimeError(f"Current version changed since the update was prepared, expected {our_version}")
+        if not os.path.isdir(dst_path):
+            raise RuntimeError(f"Prepared version does not exist, cannot update: {dst_path}")
 
         # we are updating! first thing first, we need to create the .updating_to file
-        active_dir = paths.get_path_to_active_dir()
+        active_dir = prepared.active_dir or paths.get_path_to_active_dir()
         updating_to_file = os.path.join(active_dir, ".updating_to")
         with open(updating_to_file, "w") as f:
-            f.write(most_recent_downloaded_version)
-            _log.info(f"Updating to version: {most_recent_downloaded_version}")
+            f.write(new_version)
+            _log.info(f"Updating to version: {new_version}")
 
-        # step one, copy the most recent downloaded version to the active directory
-        src_path = os.path.join(paths.get_path_to_versions_dir(), most_recent_downloaded_version)
-        dst_path = os.path.join(active_dir, most_recent_downloaded_version)
-        path_to_current = os.path.join(active_dir, "current")
+        path_to_current = prepared.path_to_current
+        path_to_retired = os.path.join(active_dir, f".retired_{our_version}")
+        version_file = os.path.join(active_dir, ".version")
+        moved = []  # (src, dst) of each world directory handed over so far
+        retired = promoted = False
+        try:
+            if our_version:
+                # step four, pick up config changes made since the update was prepared, and move the worlds across
+                for file in CONFIG_FILES:
+                    try:
+                        mtime = os.stat(os.path.join(path_to_current, file)).st_mtime
+                    except FileNotFoundError:
+                        continue
+                    if prepared.config_mtimes.get(file) != mtime:
+                        _log.info(f"{file} changed since the update was prepared, copying it again")
+                        _copy_config_file(path_to_current, dst_path, file)
+
+                for dir_ in WORLD_DIRS:
+                    src = os.path.join(path_to_current, dir_)
+                    dst = os.path.join(dst_path, dir_)
+                    if not os.path.exists(src):
+                        _log.debug(f"Directory does not exist, skipping: {src}")
+                        continue
+                    if os.path.exists(dst):
+                        shutil.rmtree(dst)
+                    # moved, not copied (staged for the backup before this), only copied across filesystems
+                    staging.move_tree(src, dst)
+                    moved.append((src, dst))
+                _log.info(f"Copied necessary files from current version to new version")
+
+            # step five, retire the previous version (deleted in the background once the new one is in place)
+            if our_version:
+                shutil.rmtree(path_to_retired, ignore_errors=True)  # left over from an earlier attempt
+                os.rename(path_to_current, path_to_retired)
+                retired = True
+
+            # step six, rename the new version to current
+            os.rename(dst_path, path_to_current)
+            promoted = True
+
+            # step seven, write the .version file
+            with open(version_file, "w") as f:
+                f.write(new_version)
+                _log.info(f"Updated to version: {new_version}")
+
+            # step eight, delete the .updating_to file
+            os.remove(updating_to_file)
+        except Exception:
+            _roll_back_update(prepared, updating_to_file, path_to_retired, moved, retired, promoted)
+            raise
 
         if our_version:
-            if not os.path.exists(path_to_current):
-                _log.critical(f"Current version does not exist: {path_to_current}")
-                raise RuntimeError(f"Current version does not exist: {path_to_current}")
+            Thread(target=shutil.rmtree, args=(path_to_retired,), kwargs={"ignore_errors": True}, daemon=True).start()
+        _log.info(f"Update handover took {time.perf_counter() - start:.2f} seconds")
+    except Exception as e:
+        _log.critical("Unexpected exception during update", exc_info=e)
+        raise e
+    finally:
+        versions.get_catalog(prepared.active_dir).invalidate()  # .version / .updating_to may have changed
 
-        if os.path.exists(dst_path):
-            _log.critical(f"Destination path already exists, cannot update: {dst_path}")
-            raise RuntimeError(f"Destination path already exists, cannot update: {dst_path}")
+    return True
 
-        if not os.path.exists(src_path):
-            _log.critical(f"Source path does not exist, cannot update: {src_path}")
-            raise RuntimeError(f"Source path does not exist, cannot update: {src_path}")
 
-        _log.info(f"Copying {src_path} to {dst_path}")
+def _roll_back_update(prepared: PreparedUpdate, updating_to_file: str, path_to_retired: str,
+                      moved: list[tuple[str, str]], retired: bool, promoted: bool):
+    """
+    Undo a failed finish_update, so the old version is current again with its worlds and the update can be retried.
+    If a step can't be undone, .updating_to is left in place so the server isn't started on a half updated tree.
+    """
+    path_to_current = prepared.path_to_current
+    version_file = os.path.join(os.path.dirname(updating_to_file), ".version")
+    steps = []
+    if promoted:
+        steps.append((f"rename {path_to_current} back to {prepared.path}", os.rename, path_to_current, prepared.path))
+        if prepared.our_version:
+            steps.append((f"write {prepared.our_version} back to {version_file}", _write_version, version_file,
+                          prepared.our_version))
+        else:
+            steps.append((f"remove {version_file}", _remove_if_exists, version_file))
+    if retired:
+        steps.append((f"rename {path_to_retired} back to {path_to_current}", os.rename, path_to_retired,
+                      path_to_current))
+    for src, dst in reversed(moved):
+        steps.append((f"move {dst} back to {src}", staging.move_tree, dst, src))
+    steps.append((f"remove {updating_to_file}", os.remove, updating_to_file))
+
+    _log.critical(f"Update to {prepared.new_version} failed, rolling back to {prepared.our_version}")
+    for description, func, *args in steps:
+        try:
+            func(*args)
+        except Exception as e:
+            _log.critical(f"Could not roll back the update, failed to {description}, fix it by hand: {e}")
+            return
+    _log.critical(f"Rolled back to {prepared.our_version}")
 
-        shutil.copytree(src_path, dst_path)
 
-        # step two, make one full backup of the current version ( if we have one )
-        if our_version:
-            backup_dir = paths.get_path_to_backup_dir()
-            update_backup_dir = os.path.join(backup_dir, f"updates")
-            this_update_backup_file = os.path.join(
-                update_backup_dir,
-                f"{our_version}_to_{most_recent_downloaded_version}.zip"
-            )
-            os.makedirs(update_backup_dir, exist_ok=True)
-
-            _log.info(f"Backing up current version to: {this_update_backup_file}")
-            # back up with high compression
-            with zipfile.ZipFile(
-                    this_update_backup_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=9
-            ) as zip_ref:
-                for root, dirs, files in os.walk(path_to_current):  # noqa  # defined above if we have a current version
-                    for file in files:
-                        src = os.path.join(root, file)
-                        dst = os.path.relpath(src, path_to_current)
-                        zip_ref.write(src, dst)
-
-        # step three, copy the necessary files from the current version to the new version (blowing away any existing files)
-        if our_version:
-            files_to_copy = [
-                "allowlist.json",
-                "permissions.json",
-                "server.properties",
-            ]
-
-            dirs_to_copy = [
-                "worlds",
-            ]
-
-            for file in files_to_copy:
-                src = os.path.join(path_to_current, file)
-                dst = os.path.join(dst_path, file)
-                if not os.path.exists(src):
-                    _log.debug(f"File does not exist, skipping: {src}")
-                    continue
-                if os.path.exists(dst):
-                    os.remove(dst)
-                shutil.copy(src, dst)
-
-            for dir_ in dirs_to_copy:
-                src = os.path.join(path_to_current, dir_)
-                dst = os.path.join(dst_path, dir_)
-                if not os.path.exists(src):
-                    _log.debug(f"Directory does not exist, skipping: {src}")
-                    continue
-                if os.path.exists(dst):
-                    shutil.rmtree(dst)
-                shutil.copytree(src, dst)
-            _log.info(f"Copied necessary files from current version to new version")
-
-        # step four, delete the previous version
-        if our_version:
-            shutil.rmtree(path_to_current)
+def _write_version(version_file: str, version: str):
+    with open(version_file, "w") as f:
+        f.write(version)
 
-        # step five, rename the new version to current
-        os.rename(dst_path, path_to_current)
 
-        # step five, write the .version file
-        version_file = os.path.join(active_dir, ".version")
-        with open(version_file, "w") as f:
-            f.write(most_recent_downloaded_version)
-            _log.info(f"Updated to version: {most_recent_downloaded_version}")
+def _remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
 
-        # step six, delete the .updating_to file
-        os.remove(updating_to_file)
+def try_update(active_dir: str | None = None) -> bool:
+    """
+    This function assumes that the server is not running, and that we are in a safe state to update the server.
+
+    Prepares and finishes the update in one go, the Supervisor instead prepares while the old server still runs.
+
+    :param active_dir: the active directory of the server to update, defaults to paths.get_path_to_active_dir()
+    """
+    start = time.perf_counter()
+    try:
+        prepared = prepare_update(active_dir)
+        if prepared is None:
+            return False
+        # make one backup of the current version ( if we have one ), only the staging has to happen before the handover
+        backup_staging_dir = None
+        if prepared.our_version:
+            backup_staging_dir = stage_update_backup(
+                prepared.our_version, prepared.new_version, prepared.path_to_current
+            )
     except Exception as e:
         _log.critical("Unexpected exception during update", exc_info=e)
         raise e
-
+    try:
+        finish_update(prepared)
+    finally:
+        # archived even if the update failed, it is the copy taken before the worlds were moved
+        if backup_staging_dir is not None:
+            write_update_backup_in_background(
+                prepared.our_version, prepared.new_version, backup_staging_dir, active_dir
+            )
+    _log.info(f"Update took {time.perf_counter() - start:.2f} seconds")
     return True
 
 
@@ -0,0 +1,241 @@
+"""
+Holds the VersionCatalog, an in-memory view of the downloaded server versions and the active version
+
+Versions are ordered numerically (1.21.100.01 is newer than 1.21.30.03), and the catalog is cached so that the once a
+second need_update() check costs no filesystem calls at all. The cache is invalidated explicitly by the code that
+changes things (downloads and updates call invalidate()), and as a backstop for changes made by hand it is revalidated
+at most every REVALIDATE_INTERVAL seconds by comparing directory and file mtimes, rescanning only if they moved.
+
+The scan result is persisted to <data dir>/versions_manifest.json (outside the versions dir, so writing it doesn't move
+the mtime it is validated against), and a restart with nothing changed doesn't rescan either.
+
+When several servers share the versions dir (see mc.fleet), each active dir has its own catalog from
+get_catalog(active_dir), and pruning never deletes a version any of them is running.
+
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from threading import RLock
+from mc import paths
+
+_log = logging.getLogger(__name__)
+
+REVALIDATE_INTERVAL = 60.0  # seconds
+KEEP_VERSIONS = 5
+
+_catalogs: dict[str | None, "VersionCatalog"] = {}  # active dir (None for the default) -> catalog
+
+
+def parse_version(name: str) -> tuple[int, ...] | None:
+    """
+    :return: the version as a tuple of ints for ordering, e.g. "1.21.30.03" -> (1, 21, 30, 3), None if it isn't one
+    """
+    parts = name.split(".")
+    if len(parts) < 2 or not all(part.isdigit() for part in parts):
+        return None
+    return tuple(int(part) for part in parts)
+
+
+def get_path_to_manifest(active_dir: str | None = None) -> str:
+    if active_dir is None:
+        return os.path.join(paths.get_path_to_data_dir(), "versions_manifest.json")
+    return os.path.join(paths.get_path_to_data_dir(), f"versions_manifest_{os.path.basename(active_dir)}.json")
+
+
+def get_catalog(active_dir: str | None = None) -> "VersionCatalog":
+    """
+    :param active_dir: the active directory of the server, defaults to paths.get_path_to_active_dir()
+    """
+    catalog = _catalogs.get(active_dir)
+    if catalog is None:
+        catalog = _catalogs[active_dir] = VersionCatalog(
+            active_dir=active_dir, manifest_path=get_path_to_manifest(active_dir)
+        )
+    return catalog
+
+
+def invalidate_all():
+    """
+    Invalidate every catalog, after changing the versions directory they share
+    """
+    for catalog in list(_catalogs.values()):
+        catalog.invalidate()
+
+
+def versions_in_use() -> set[str]:
+    """
+    :return: the versions every server with a catalog is running or updating to
+    """
+    in_use = set()
+    for catalog in list(_catalogs.values()):
+        in_use |= catalog.in_use()
+    return in_use
+
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class VersionCatalog:
+    """
+    Use the shared one from get_catalog(), so an invalidate() from the download or update path is seen everywhere
+    """
+
+    def __init__(self, versions_dir: str | None = None, active_dir: str | None = None,
+                 manifest_path: str | None = None, revalidate_interval: float = REVALIDATE_INTERVAL):
+        self.versions_dir = versions_dir if versions_dir is not None else paths.get_path_to_versions_dir()
+        self.active_dir = active_dir if active_dir is not None else paths.get_path_to_active_dir()
+        self.manifest_path = manifest_path if manifest_path is not None else get_path_to_manifest()
+        self.revalidate_interval = revalidate_interval
+        self.__lock = RLock()
+
+        self._versions: list[str] = []  # oldest first
+        self._current: str | None = None
+        self._updating_to: str | None = None
+        self._mtimes: tuple = ()
+        self._valid = False
+        self._checked_at = 0.0  # time.monotonic() of the last revalidation
+
+    def _watched_mtimes(self) -> tuple:
+        # adding/removing/renaming a version directory changes the versions dir's mtime, updates rewrite .version and
+        # create/delete .updating_to
+        return (
+            _mtime(self.versions_dir),
+            _mtime(os.path.join(self.active_dir, ".version")),
+            _mtime(os.path.join(self.active_dir, ".updating_to")),
+        )
+
+    def _scan(self, mtimes: tuple):
+        versions = []
+        if os.path.isdir(self.versions_dir):
+            for entry in os.scandir(self.versions_dir):
+                if entry.is_dir() and parse_version(entry.name) is not None:  # skips *_inprogress
+                    versions.append(entry.name)
+        self._versions = sorted(versions, key=parse_version)
+
+        def read(name: str) -> str | None:
+            try:
+                with open(os.path.join(self.active_dir, name), "r") as f:
+                    return f.read().strip()
+            except FileNotFoundError:
+                return None
+
+        self._updating_to = read(".updating_to")
+        self._current = read(".version")
+        self._mtimes = mtimes
+        self._save_manifest()
+
+    def _save_manifest(self):
+        manifest = {
+            "versions": self._versions,
+            "current": self._current,
+            "updating_to": self._updating_to,
+            "mtimes": list(self._mtimes),
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            _log.warning(f"Could not write version manifest: {e}")
+
+    def _load_manifest(self, mtimes: tuple) -> bool:
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if tuple(manifest.get("mtimes", ())) != mtimes:
+            return False
+        self._versions = manifest["versions"]
+        self._current = manifest["current"]
+        self._updating_to = manifest["updating_to"]
+        self._mtimes = mtimes
+        return True
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._valid and now - self._checked_at < self.revalidate_interval:
+            return
+
+        mtimes = self._watched_mtimes()
+        if not self._valid:
+            if not self._load_manifest(mtimes):
+                self._scan(mtimes)
+        elif mtimes != self._mtimes:
+            _log.info("Versions changed on disk, rescanning")
+            self._scan(mtimes)
+        self._valid = True
+        self._checked_at = now
+
+    def invalidate(self):
+        """
+        Call after changing the versions directory or the active version, the next lookup rescans
+        """
+        with self.__lock:
+            self._valid = False
+            try:
+                os.remove(self.manifest_path)
+            except FileNotFoundError:
+                pass
+
+    def versions(self) -> list[str]:
+        """
+        :return: downloaded versions, oldest first
+        """
+        with self.__lock:
+            self._refresh()
+            return list(self._versions)
+
+    def latest(self) -> str | None:
+        with self.__lock:
+            self._refresh()
+            return self._versions[-1] if self._versions else None
+
+    def current_version(self) -> str | None:
+        """
+        Cached paths.get_current_version(): the version being updated to if an update is in progress, otherwise the
+        active version, or None
+        """
+        with self.__lock:
+            self._refresh()
+            return self._updating_to if self._updating_to is not None else self._current
+
+    def is_updating(self) -> bool:
+        with self.__lock:
+            self._refresh()
+            return self._updating_to is not None
+
+    def in_use(self) -> set[str]:
+        """
+        :return: the active version, and the one being updated to
+        """
+        with self.__lock:
+            self._refresh()
+            return {v for v in (self._current, self._updating_to) if v is not None}
+
+    def prune(self, keep: int = KEEP_VERSIONS, pinned: set[str] | None = None) -> list[str]:
+        """
+        Delete all but the newest `keep` downloaded versions (never one a server with a catalog is running)
+
+        :param pinned: versions to keep regardless, e.g. those update backups need to be restored
+        :return: the versions deleted
+        """
+        with self.__lock:
+            self._refresh()
+            in_use = self.in_use() | versions_in_use() | (pinned or set())
+            to_delete = [v for v in self._versions[:-keep] if v not in in_use] if keep > 0 else []
+            for version in to_delete:
+                _log.info(f"Deleting old version: {version}")
+                shutil.rmtree(os.path.join(self.versions_dir, version))
+            if to_delete:
+                invalidate_all()
+            return to_delete
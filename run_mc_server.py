@@ -1,122 +1,15 @@
-import time
-
 import mc
 import os
-from threading import Thread, RLock
+from threading import Thread
 import logging
-import datetime
 import dotenv
 
 dotenv.load_dotenv(".env")
 
 _log = logging.getLogger(__name__)
 
-_current_runtime: mc.ServerRuntime | None = None
-
-
-class ThreadSafeFileLogger(logging.Handler):
-    def __init__(self, level=logging.NOTSET):
-        super().__init__(level)
-        self.lock = RLock()  # noqa
-
-    def emit(self, record):
-        """
-        Emit a record to the file, which will be in the log dir, and will be to the current day
-        """
-        current_time = datetime.datetime.now()
-        log_dir = mc.paths.get_path_to_logs_dir()
-        log_file = os.path.join(log_dir, f"{current_time.strftime('%Y-%m-%d')}.log")
-
-        with self.lock:
-            with open(log_file, "a") as f:
-                f.write(f"{record.asctime} - {record.name} - {record.levelname} - {record.message}\n")
-
-
-def slow_update():
-    # assume we know we need an update and have a runtime
-    global _current_runtime
-
-    if _current_runtime is None:
-        raise RuntimeError("No runtime to update")
-
-    # send a message to the server that we will be updating in 15 minutes
-    _current_runtime.send_command("say Server will be restarting in 15 minutes for an update!")
-
-    # sleep for 10 minutes
-    time.sleep(600)
-
-    # send a message to the server that we will be updating in 5 minutes
-    _current_runtime.send_command("say Server will be restarting in 5 minutes for an update!!")
-
-    # sleep for 4 minutes
-    time.sleep(240)
-
-    # send a message to the server that we will be updating in 1 minute
-    _current_runtime.send_command("say Server will be restarting in 1 minute for an update!!!")
-
-    # sleep for a minute
-    time.sleep(60)
-
-    # send a message to the server that we will be updating now
-    _current_runtime.send_command("say Server is restarting for an update!!!!")
-
-    time.sleep(0.5)
-
-    # stop the server
-    _current_runtime.stop()
-
-    _current_runtime = None
-
-    # update the version
-    update_success = False
-    while not update_success:
-        update_success = mc.update.try_update()
-        if not update_success:
-            _log.critical("Update failed, trying again in 5 seconds...")
-            time.sleep(5)
-
-    # get the path to the executable
-    path_to_exe = mc.paths.get_path_to_minecraft_server_exe()
-
-    # create the runtime
-    _current_runtime = mc.ServerRuntime(path_to_exe)
-
-    # start the runtime
-    _current_runtime.start()
-
-
-def maintain_loop():
-    global _current_runtime
-
-    while True:
-        if _current_runtime is not None:
-            # health check that the server is still running
-            if _current_runtime.process is not None and _current_runtime.process.poll() is not None:
-                _log.critical("Server process has died unceremoniously, restarting after a delay...")
-                try:
-                    _current_runtime.stop()
-                except Exception:  # noqa
-                    pass
-                _current_runtime = None
-
-                path_to_exe = mc.paths.get_path_to_minecraft_server_exe()
-                _current_runtime = mc.ServerRuntime(path_to_exe)
-                time.sleep(5)
-                _current_runtime.start()
-
-            # check if we need to update
-            if mc.update.need_update():
-                slow_update()
-                # at the end of slow_update, we will have a new runtime
-        else:
-            raise RuntimeError("No runtime, cannot continue...")
-
-        time.sleep(1)
-
 
 def main():
-    global _current_runtime
-
     lib_log = logging.getLogger("mc")
     lib_log.setLevel(logging.DEBUG)
 
@@ -133,14 +26,25 @@ def main():
     lib_log.addHandler(ch)
     out_log.addHandler(ch)
     _log.addHandler(ch)
-    # add a file handler to the logs directory
-    fh = ThreadSafeFileLogger()
+    # add a file handler to the logs directory, writes happen on its own thread with the day's file kept open
+    fh = mc.log_handlers.QueuedDailyFileHandler(
+        gzip_old=os.environ.get("MC_LOG_GZIP", "0").replace("'", "").replace('"', "").strip() == "1"
+    )
     fh.setLevel(logging.DEBUG)
+    mc.log_index.LogIndexer().attach(fh.file_handler)  # indexes each batch on the writer thread
     fh.setFormatter(formatter)
     lib_log.addHandler(fh)
     out_log.addHandler(fh)
     _log.addHandler(fh)
 
+    # prometheus /metrics, read from what the supervisors, backups, updates and downloads already keep
+    if mc.metrics.get_metrics_port() is not None:
+        mc.metrics.start_server()
+
+    if mc.fleet.get_instances_from_env():
+        run_fleet(mc.fleet.Fleet.from_env())
+        return
+
     # check if we need to update
     if mc.update.need_update():
         _log.info("Updating server...")
@@ -165,40 +69,100 @@ def main():
                 if not success_update:
                     raise RuntimeError("Update failed, cannot start server")
 
+    # the supervisor starts the server, restarts it the moment it crashes (and at MC_RESTART_CRON), and runs the update
+    # countdown when the update thread says a new version is ready
+    supervisor = mc.supervisor.Supervisor(restart_cron=mc.supervisor.get_restart_cron())
+
     # start a thread to scrape for new updates (decoupled from the actual update process)
-    update_thread = Thread(target=mc.update.get_most_recent_update_thread, daemon=True)
+    update_thread = Thread(
+        target=mc.update.get_most_recent_update_thread,
+        kwargs={"on_update_ready": supervisor.notify_update_ready},
+        daemon=True
+    )
     update_thread.start()
 
-    # get the path to the executable
-    path_to_exe = mc.paths.get_path_to_minecraft_server_exe()
+    # quick enable coordinates
+    supervisor.call_soon(lambda: supervisor.runtime.send_command("gamerule showcoordinates true"))
 
-    # create the runtime
-    _current_runtime = mc.ServerRuntime(path_to_exe)
+    # start the supervisor thread
+    supervisor_thread = Thread(target=supervisor.run, daemon=True)
+    supervisor_thread.start()
 
-    # start the runtime
-    _current_runtime.start()
+    while True:
+        try:
+            command = input()
+            if command == "stop":
+                supervisor.shutdown()
+                supervisor_thread.join()
+                break
+            if command.startswith("restore "):
+                # restore <backup id> [file ...], see python -m mc.restore --list for the ids
+                backup_id, *files = command.split()[1:]
+                supervisor.restore_world(int(backup_id), files=files or None)
+                continue
+            if supervisor.runtime is None:
+                _log.error("Server is not running (restarting or updating), command not sent")
+                continue
+            supervisor.runtime.send_command(command)
+        except Exception as e:
+            _log.error(f"Error writing command: {e}")
+            continue
+        except KeyboardInterrupt as e:
+            _log.info("Exiting...")
+            try:
+                supervisor.shutdown()
+                supervisor_thread.join()
+            except BaseException:  # noqa
+                pass
 
-    # quick enable coordinates
-    _current_runtime.send_command("gamerule showcoordinates true")
+            raise e
 
-    # start the maintain loop thread
-    maintain_thread = Thread(target=maintain_loop, daemon=True)
-    maintain_thread.start()
+
+def run_fleet(fleet: "mc.fleet.Fleet"):
+    """
+    Run every server in MC_INSTANCES from this process, sharing the downloaded versions and the update thread
+    """
+    mc.update.download_version_if_required()
+    fleet.install()
+
+    # one update thread for the whole fleet, the fleet staggers each instance's countdown
+    update_thread = Thread(
+        target=mc.update.get_most_recent_update_thread,
+        kwargs={
+            "on_update_ready": fleet.notify_update_ready,
+            "active_dirs": [instance.active_dir for instance in fleet.instances],
+        },
+        daemon=True
+    )
+    update_thread.start()
+    fleet.start()
 
     while True:
         try:
+            # "<instance>: <command>" goes to that instance, anything else to all of them
             command = input()
-            if command == "stop":
-                _current_runtime.stop()
+            name = None
+            instance_name, sep, rest = command.partition(":")
+            if sep and " " not in instance_name:
+                name, command = instance_name, rest.strip()
+            if command == "stop" and name is None:
+                fleet.shutdown()
                 break
-            _current_runtime.send_command(command)
+            if command.startswith("restore "):
+                if name is None:
+                    _log.error("restore needs an instance, e.g. <instance>: restore <backup id>")
+                    continue
+                backup_id, *files = command.split()[1:]
+                fleet.get(name).supervisor.restore_world(int(backup_id), files=files or None)
+                continue
+            fleet.send_command(command, name)
         except Exception as e:
             _log.error(f"Error writing command: {e}")
             continue
         except KeyboardInterrupt as e:
             _log.info("Exiting...")
             try:
-                _current_runtime.stop()
+                fleet.shutdown()
             except BaseException:  # noqa
                 pass
 